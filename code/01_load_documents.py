@@ -62,6 +62,7 @@ def split_documents(documents, chunk_size=1000, chunk_overlap=200):
         chunk_overlap=chunk_overlap,
         length_function=len,
         separators=["\n\n", "\n", " ", ""],  # Try these separators in order
+        add_start_index=True,  # Record each chunk's offset in its source document
     )
     
     chunks = text_splitter.split_documents(documents)
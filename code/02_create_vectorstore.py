@@ -14,7 +14,6 @@ Key concepts:
 
 import os
 from pathlib import Path
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -26,7 +25,11 @@ os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
 
 # Add parent directory to path for utils
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from utils.api_config import get_api_config, get_embedding_model
+from utils.api_config import (get_api_config, get_embedding_model, get_embedding_provider, create_embeddings,
+                              save_embedding_model)
+from utils.lexical_index import BM25Index
+from utils.metadata_index import MetadataIndex, add_section_metadata
+from utils.source_router import SourceRouter
 
 # Load environment variables
 load_dotenv()
@@ -34,6 +37,11 @@ load_dotenv()
 def check_api_key():
     """Check if API key is set (OpenAI or OpenRouter)."""
     config = get_api_config()
+    embedding_provider = get_embedding_provider()
+    if embedding_provider != "api":
+        # Embeddings are computed in-process; no key needed for this step
+        print(f"[OK] Using {embedding_provider} embeddings (EMBEDDING_PROVIDER={embedding_provider})")
+        return config
     if not config:
         raise ValueError(
             "API key not found! Please set one of:\n"
@@ -73,9 +81,12 @@ def load_and_split_documents():
         chunk_overlap=200,
         length_function=len,
         separators=["\n\n", "\n", " ", ""],
+        add_start_index=True,  # Lets overlapping chunks be merged at query time
     )
     
     chunks = text_splitter.split_documents(documents)
+    # Markdown header path of each chunk, for section filters at query time
+    add_section_metadata(documents, chunks)
     
     print(f"[OK] Loaded and split {len(chunks)} document chunks")
     return chunks
@@ -93,23 +104,15 @@ def create_embeddings_and_vectorstore(chunks, config):
     print("   This may take a moment depending on the number of chunks...")
     
     # Get embedding model name
-    model_name = get_embedding_model(config["provider"])
+    embedding_provider = get_embedding_provider()
+    provider = config["provider"] if embedding_provider == "api" else embedding_provider
+    model_name = get_embedding_model(provider)
     
-    # Initialize embedding model
-    # Supports both OpenAI and OpenRouter (OpenAI-compatible)
-    embedding_kwargs = {
-        "model": model_name,
-        "openai_api_key": config["api_key"]
-    }
-    
-    # Add base_url for OpenRouter
-    if config["base_url"]:
-        embedding_kwargs["openai_api_base"] = config["base_url"]
-    
-    embeddings = OpenAIEmbeddings(**embedding_kwargs)
+    # Uses the shared, connection-pooled HTTP clients (or a local model)
+    embeddings = create_embeddings(config)
     
     print(f"   Using model: {model_name}")
-    print(f"   Provider: {config['provider'].upper()}")
+    print(f"   Provider: {provider.upper()}")
     
     # Create vector store from documents
     # This will:
@@ -128,9 +131,26 @@ def create_embeddings_and_vectorstore(chunks, config):
     # Save vector store to disk
     save_path = str(vectorstore_path)
     vectorstore.save_local(save_path)
+    # Lets the other steps refuse to query it with a different embedding model
+    save_embedding_model(vectorstore_path, config)
     
     print(f"[OK] Vector store saved to: {save_path}")
     
+    # Keyword index over the same chunks, for hybrid (BM25 + vector) retrieval
+    lexical_index = BM25Index.from_vectorstore(vectorstore)
+    lexical_path = lexical_index.save(vectorstore_path)
+    print(f"[OK] BM25 keyword index saved to: {lexical_path} ({len(lexical_index.postings)} terms)")
+    
+    # Source/section index, so filtered searches only score matching chunks
+    metadata_index = MetadataIndex.from_vectorstore(vectorstore)
+    metadata_path = metadata_index.save(vectorstore_path)
+    print(f"[OK] Metadata index saved to: {metadata_path} "
+          f"({len(metadata_index.values('source'))} sources, {len(metadata_index.values('section'))} sections)")
+    
+    # One sub-index and centroid per source, for routing queries to the closest sources
+    router_path = SourceRouter.from_vectorstore(vectorstore, metadata_index).save(vectorstore_path)
+    print(f"[OK] Per-source sub-indexes saved to: {router_path}")
+    
     # Test the vector store with a sample query
     print(f"\nTesting vector store with sample query...")
     test_query = "How do I reset my password?"
@@ -16,7 +16,7 @@ Run this after Step 2 to see what data is stored in the vector database.
 import os
 from pathlib import Path
 from collections import Counter
-from langchain_openai import OpenAIEmbeddings
+import numpy as np
 from langchain_community.vectorstores import FAISS
 from dotenv import load_dotenv
 import sys
@@ -26,7 +26,10 @@ os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
 
 # Add parent directory to path for utils
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from utils.api_config import get_api_config, get_embedding_model
+from utils.api_config import get_api_config, get_embedding_model, create_embeddings, get_embedding_provider, check_embedding_model
+from utils.metadata_index import load_metadata_index
+from utils.source_router import load_source_router
+from utils.retrieval import batch_scored_search, scored_search
 
 # Load environment variables
 load_dotenv()
@@ -43,20 +46,13 @@ def load_vectorstore():
         )
     
     config = get_api_config()
-    if not config:
+    # No LLM calls here, so a key is only needed for API embeddings
+    if not config and get_embedding_provider() == "api":
         raise ValueError("API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
+    check_embedding_model(vectorstore_path, config)
     
-    model_name = get_embedding_model(config["provider"])
-    
-    embedding_kwargs = {
-        "model": model_name,
-        "openai_api_key": config["api_key"]
-    }
-    
-    if config["base_url"]:
-        embedding_kwargs["openai_api_base"] = config["base_url"]
-    
-    embeddings = OpenAIEmbeddings(**embedding_kwargs)
+    # Uses the shared, connection-pooled HTTP clients
+    embeddings = create_embeddings(config)
     
     vectorstore = FAISS.load_local(
         str(vectorstore_path),
@@ -138,10 +134,10 @@ def show_source_breakdown(vectorstore):
         "user guide"
     ]
     
+    # One embedding request and one FAISS search for all queries
     all_sources = []
-    for query in queries:
-        results = vectorstore.similarity_search(query, k=10)
-        for doc in results:
+    for results in batch_scored_search(vectorstore, queries, k=10):
+        for doc, _ in results:
             source = doc.metadata.get('source', 'Unknown')
             all_sources.append(Path(source).name if source != 'Unknown' else 'Unknown')
     
@@ -166,35 +162,88 @@ def demonstrate_similarity_search(vectorstore, embeddings):
         "What is your refund policy?",
     ]
     
-    for query in test_queries:
+    # Perform all similarity searches at once (one embedding request)
+    all_results = batch_scored_search(vectorstore, test_queries, k=3)
+    
+    for query, results in zip(test_queries, all_results):
         print(f"\nQuery: '{query}'")
         print("-" * 80)
         
-        # Perform similarity search
-        results = vectorstore.similarity_search(query, k=3)
-        
         print(f"Found {len(results)} relevant chunks:")
         
-        for i, doc in enumerate(results, 1):
+        for i, (doc, score) in enumerate(results, 1):
             source = Path(doc.metadata.get('source', 'Unknown')).name
             content_preview = doc.page_content[:150].replace('\n', ' ')
             if len(doc.page_content) > 150:
                 content_preview += "..."
             
-            print(f"\n  {i}. Source: {source}")
+            print(f"\n  {i}. Source: {source} (score {score:.3f})")
             print(f"     Preview: {content_preview}")
 
 
+def demonstrate_filtered_search(vectorstore):
+    """Demonstrate searches restricted to one source file or section."""
+    print("\n" + "=" * 80)
+    print("FILTERED SEARCH DEMONSTRATION")
+    print("=" * 80)
+    
+    metadata_index = load_metadata_index(Path("vectorstore"), vectorstore)
+    if metadata_index is None:
+        print("\nNo metadata index found (rerun code/02_create_vectorstore.py to build it)")
+        return
+    
+    print("\nIndexed sources:")
+    for source, count in metadata_index.values("source"):
+        print(f"  {source}: {count} chunks")
+    
+    examples = [
+        ("What does it cost?", {"source": "pricing.md"}),
+        ("How is my data protected?", {"source": ["data_privacy.md", "faq.md"]}),
+    ]
+    for query, metadata_filter in examples:
+        # Only the vectors of matching chunks are scored
+        positions = metadata_index.select(metadata_filter)
+        results = scored_search(vectorstore, query, k=3, positions=positions)
+        
+        print(f"\nQuery: '{query}' with filter {metadata_filter} ({len(positions)} chunks searched)")
+        print("-" * 80)
+        for i, (doc, score) in enumerate(results, 1):
+            source = Path(doc.metadata.get('source', 'Unknown')).name
+            print(f"  {i}. [{score:.3f}] {source} - {doc.metadata.get('section', '')}")
+
+
+def demonstrate_source_routing(vectorstore, embeddings):
+    """Show which sources' sub-indexes a question would be routed to."""
+    print("\n" + "=" * 80)
+    print("SOURCE ROUTING DEMONSTRATION")
+    print("=" * 80)
+    
+    router = load_source_router(Path("vectorstore"), vectorstore)
+    if router is None:
+        print("\nNo per-source sub-indexes found (rerun code/02_create_vectorstore.py to build them)")
+        return
+    
+    print(f"\n{len(router.sources)} sub-indexes; each question is compared with the source centroids")
+    print("and only the closest sources are searched (set RAG_ROUTE_SOURCES to enable in the chatbots).")
+    for query in ["How much does the Professional plan cost?", "My dashboard won't load"]:
+        query_vector = np.array([embeddings.embed_query(query)], dtype=np.float32)
+        routes = ", ".join(f"{router.sources[i]} ({similarity:.2f})" for i, similarity in router.route(query_vector, 3))
+        print(f"\nQuery: '{query}'")
+        print(f"  Closest sources: {routes}")
+
+
 def show_embedding_info(embeddings, config):
     """Show information about embeddings."""
     print("\n" + "=" * 80)
     print("EMBEDDING INFORMATION")
     print("=" * 80)
     
-    model_name = get_embedding_model(config["provider"])
+    embedding_provider = get_embedding_provider()
+    provider = config["provider"] if embedding_provider == "api" else embedding_provider
+    model_name = get_embedding_model(provider)
     
     print(f"\nEmbedding Model: {model_name}")
-    print(f"Provider: {config['provider'].upper()}")
+    print(f"Provider: {provider.upper()}")
     
     # Test embedding to get dimensions
     test_text = "This is a test sentence."
@@ -249,6 +298,12 @@ def main():
         # Demonstrate similarity search
         demonstrate_similarity_search(vectorstore, embeddings)
         
+        # Demonstrate metadata-filtered search
+        demonstrate_filtered_search(vectorstore)
+        
+        # Demonstrate routing to per-source sub-indexes
+        demonstrate_source_routing(vectorstore, embeddings)
+        
         # Summary
         print("\n" + "=" * 80)
         print("SUMMARY")
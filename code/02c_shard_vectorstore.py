@@ -0,0 +1,145 @@
+"""
+Step 2c: Shard the Vector Store
+===============================
+
+Splits the FAISS index from Step 2 into N shards (vectorstore/shards/),
+built in parallel. The retrievers then send each query to all shards at
+once and merge the per-shard top-k lists (scatter-gather), which gives the
+same results as the single index while spreading a large corpus over
+several cores, or over worker processes with RAG_SHARD_WORKERS=processes.
+
+The script also times single-index and sharded search on query vectors
+taken from the index itself (no embedding calls) and checks that all
+modes return the same chunks. On the small tutorial knowledge base a
+single index is faster; sharding pays off with hundreds of thousands of
+chunks.
+
+Run this after Step 2 (and again whenever you rebuild the vector store):
+    python code/02c_shard_vectorstore.py --shards 4
+"""
+
+import os
+import time
+from pathlib import Path
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from dotenv import load_dotenv
+import sys
+
+# Fix OpenMP library conflict on macOS
+os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
+
+# Add parent directory to path for utils
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.api_config import get_api_config, create_embeddings, get_embedding_provider, check_embedding_model
+from utils.sharded_index import build_shards, load_sharded_index
+
+# Load environment variables
+load_dotenv()
+
+VECTORSTORE_PATH = Path("vectorstore")
+
+
+def load_vectorstore():
+    """Load the vector store from disk."""
+    if not VECTORSTORE_PATH.exists():
+        raise FileNotFoundError(
+            f"Vector store not found at {VECTORSTORE_PATH}. "
+            "Please run code/02_create_vectorstore.py first."
+        )
+
+    config = get_api_config()
+    # No LLM calls here, so a key is only needed for API embeddings
+    if not config and get_embedding_provider() == "api":
+        raise ValueError("API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
+    check_embedding_model(VECTORSTORE_PATH, config)
+
+    # Only needed to load the store; the benchmark makes no embedding calls
+    embeddings = create_embeddings(config)
+
+    return FAISS.load_local(
+        str(VECTORSTORE_PATH),
+        embeddings,
+        allow_dangerous_deserialization=True
+    )
+
+
+def time_search(search, queries, k):
+    """Run `search(query, k)` for each (1, d) query; return results and mean latency in ms."""
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(search(query, k)[1][0])
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def benchmark(vectorstore, num_queries, k):
+    """Compare single-index, threaded-shard and worker-process search."""
+    index = vectorstore.index
+    rng = np.random.default_rng(0)
+    picks = rng.integers(0, index.ntotal, size=num_queries)
+    queries = index.reconstruct_batch(picks) + rng.normal(0, 0.01, (num_queries, index.d)).astype(np.float32)
+    queries = [query[None, :] for query in queries]
+
+    reference, latency = time_search(index.search, queries, k)
+    print(f"  {'single index':<20} {latency:8.3f} ms/query")
+
+    for workers in ("threads", "processes"):
+        sharded = load_sharded_index(VECTORSTORE_PATH, vectorstore, workers=workers)
+        try:
+            results, latency = time_search(sharded.search, queries, k)
+        finally:
+            sharded.close()
+        same = all(np.array_equal(a, b) for a, b in zip(reference, results))
+        status = "same results" if same else "[WARNING] results differ"
+        print(f"  {f'shards ({workers})':<20} {latency:8.3f} ms/query  {status}")
+
+
+def main(num_shards=4, num_queries=200, k=10):
+    """Main function to shard the vector store."""
+    print("=" * 80)
+    print("STEP 2c: Sharding the Vector Store")
+    print("=" * 80)
+
+    try:
+        vectorstore = load_vectorstore()
+        print(f"[OK] Vector store loaded: {vectorstore.index.ntotal} vectors")
+
+        start = time.perf_counter()
+        path = build_shards(vectorstore, VECTORSTORE_PATH, num_shards)
+        elapsed = time.perf_counter() - start
+        built = len(list(path.glob("shard-*.faiss")))
+        print(f"[OK] Built {built} shards in parallel in {elapsed:.2f}s: {path}")
+
+        print(f"\nSearch latency ({num_queries} queries, k={k}):")
+        print("-" * 80)
+        benchmark(vectorstore, num_queries, k)
+
+        print("\n" + "=" * 80)
+        print("[OK] Step 2c Complete!")
+        print("=" * 80)
+        print("\nThe retrievers now search the shards in parallel.")
+        print("Set RAG_SHARD_WORKERS=processes for one worker process per shard,")
+        print("or RAG_SHARD_WORKERS=off to use the single index again.")
+
+        return path
+
+    except Exception as e:
+        print(f"\n[ERROR] Error: {e}")
+        print("\nTroubleshooting:")
+        print("- Ensure vector store exists (run Step 2 first)")
+        print("- Check OPENAI_API_KEY or OPENROUTER_API_KEY is set correctly")
+        raise
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Split the vector store into shards searched in parallel")
+    parser.add_argument("--shards", type=int, default=4,
+                        help="Number of shards (at most one per CPU core is useful)")
+    parser.add_argument("--queries", type=int, default=200, help="Queries for the latency benchmark")
+    parser.add_argument("--k", type=int, default=10, help="Results per query")
+    args = parser.parse_args()
+
+    main(args.shards, args.queries, args.k)
@@ -13,7 +13,6 @@ Key concepts:
 
 import os
 from pathlib import Path
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
@@ -26,7 +25,14 @@ os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
 
 # Add parent directory to path for utils
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from utils.api_config import get_api_config, get_embedding_model, get_llm_model
+from utils.api_config import get_api_config, get_llm_model, get_llm_provider, create_embeddings, create_chat_model, check_embedding_model
+from utils.async_rag import DEFAULT_MAX_CONCURRENCY, batch_rag, load_questions
+from utils.context_packer import DEFAULT_CONTEXT_TOKENS, pack_context
+from utils.lexical_index import load_lexical_index
+from utils.metadata_index import load_metadata_index
+from utils.source_router import DEFAULT_ROUTE_SOURCES, load_source_router
+from utils.retrieval import AdaptiveRetriever, HybridRetriever, filter_positions, prefetch_query_embeddings
+from utils.confidence import build_guarded_rag_chain, load_confidence_threshold
 
 # Load environment variables
 load_dotenv()
@@ -45,17 +51,10 @@ def load_vectorstore():
     if not config:
         raise ValueError("API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
     
-    model_name = get_embedding_model(config["provider"])
+    check_embedding_model(vectorstore_path, config)
     
-    embedding_kwargs = {
-        "model": model_name,
-        "openai_api_key": config["api_key"]
-    }
-    
-    if config["base_url"]:
-        embedding_kwargs["openai_api_base"] = config["base_url"]
-    
-    embeddings = OpenAIEmbeddings(**embedding_kwargs)
+    # Uses the shared, connection-pooled HTTP clients
+    embeddings = create_embeddings(config)
     
     vectorstore = FAISS.load_local(
         str(vectorstore_path),
@@ -67,14 +66,51 @@ def load_vectorstore():
     return vectorstore
 
 
-def create_retriever(vectorstore, top_k=5):
+def create_retriever(vectorstore, top_k=5, search_type="similarity", metadata_filter=None,
+                     route_sources=DEFAULT_ROUTE_SOURCES):
     """
     Create a retriever from the vector store.
     
     Args:
         vectorstore: FAISS vector store
-        top_k: Number of relevant chunks to retrieve (increased to get more context)
+        top_k: Number of relevant chunks to retrieve (the maximum in adaptive mode)
+        search_type: "similarity" for a fixed top_k, "adaptive" to over-fetch
+            candidates and keep only those the similarity scores justify, or
+            "hybrid" to fuse vector and BM25 keyword rankings (needs the
+            keyword index from step 2; falls back to adaptive without it)
+        metadata_filter: Only search matching chunks, e.g. {"source": "pricing.md"}
+            (hybrid and adaptive search; needs the metadata index from step 2)
+        route_sources: Without a filter, only search the sub-indexes of this
+            many sources closest to the question (0 searches everything)
     """
+    options = {}
+    if metadata_filter:
+        options = {"metadata_index": load_metadata_index(Path("vectorstore"), vectorstore),
+                     "metadata_filter": metadata_filter}
+        print(f"[OK] Searching only chunks matching {metadata_filter} "
+              f"({len(filter_positions(**options))} chunks)")
+    elif route_sources:
+        router = load_source_router(Path("vectorstore"), vectorstore, n_sources=route_sources)
+        if router is not None:
+            options = {"source_router": router}
+            print(f"[OK] Routing each question to the {route_sources} closest of {len(router.sources)} sources")
+    
+    if search_type == "hybrid":
+        lexical_index = load_lexical_index(Path("vectorstore"), vectorstore)
+        if lexical_index is not None:
+            retriever = HybridRetriever(vectorstore=vectorstore, lexical_index=lexical_index,
+                                        k=top_k, fetch_k=2 * top_k, **options)
+            print(f"[OK] Hybrid retriever created (BM25 + vector results fused by rank, "
+                  f"keeping up to {top_k} chunks; vector-only hits cut by score)")
+            return retriever
+        print("[WARNING] No BM25 keyword index found; using adaptive vector search")
+        search_type = "adaptive"
+    
+    if search_type == "adaptive":
+        retriever = AdaptiveRetriever(vectorstore=vectorstore, max_k=top_k, fetch_k=2 * top_k, **options)
+        print(f"[OK] Adaptive retriever created (retrieving 1-{top_k} chunks by score)")
+        return retriever
+    
     retriever = vectorstore.as_retriever(
         search_type="similarity",
         search_kwargs={"k": top_k}
@@ -108,28 +144,36 @@ Answer:"""
     return prompt
 
 
-def format_docs(docs):
-    """Format retrieved documents for the prompt."""
-    return "\n\n".join(
-        f"Source: {doc.metadata.get('source', 'Unknown')}\nContent: {doc.page_content}"
-        for doc in docs
-    )
-
-
-def build_rag_chain(retriever, prompt_template, llm):
+def build_rag_chain(retriever, prompt_template, llm, max_context_tokens=DEFAULT_CONTEXT_TOKENS,
+                    confidence_threshold=None):
     """
     Build the RAG chain that combines retrieval and generation.
     
     The chain:
     1. Takes a question
     2. Retrieves relevant chunks
-    3. Formats them with the prompt
-    4. Sends to LLM
-    5. Returns the answer
+    3. Packs them into a context block (merging overlaps, within a token budget)
+    4. Formats them with the prompt
+    5. Sends to LLM
+    6. Returns the answer
+    
+    With a `confidence_threshold`, questions whose best chunk scores below it
+    skip steps 3-5 and get a canned "not in the knowledge base" answer. The
+    chain then returns a dict with "answer", "sources", "score" and
+    "low_confidence" instead of a plain string.
     """
+    if confidence_threshold is not None:
+        rag_chain = build_guarded_rag_chain(
+            retriever, prompt_template, llm,
+            threshold=confidence_threshold,
+            format_context=lambda docs: pack_context(docs, max_context_tokens),
+        )
+        print(f"[OK] RAG chain built successfully (confidence threshold {confidence_threshold:.2f})")
+        return rag_chain
+    
     rag_chain = (
         {
-            "context": retriever | format_docs,
+            "context": retriever | (lambda docs: pack_context(docs, max_context_tokens)),
             "question": RunnablePassthrough()
         }
         | prompt_template
@@ -141,31 +185,55 @@ def build_rag_chain(retriever, prompt_template, llm):
     return rag_chain
 
 
-def test_rag_system(rag_chain):
-    """Test the RAG system with sample questions."""
-    test_questions = [
-        "How do I reset my password?",
-        "What are the pricing plans?",
-        "How do I cancel my subscription?",
-    ]
+def test_rag_system(rag_chain, test_questions=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, retriever=None):
+    """
+    Test the RAG system with sample questions.
+    
+    Questions are answered concurrently through the chain's async API
+    (`ainvoke`), at most `max_concurrency` at a time, and printed in order.
+    Given the chain's `retriever`, all questions are embedded up front in
+    one request.
+    """
+    if test_questions is None:
+        test_questions = [
+            "How do I reset my password?",
+            "What are the pricing plans?",
+            "How do I cancel my subscription?",
+        ]
     
     print("\n" + "=" * 80)
     print("Testing RAG System")
     print("=" * 80)
     
-    for i, question in enumerate(test_questions, 1):
-        print(f"\n{i}. Question: {question}")
+    if retriever is not None and prefetch_query_embeddings(retriever, test_questions):
+        print(f"[OK] Embedded {len(test_questions)} questions in one request")
+    
+    results = batch_rag(rag_chain, test_questions, max_concurrency=max_concurrency)
+    
+    for i, result in enumerate(results, 1):
+        print(f"\n{i}. Question: {result['question']}")
         print("-" * 80)
         
-        try:
-            answer = rag_chain.invoke(question)
-            print(f"Answer: {answer}")
-        except Exception as e:
-            print(f"Error: {e}")
+        if result["error"]:
+            print(f"Error: {result['error']}")
+        elif result.get("low_confidence"):
+            print(f"Answer (low confidence, LLM skipped): {result['answer']}")
+        else:
+            print(f"Answer: {result['answer']}")
+        print(f"({result['latency']:.2f}s)")
+    
+    return results
 
 
-def main():
-    """Main function to build the RAG system."""
+def main(questions_path=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, sources=None):
+    """
+    Main function to build the RAG system.
+    
+    Args:
+        questions_path: Optional question set (.txt or .jsonl) to test with
+        max_concurrency: Maximum number of questions answered in parallel
+        sources: Optional knowledge-base file names to restrict retrieval to
+    """
     print("=" * 80)
     print("STEP 3: Building the RAG System")
     print("=" * 80)
@@ -182,7 +250,8 @@ def main():
         vectorstore = load_vectorstore()
         
         # Create retriever
-        retriever = create_retriever(vectorstore, top_k=3)
+        retriever = create_retriever(vectorstore, top_k=5, search_type="hybrid",
+                                     metadata_filter={"source": sources} if sources else None)
         
         # Create prompt template
         prompt_template = create_prompt_template()
@@ -192,26 +261,20 @@ def main():
         if not config:
             raise ValueError("API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
         
-        model_name = get_llm_model(config["provider"])
+        model_name = get_llm_model(get_llm_provider(config))
+        llm = create_chat_model(config, temperature=0.3)  # Slightly higher for more creative/complete answers
         
-        llm_kwargs = {
-            "model": model_name,
-            "temperature": 0.3,  # Slightly higher for more creative/complete answers
-            "openai_api_key": config["api_key"]
-        }
-        
-        if config["base_url"]:
-            llm_kwargs["openai_api_base"] = config["base_url"]
-        
-        llm = ChatOpenAI(**llm_kwargs)
-        
-        print(f"[OK] LLM initialized: {model_name} ({config['provider']})")
+        print(f"[OK] LLM initialized: {model_name} ({get_llm_provider(config)})")
         
         # Build RAG chain
-        rag_chain = build_rag_chain(retriever, prompt_template, llm)
+        rag_chain = build_rag_chain(
+            retriever, prompt_template, llm,
+            confidence_threshold=load_confidence_threshold()
+        )
         
         # Test the system
-        test_rag_system(rag_chain)
+        test_questions = load_questions(questions_path) if questions_path else None
+        test_rag_system(rag_chain, test_questions, max_concurrency=max_concurrency, retriever=retriever)
         
         print("\n" + "=" * 80)
         print("[OK] Step 3 Complete!")
@@ -237,5 +300,15 @@ def main():
 
 
 if __name__ == "__main__":
-    rag_chain = main()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Build and test the RAG system")
+    parser.add_argument("--questions", help="Question set to test with (.txt or .jsonl)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="Maximum number of questions answered in parallel")
+    parser.add_argument("--source", action="append", default=[],
+                        help="Only retrieve from this knowledge-base file (repeatable, e.g. pricing.md)")
+    args = parser.parse_args()
+    
+    rag_chain = main(args.questions, args.concurrency, args.source)
 
@@ -0,0 +1,149 @@
+"""
+Step 3b: Calibrate the Retrieval Confidence Threshold
+=====================================================
+
+The RAG chain skips the LLM entirely when the best retrieved chunk scores
+below a confidence threshold, and answers "not in the knowledge base" instead.
+This script picks that threshold from a labelled question set:
+
+- Questions the knowledge base can answer ("in_kb": true)
+- Off-topic questions it cannot answer ("in_kb": false)
+
+For each question we record the best retrieval score, then choose the
+threshold that best separates the two groups. The result is saved to
+vectorstore/confidence.json, where the chatbots pick it up.
+
+Run this after Step 2 (and again whenever you rebuild the vector store):
+    python code/03b_calibrate_confidence.py
+"""
+
+import os
+import json
+from pathlib import Path
+from langchain_community.vectorstores import FAISS
+from dotenv import load_dotenv
+import sys
+
+# Fix OpenMP library conflict on macOS
+os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
+
+# Add parent directory to path for utils
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.api_config import get_api_config, create_embeddings, get_embedding_provider, check_embedding_model
+from utils.confidence import calibrate_threshold, save_confidence_threshold
+from utils.retrieval import batch_scored_search
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_QUESTIONS_PATH = Path("data/eval/confidence_questions.jsonl")
+
+
+def load_vectorstore():
+    """Load the vector store from disk."""
+    vectorstore_path = Path("vectorstore")
+
+    if not vectorstore_path.exists():
+        raise FileNotFoundError(
+            f"Vector store not found at {vectorstore_path}. "
+            "Please run code/02_create_vectorstore.py first."
+        )
+
+    config = get_api_config()
+    # No LLM calls here, so a key is only needed for API embeddings
+    if not config and get_embedding_provider() == "api":
+        raise ValueError("API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
+    check_embedding_model(vectorstore_path, config)
+
+    # Uses the shared, connection-pooled HTTP clients
+    embeddings = create_embeddings(config)
+
+    vectorstore = FAISS.load_local(
+        str(vectorstore_path),
+        embeddings,
+        allow_dangerous_deserialization=True
+    )
+
+    return vectorstore
+
+
+def load_labelled_questions(path):
+    """Load (question, in_kb) pairs from a JSONL file."""
+    labelled = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                labelled.append((record["question"], bool(record["in_kb"])))
+    return labelled
+
+
+def best_scores(vectorstore, labelled):
+    """Best retrieval relevance score for each labelled question."""
+    # One embedding request and one FAISS search for the whole question set
+    all_results = batch_scored_search(vectorstore, [question for question, _ in labelled], k=1)
+    scored = []
+    for (question, in_kb), results in zip(labelled, all_results):
+        score = results[0][1] if results else 0.0
+        scored.append((question, in_kb, score))
+    return scored
+
+
+def main(questions_path=DEFAULT_QUESTIONS_PATH):
+    """Main function to calibrate the confidence threshold."""
+    print("=" * 80)
+    print("STEP 3b: Calibrating the Retrieval Confidence Threshold")
+    print("=" * 80)
+
+    try:
+        vectorstore = load_vectorstore()
+        print("[OK] Vector store loaded successfully")
+
+        labelled = load_labelled_questions(questions_path)
+        print(f"[OK] Loaded {len(labelled)} labelled questions from {questions_path}")
+
+        scored = best_scores(vectorstore, labelled)
+
+        print("\nBest retrieval score per question:")
+        print("-" * 80)
+        for question, in_kb, score in sorted(scored, key=lambda item: item[2], reverse=True):
+            label = "in KB    " if in_kb else "off-topic"
+            print(f"  {score:.3f}  [{label}]  {question}")
+
+        in_kb_scores = [score for _, in_kb, score in scored if in_kb]
+        off_topic_scores = [score for _, in_kb, score in scored if not in_kb]
+        if not in_kb_scores or not off_topic_scores:
+            raise ValueError("The question set needs both in-KB and off-topic questions")
+
+        threshold, stats = calibrate_threshold(in_kb_scores, off_topic_scores)
+        path = save_confidence_threshold(threshold, stats)
+
+        print("\n" + "=" * 80)
+        print("[OK] Step 3b Complete!")
+        print("=" * 80)
+        print(f"\nThreshold: {threshold:.3f}")
+        print(f"In-KB questions answered:     {stats['in_kb_answered']:.0%}")
+        print(f"Off-topic questions refused:  {stats['off_topic_refused']:.0%}")
+        print(f"Saved to: {path}")
+        print("\nQuestions scoring below the threshold are answered without calling the LLM.")
+
+        return threshold
+
+    except Exception as e:
+        print(f"\n[ERROR] Error: {e}")
+        print("\nTroubleshooting:")
+        print("- Ensure vector store exists (run Step 2 first)")
+        print("- Check OPENAI_API_KEY or OPENROUTER_API_KEY is set correctly")
+        print(f"- Check the labelled question set exists: {questions_path}")
+        raise
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Calibrate the retrieval confidence threshold")
+    parser.add_argument("--questions", default=str(DEFAULT_QUESTIONS_PATH),
+                        help="Labelled question set (JSONL with 'question' and 'in_kb')")
+    args = parser.parse_args()
+
+    main(args.questions)
@@ -13,11 +13,8 @@ Features:
 
 import os
 from pathlib import Path
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 from dotenv import load_dotenv
 import sys
 
@@ -26,7 +23,12 @@ os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
 
 # Add parent directory to path for utils
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from utils.api_config import get_api_config, get_embedding_model, get_llm_model
+from utils.api_config import get_api_config, create_embeddings, create_chat_model, check_embedding_model
+from utils.context_packer import pack_context
+from utils.retrieval import build_retriever
+from utils.confidence import build_guarded_rag_chain, load_confidence_threshold
+from utils.faq_index import FAQIndex, FAQ_PATH, with_faq_answers
+from utils.resilience import DeadlineExceeded, with_deadline
 
 # Load environment variables
 load_dotenv()
@@ -45,17 +47,10 @@ def load_vectorstore():
     if not config:
         raise ValueError("API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
     
-    model_name = get_embedding_model(config["provider"])
+    check_embedding_model(vectorstore_path, config)
     
-    embedding_kwargs = {
-        "model": model_name,
-        "openai_api_key": config["api_key"]
-    }
-    
-    if config["base_url"]:
-        embedding_kwargs["openai_api_base"] = config["base_url"]
-    
-    embeddings = OpenAIEmbeddings(**embedding_kwargs)
+    # Uses the shared, connection-pooled HTTP clients
+    embeddings = create_embeddings(config)
     
     vectorstore = FAISS.load_local(
         str(vectorstore_path),
@@ -66,20 +61,11 @@ def load_vectorstore():
     return vectorstore
 
 
-def format_docs(docs):
-    """Format retrieved documents for the prompt."""
-    return "\n\n".join(
-        f"Source: {doc.metadata.get('source', 'Unknown')}\nContent: {doc.page_content}"
-        for doc in docs
-    )
-
-
 def build_rag_chain(vectorstore):
     """Build the RAG chain."""
-    retriever = vectorstore.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 5}  # Increased to get more context including fun methods
-    )
+    # Up to 5 chunks (to include the fun methods), fewer when scores drop off
+    # (fused with BM25 keyword hits when step 2 saved a keyword index)
+    retriever = build_retriever(vectorstore, max_k=5, fetch_k=10)
     
     prompt_template = ChatPromptTemplate.from_template(
         """You are a helpful customer support assistant for TechCorp.
@@ -103,41 +89,24 @@ Answer:"""
     if not config:
         raise ValueError("API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
     
-    model_name = get_llm_model(config["provider"])
-    
-    llm_kwargs = {
-        "model": model_name,
-        "temperature": 0.3,  # Slightly higher for more complete answers
-        "openai_api_key": config["api_key"]
-    }
+    llm = create_chat_model(config, temperature=0.3)  # Slightly higher for more complete answers
     
-    if config["base_url"]:
-        llm_kwargs["openai_api_base"] = config["base_url"]
-    
-    llm = ChatOpenAI(**llm_kwargs)
-    
-    rag_chain = (
-        {
-            "context": retriever | format_docs,
-            "question": RunnablePassthrough()
-        }
-        | prompt_template
-        | llm
-        | StrOutputParser()
+    # Returns {"answer", "sources", "score", "low_confidence"}; off-topic
+    # questions are answered without calling the LLM
+    rag_chain = build_guarded_rag_chain(
+        retriever, prompt_template, llm,
+        threshold=load_confidence_threshold(),
+        format_context=pack_context
     )
     
-    return rag_chain, retriever
-
-
-def get_sources(retriever, question):
-    """Get source documents for a question."""
-    docs = retriever.get_relevant_documents(question)
-    sources = []
-    for doc in docs:
-        source = doc.metadata.get('source', 'Unknown')
-        source_name = Path(source).name if source != 'Unknown' else 'Unknown'
-        sources.append(source_name)
-    return sources
+    # Near-duplicates of FAQ questions get the curated answer directly
+    if FAQ_PATH.exists():
+        faq_index = FAQIndex.from_markdown(vectorstore.embeddings)
+        rag_chain = with_faq_answers(faq_index, rag_chain, retriever)
+        print(f"[OK] FAQ index built ({len(faq_index.qa_pairs)} questions)")
+    
+    # One deadline per question covers the FAQ lookup, retrieval and the LLM
+    return with_deadline(rag_chain), retriever
 
 
 def main():
@@ -183,17 +152,18 @@ def main():
                     print("Please enter a question.")
                     continue
                 
-                # Get sources
-                print("\nSearching knowledge base...")
-                sources = get_sources(retriever, question)
-                
-                # Get answer
-                print("Generating answer...")
-                answer = rag_chain.invoke(question)
+                # Retrieve and answer (one retrieval serves both answer and sources)
+                print("\nSearching knowledge base and generating answer...")
+                result = rag_chain.invoke(question)
+                answer = result["answer"]
+                sources = result["sources"]
                 
                 # Display answer
                 print("\n" + "=" * 80)
-                print("Answer:")
+                if "faq_question" in result:
+                    print(f"Answer (from FAQ: {result['faq_question']}):")
+                else:
+                    print("Answer:")
                 print("-" * 80)
                 print(answer)
                 print("-" * 80)
@@ -201,7 +171,7 @@ def main():
                 # Display sources
                 if sources:
                     print(f"\nSources:")
-                    for i, source in enumerate(set(sources), 1):
+                    for i, source in enumerate(sources, 1):
                         print(f"   {i}. {source}")
                 
                 print("=" * 80)
@@ -209,6 +179,8 @@ def main():
             except KeyboardInterrupt:
                 print("\n\nThanks for using TechCorp Support Chatbot!")
                 break
+            except DeadlineExceeded as e:
+                print(f"\n[ERROR] {e}. The API may be slow or down; please try again.")
             except Exception as e:
                 print(f"\n[ERROR] Error: {e}")
                 print("Please try again or type 'quit' to exit.")
@@ -60,7 +60,6 @@ except ImportError:
 
 # RAG imports
 try:
-    from langchain_openai import OpenAIEmbeddings, ChatOpenAI
     from langchain_community.vectorstores import FAISS
     from langchain_core.prompts import ChatPromptTemplate
     from langchain_core.output_parsers import StrOutputParser
@@ -70,7 +69,9 @@ try:
     
     # Add parent directory to path for utils
     sys.path.insert(0, str(Path(__file__).parent.parent))
-    from utils.api_config import get_api_config, get_embedding_model, get_llm_model
+    from utils.api_config import get_api_config, create_embeddings, create_chat_model, check_embedding_model
+    from utils.async_rag import batch_rag
+    from utils.context_packer import pack_context
     
     RAG_AVAILABLE = True
 except ImportError:
@@ -154,17 +155,14 @@ def setup_rag_system():
         print("[ERROR] API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
         return None
     
-    model_name = get_embedding_model(config["provider"])
-    
-    embedding_kwargs = {
-        "model": model_name,
-        "openai_api_key": config["api_key"]
-    }
-    
-    if config["base_url"]:
-        embedding_kwargs["openai_api_base"] = config["base_url"]
+    try:
+        check_embedding_model(vectorstore_path, config)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        return None
     
-    embeddings = OpenAIEmbeddings(**embedding_kwargs)
+    # Uses the shared, connection-pooled HTTP clients
+    embeddings = create_embeddings(config)
     
     vectorstore = FAISS.load_local(
         str(vectorstore_path),
@@ -174,9 +172,6 @@ def setup_rag_system():
     
     retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
     
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-    
     prompt_template = ChatPromptTemplate.from_template(
         """You are a helpful customer support assistant for TechCorp.
 Answer based on the provided context.
@@ -196,22 +191,11 @@ Answer:"""
         print("[ERROR] API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
         return None
     
-    model_name = get_llm_model(config["provider"])
-    
-    llm_kwargs = {
-        "model": model_name,
-        "temperature": 0,
-        "openai_api_key": config["api_key"]
-    }
-    
-    if config["base_url"]:
-        llm_kwargs["openai_api_base"] = config["base_url"]
-    
-    llm = ChatOpenAI(**llm_kwargs)
+    llm = create_chat_model(config, temperature=0)
     
     rag_chain = (
         {
-            "context": retriever | format_docs,
+            "context": retriever | pack_context,
             "question": RunnablePassthrough()
         }
         | prompt_template
@@ -285,83 +269,59 @@ def fine_tune_model(model_name="unsloth/tinyllama-bnb-4bit", num_steps=10):
     return model, tokenizer
 
 
-def test_fine_tuned_model_mlx(adapter_path, question):
-    """Test the fine-tuned MLX model."""
+def test_fine_tuned_model_mlx(adapter_path, questions):
+    """
+    Answer questions with the fine-tuned MLX model.
+    
+    The model and adapter are loaded once, in-process (utils/mlx_worker.py),
+    and reused for every question.
+    
+    Returns:
+        List of result dicts (question, answer, error, latency, token counts)
+    """
     if not adapter_path or not Path(adapter_path).exists():
-        return "Fine-tuned adapter not available"
+        return [{"question": q, "answer": None, "error": "Fine-tuned adapter not available"}
+                for q in questions]
+    
+    from utils.mlx_worker import get_mlx_worker
     
+    worker = get_mlx_worker(adapter_path=adapter_path)
     try:
-        import subprocess
-        model_name = "mlx-community/Qwen2.5-1.5B-Instruct-4bit"
-        
-        # Use mlx_lm generate command
-        cmd = [
-            "python", "-m", "mlx_lm", "generate",
-            "--model", model_name,
-            "--adapter-path", adapter_path,
-            "--prompt", question,
-            "--max-tokens", "200",
-            "--temp", "0.7"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0:
-            # Extract response (mlx_lm outputs the full prompt + response)
-            output = result.stdout
-            if "Answer:" in output or "Response:" in output:
-                # Try to extract just the response part
-                lines = output.split("\n")
-                response_lines = []
-                capturing = False
-                for line in lines:
-                    if "Answer:" in line or "Response:" in line:
-                        capturing = True
-                        response_lines.append(line.split(":")[-1].strip())
-                    elif capturing and line.strip():
-                        response_lines.append(line.strip())
-                
-                if response_lines:
-                    return " ".join(response_lines)
-            return output[-500:] if len(output) > 500 else output  # Last 500 chars
-        else:
-            return f"Error: {result.stderr}"
+        worker.load()
     except Exception as e:
-        return f"Error testing fine-tuned model: {str(e)}"
+        return [{"question": q, "answer": None, "error": f"Error loading fine-tuned model: {e}"}
+                for q in questions]
+    print(f"[OK] Fine-tuned model loaded in {worker.load_seconds:.1f}s")
+    return worker.generate_batch(questions, max_tokens=200, temperature=0.7)
 
 
 def test_fine_tuned_model(model, tokenizer, question):
     """Test the fine-tuned model (Unsloth version)."""
+    return test_fine_tuned_model_batch(model, tokenizer, [question])[0]
+
+
+def test_fine_tuned_model_batch(model, tokenizer, questions, batch_size=8):
+    """
+    Answer several questions with the fine-tuned model (Unsloth version).
+    
+    Prompts are left-padded and generated `batch_size` at a time
+    (utils/batch_generation.py), each stopping on its own.
+    
+    Returns:
+        List of answers, in the order of `questions`
+    """
     if model is None or tokenizer is None:
-        return "Fine-tuned model not available"
+        return ["Fine-tuned model not available"] * len(questions)
     
     try:
-        import torch
-        # Format prompt
-        prompt = f"### Instruction:\n{question}\n\n### Response:\n"
-        
-        inputs = tokenizer(prompt, return_tensors="pt").to("cuda" if torch.cuda.is_available() else "cpu")
-        
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=200,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
-        )
-        
-        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # Extract just the response part
-        if "### Response:" in response:
-            response = response.split("### Response:")[-1].strip()
-        
-        return response
+        from utils.batch_generation import generate_batch
+        return generate_batch(model, tokenizer, questions, batch_size=batch_size,
+                              max_new_tokens=200, temperature=0.7, top_p=0.9)
     except Exception as e:
-        return f"Error: {str(e)}"
+        return [f"Error: {str(e)}"] * len(questions)
 
 
-def compare_approaches():
+def compare_approaches(max_concurrency=None):
     """Compare RAG vs Fine-Tuning on the same questions."""
     
     test_questions = [
@@ -432,23 +392,34 @@ def compare_approaches():
         print("\n[OK] RAG system ready!")
         print("\nTesting RAG on sample questions:\n")
         
-        for i, question in enumerate(test_questions, 1):
+        # Answer all questions concurrently through the async chain API
+        rag_results = batch_rag(rag_chain, test_questions, max_concurrency=max_concurrency)
+        
+        # Fine-tuned answers (MLX): one model load for all questions
+        ft_results = [None] * len(test_questions)
+        if fine_tuned_adapter_path and APPLE_SILICON:
+            print("[INFO] Loading fine-tuned model...")
+            ft_results = test_fine_tuned_model_mlx(fine_tuned_adapter_path, test_questions)
+            print()
+        
+        for i, (question, rag_result, ft_result) in enumerate(
+            zip(test_questions, rag_results, ft_results), 1
+        ):
             print(f"{i}. Question: {question}")
             print("-" * 80)
-            try:
-                answer = rag_chain.invoke(question)
-                print(f"   RAG Answer: {answer[:300]}...")
-            except Exception as e:
-                print(f"   Error: {e}")
+            if rag_result["error"]:
+                print(f"   Error: {rag_result['error']}")
+            else:
+                print(f"   RAG Answer: {rag_result['answer'][:300]}...")
             
-            # Test fine-tuned model if available (MLX)
-            if fine_tuned_adapter_path and APPLE_SILICON:
+            # Fine-tuned model answer if available (MLX)
+            if ft_result is not None:
                 print("\n   Fine-Tuned Model (MLX) Answer:")
-                try:
-                    ft_answer = test_fine_tuned_model_mlx(fine_tuned_adapter_path, question)
-                    print(f"   {ft_answer[:300]}...")
-                except Exception as e:
-                    print(f"   Error: {e}")
+                if ft_result["error"]:
+                    print(f"   Error: {ft_result['error']}")
+                else:
+                    print(f"   {ft_result['answer'][:300]}...")
+                    print(f"   ({ft_result['completion_tokens']} tokens in {ft_result['latency']:.1f}s)")
             
             print()
     else:
@@ -0,0 +1,363 @@
+"""
+Step 5b: Evaluate RAG vs Fine-Tuning on a Question Set
+======================================================
+
+Runs the RAG chain and the fine-tuned model over the same questions, scores
+every answer against a reference answer, and writes a report:
+
+- Questions: data/training/valid.jsonl and the FAQ (knowledge_base/faq.md)
+  by default; any JSONL with question/answer fields works too
+- Scores: token F1, ROUGE-L and embedding similarity to the reference
+- Per system: latency percentiles, token counts and API cost
+
+The RAG questions run concurrently against the API while the fine-tuned
+model generates in batches, and both systems run at the same time. Hundreds
+of questions take minutes.
+
+Fine-tuned backends (--finetuned, default auto):
+- mlx: base model + adapters/techcorp-support with MLX (Apple Silicon)
+- local: the exported model in models/ on CPU (utils/local_llm.py)
+- hf: any Hugging Face / Unsloth checkpoint directory (--model-path)
+
+Run with:
+    python code/05b_evaluate_rag_vs_finetuning.py
+"""
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Fix OpenMP library conflict on macOS
+os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
+
+# Add parent directory to path for utils
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.api_config import get_api_config, create_embeddings, create_chat_model, check_embedding_model
+from utils.async_rag import run_async
+from utils.evaluation import (
+    PRICE_INPUT, PRICE_OUTPUT, aevaluate_rag, build_report, load_eval_set,
+    score_results, summarize, write_report,
+)
+
+load_dotenv()
+
+DEFAULT_QUESTION_SETS = [Path("data/training/valid.jsonl"), Path("knowledge_base/faq.md")]
+DEFAULT_OUTPUT = Path("reports/rag_vs_finetuning")
+DEFAULT_ADAPTER_PATH = Path("adapters/techcorp-support")
+
+
+# ---------------------------------------------------------------------------
+# RAG system
+# ---------------------------------------------------------------------------
+
+def build_rag_chain(config):
+    """
+    The guarded RAG chain used by the chatbots (without the FAQ shortcut).
+
+    Returns:
+        (chain, retriever)
+    """
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.prompts import ChatPromptTemplate
+    from utils.confidence import build_guarded_rag_chain, load_confidence_threshold
+    from utils.context_packer import pack_context
+    from utils.retrieval import build_retriever
+
+    vectorstore_path = Path("vectorstore")
+    if not vectorstore_path.exists():
+        raise FileNotFoundError(
+            f"Vector store not found at {vectorstore_path}. "
+            "Please run code/02_create_vectorstore.py first."
+        )
+
+    check_embedding_model(vectorstore_path, config)
+    vectorstore = FAISS.load_local(
+        str(vectorstore_path),
+        create_embeddings(config),
+        allow_dangerous_deserialization=True
+    )
+    retriever = build_retriever(vectorstore, str(vectorstore_path), max_k=5, fetch_k=10)
+
+    prompt_template = ChatPromptTemplate.from_template(
+        """You are a helpful customer support assistant for TechCorp.
+Your job is to answer customer questions based on the provided context.
+
+Use the following pieces of context to answer the question.
+If you don't know the answer based on the context, just say that you don't know.
+Don't make up information. Be concise and helpful.
+
+IMPORTANT: The context contains our official company policies and procedures. Always use these official methods as the primary answer. These are our established procedures, not alternatives - they represent how TechCorp actually operates.
+
+Context:
+{context}
+
+Question: {question}
+
+Answer:"""
+    )
+
+    # The FAQ answers are references here, so no FAQ index: every question
+    # goes through retrieval and the LLM
+    llm = create_chat_model(config, temperature=0)
+    rag_chain = build_guarded_rag_chain(
+        retriever, prompt_template, llm,
+        threshold=load_confidence_threshold(),
+        format_context=pack_context
+    )
+    return rag_chain, retriever
+
+
+def run_rag(rag_chain, questions, max_concurrency, retriever=None):
+    from utils.retrieval import prefetch_query_embeddings
+
+    start = time.perf_counter()
+    # One embedding request for the whole question set instead of one per question
+    if retriever is not None:
+        prefetch_query_embeddings(retriever, questions)
+    results = run_async(aevaluate_rag(rag_chain, questions, max_concurrency))
+    return list(results), time.perf_counter() - start
+
+
+# ---------------------------------------------------------------------------
+# Fine-tuned model backends
+# ---------------------------------------------------------------------------
+
+def detect_backend(adapter_path):
+    """Pick the fine-tuned backend available on this machine."""
+    import platform
+
+    if platform.system() == "Darwin" and platform.machine() == "arm64" and Path(adapter_path).exists():
+        try:
+            import mlx_lm  # noqa: F401
+            return "mlx"
+        except ImportError:
+            pass
+    try:
+        import torch  # noqa: F401
+        from utils.local_llm import LOCAL_MODEL_PATH
+    except ImportError:
+        return None
+    if any(LOCAL_MODEL_PATH.glob("*.safetensors")):
+        return "local"
+    return None
+
+
+def run_mlx(questions, args):
+    from utils.mlx_worker import get_mlx_worker
+
+    worker = get_mlx_worker(adapter_path=args.adapter)
+    worker.load()
+    print(f"[OK] MLX model loaded in {worker.load_seconds:.1f}s")
+    return worker.generate_batch(questions, max_tokens=args.max_tokens, temperature=0.0)
+
+
+def run_local(questions, args):
+    """Continuous batching on the CPU model (utils/local_server.BatchScheduler)."""
+    from utils.local_llm import load_local_model
+    from utils.local_server import BatchScheduler
+    from utils.mlx_worker import PROMPT_TEMPLATE, extract_response
+
+    local_model = load_local_model(args.model_path) if args.model_path else load_local_model()
+    adapter = local_model.load_adapter(args.adapter) if args.local_adapter else None
+    scheduler = BatchScheduler(local_model, max_batch_size=args.batch_size)
+    print(f"[OK] Local model loaded: {local_model.path}")
+
+    def answer(question):
+        prompt_ids = local_model.tokenizer.encode(PROMPT_TEMPLATE.format(question=question))
+        start = time.perf_counter()
+        request = scheduler.submit(prompt_ids, max_new_tokens=args.max_tokens, temperature=0.0,
+                                   stop=["###"], adapter=adapter)
+        result = {"question": question, "answer": None, "error": None,
+                  "prompt_tokens": len(prompt_ids)}
+        try:
+            result["answer"] = extract_response(request.text())
+        except RuntimeError as e:
+            result["error"] = str(e)
+        result["completion_tokens"] = request.completion_tokens
+        result["latency"] = time.perf_counter() - start
+        return result
+
+    # One waiting thread per batch slot keeps the batch full
+    with ThreadPoolExecutor(max_workers=args.batch_size) as pool:
+        return list(pool.map(answer, questions))
+
+
+def run_hf(questions, args):
+    """Left-padded batched generate() on a Hugging Face / Unsloth checkpoint."""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from utils.batch_generation import generate_batch
+    from utils.mlx_worker import PROMPT_TEMPLATE
+
+    if not args.model_path:
+        raise ValueError("--finetuned hf needs --model-path")
+    tokenizer = AutoTokenizer.from_pretrained(args.model_path)
+    model = AutoModelForCausalLM.from_pretrained(args.model_path, torch_dtype="auto")
+    model.eval()
+    print(f"[OK] Model loaded: {args.model_path}")
+
+    results = []
+    for start in range(0, len(questions), args.batch_size):
+        batch = questions[start:start + args.batch_size]
+        batch_start = time.perf_counter()
+        answers = generate_batch(model, tokenizer, batch, batch_size=args.batch_size,
+                                 max_new_tokens=args.max_tokens, temperature=0.0)
+        latency = time.perf_counter() - batch_start
+        for question, answer in zip(batch, answers):
+            results.append({
+                "question": question, "answer": answer, "error": None, "latency": latency,
+                "prompt_tokens": len(tokenizer.encode(PROMPT_TEMPLATE.format(question=question))),
+                "completion_tokens": len(tokenizer.encode(answer, add_special_tokens=False)),
+            })
+    return results
+
+
+BACKENDS = {"mlx": run_mlx, "local": run_local, "hf": run_hf}
+
+
+def run_finetuned(backend, questions, args):
+    start = time.perf_counter()
+    results = BACKENDS[backend](questions, args)
+    return results, time.perf_counter() - start
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def print_summary(summaries):
+    systems = list(summaries)
+    print(f"{'':<24}" + "".join(f"{system:>16}" for system in systems))
+    rows = [("Token F1", "token_f1", "{:.3f}"), ("ROUGE-L", "rouge_l", "{:.3f}"),
+            ("Embedding similarity", "embedding_similarity", "{:.3f}"), ("Errors", "errors", "{}"),
+            ("Latency p50 (s)", "latency_p50", "{:.2f}"), ("Latency p90 (s)", "latency_p90", "{:.2f}"),
+            ("Latency p99 (s)", "latency_p99", "{:.2f}"), ("Completion tokens", "completion_tokens", "{}"),
+            ("Cost (USD)", "cost_usd", "{:.4f}"), ("Wall time (s)", "wall_seconds", "{:.1f}")]
+    for label, key, fmt in rows:
+        values = [summaries[system].get(key) for system in systems]
+        print(f"{label:<24}" + "".join(
+            f"{(fmt.format(value) if value is not None else '-'):>16}" for value in values
+        ))
+
+
+def main(args):
+    """Main function to evaluate RAG and the fine-tuned model."""
+    print("=" * 80)
+    print("STEP 5b: Evaluating RAG vs Fine-Tuning")
+    print("=" * 80)
+    print()
+
+    question_sets = [Path(path) for path in args.questions]
+    missing = [path for path in question_sets if not path.exists()]
+    if missing:
+        print(f"[ERROR] Question set not found: {', '.join(map(str, missing))}")
+        return
+    items = load_eval_set(question_sets)
+    if args.limit:
+        items = items[:args.limit]
+    questions = [item["question"] for item in items]
+    references = [item["reference"] for item in items]
+    print(f"[OK] Loaded {len(items)} questions with reference answers")
+
+    config = get_api_config()
+    rag_chain = rag_retriever = None
+    if args.skip_rag:
+        print("[INFO] Skipping RAG (--skip-rag)")
+    elif not config:
+        print("[WARNING] API key not found; skipping RAG. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
+    else:
+        try:
+            rag_chain, rag_retriever = build_rag_chain(config)
+            print(f"[OK] RAG chain ready ({config['provider'].upper()})")
+        except FileNotFoundError as e:
+            print(f"[WARNING] {e}")
+
+    backend = detect_backend(args.adapter) if args.finetuned == "auto" else args.finetuned
+    if backend == "none":
+        backend = None
+    if backend:
+        print(f"[OK] Fine-tuned backend: {backend}")
+    else:
+        print("[INFO] No fine-tuned model available (see --finetuned); evaluating RAG only")
+
+    if rag_chain is None and backend is None:
+        print("[ERROR] Nothing to evaluate")
+        return
+
+    # Both systems at once: RAG waits on the API while the local model computes
+    print(f"\n[INFO] Answering {len(questions)} questions...")
+    results, walls = {}, {}
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = {}
+        if rag_chain is not None:
+            futures["rag"] = pool.submit(run_rag, rag_chain, questions, args.max_concurrency, rag_retriever)
+        if backend:
+            futures["fine_tuned"] = pool.submit(run_finetuned, backend, questions, args)
+        for system, future in futures.items():
+            try:
+                results[system], walls[system] = future.result()
+                print(f"[OK] {system}: {len(results[system])} answers in {walls[system]:.1f}s")
+            except Exception as e:
+                print(f"[ERROR] {system} failed: {e}")
+
+    if not results:
+        return
+
+    embeddings = None
+    if config and not args.no_embeddings:
+        embeddings = create_embeddings(config)
+    summaries = {}
+    for system, system_results in results.items():
+        try:
+            score_results(system_results, references, embeddings)
+        except Exception as e:
+            print(f"[WARNING] Embedding similarity unavailable: {e}")
+            score_results(system_results, references)
+        prices = (args.price_input, args.price_output) if system == "rag" else (0.0, 0.0)
+        summaries[system] = summarize(system_results, *prices, wall_seconds=walls[system])
+
+    report = build_report(items, results, summaries, question_sets)
+    json_path, md_path = write_report(report, args.output)
+
+    print()
+    print("=" * 80)
+    print("[OK] Step 5b Complete!")
+    print("=" * 80)
+    print()
+    print_summary(summaries)
+    print()
+    print(f"Report: {md_path}")
+    print(f"Details: {json_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate RAG vs the fine-tuned model on a question set")
+    parser.add_argument("--questions", nargs="+", default=[str(path) for path in DEFAULT_QUESTION_SETS],
+                        help="Question sets with reference answers (JSONL or FAQ markdown)")
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N questions")
+    parser.add_argument("--output", default=str(DEFAULT_OUTPUT),
+                        help="Report path prefix (.json and .md are written)")
+    parser.add_argument("--finetuned", default="auto", choices=["auto", "mlx", "local", "hf", "none"])
+    parser.add_argument("--adapter", default=str(DEFAULT_ADAPTER_PATH),
+                        help="LoRA adapter for the mlx backend")
+    parser.add_argument("--local-adapter", action="store_true",
+                        help="Also apply --adapter on the local backend (for a base model, not the fused export)")
+    parser.add_argument("--model-path", default=None,
+                        help="Model directory for the local / hf backends")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="Fine-tuned model prompts generated together")
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--max-concurrency", type=int, default=None,
+                        help="RAG questions in flight at once (default: RAG_MAX_CONCURRENCY or 8)")
+    parser.add_argument("--skip-rag", action="store_true")
+    parser.add_argument("--no-embeddings", action="store_true",
+                        help="Skip the embedding similarity metric (no embedding API calls)")
+    parser.add_argument("--price-input", type=float, default=PRICE_INPUT,
+                        help="USD per million prompt tokens for the RAG model")
+    parser.add_argument("--price-output", type=float, default=PRICE_OUTPUT,
+                        help="USD per million completion tokens for the RAG model")
+
+    main(parser.parse_args())
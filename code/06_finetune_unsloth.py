@@ -12,11 +12,16 @@ Requirements:
 """
 
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Add parent directory to path for utils
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.batch_generation import generate_batch
+
 try:
     from unsloth import FastLanguageModel
     from transformers import TrainingArguments
@@ -210,26 +215,12 @@ def main():
             "What are the pricing plans?",
         ]
         
-        for question in test_questions:
+        # All test questions in one left-padded batch
+        answers = generate_batch(model, tokenizer, test_questions,
+                                 max_new_tokens=150, temperature=0.7, top_p=0.9)
+        
+        for question, response in zip(test_questions, answers):
             print(f"\nQuestion: {question}")
-            prompt = f"### Instruction:\n{question}\n\n### Response:\n"
-            
-            inputs = tokenizer(prompt, return_tensors="pt").to("cuda")
-            
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=150,
-                temperature=0.7,
-                top_p=0.9,
-                do_sample=True,
-            )
-            
-            response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # Extract response
-            if "### Response:" in response:
-                response = response.split("### Response:")[-1].strip()
-            
             print(f"Answer: {response}")
         
         print("\n" + "="*80)
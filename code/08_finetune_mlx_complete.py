@@ -31,6 +31,11 @@ from dotenv import load_dotenv
 # Fix OpenMP library conflict on macOS
 os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
 
+# Add parent directory to path for utils
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.faq_index import parse_faq
+from utils.mlx_worker import MLXGenerationWorker
+
 load_dotenv()
 
 # Check if running on Apple Silicon
@@ -62,40 +67,14 @@ def extract_qa_from_knowledge_base():
     # Extract Q&A pairs from markdown files
     qa_pairs = []
     
-    # Read FAQ file
+    # Read FAQ file ("###" headers are questions, followed by their answers)
     faq_path = knowledge_base_path / "faq.md"
     if faq_path.exists():
-        with open(faq_path, "r") as f:
-            content = f.read()
-            
-        # Extract Q&A pairs from FAQ format
-        # Look for "###" headers (questions) followed by content (answers)
-        lines = content.split("\n")
-        current_question = None
-        current_answer = []
-        
-        for line in lines:
-            if line.startswith("###"):
-                if current_question and current_answer:
-                    answer = "\n".join(current_answer).strip()
-                    if answer:
-                        qa_pairs.append({
-                            "instruction": current_question,
-                            "output": answer
-                        })
-                current_question = line.replace("###", "").strip()
-                current_answer = []
-            elif current_question and line.strip():
-                current_answer.append(line)
-        
-        # Add last Q&A pair
-        if current_question and current_answer:
-            answer = "\n".join(current_answer).strip()
-            if answer:
-                qa_pairs.append({
-                    "instruction": current_question,
-                    "output": answer
-                })
+        for qa in parse_faq(faq_path):
+            qa_pairs.append({
+                "instruction": qa["question"],
+                "output": qa["answer"]
+            })
     
     # Add specific Q&A pairs from knowledge base (using official company policy)
     training_data = [
@@ -368,56 +347,25 @@ def test_fine_tuned_model(model_name, adapter_path, test_prompts):
         print("[INFO] Run fine-tuning first!")
         return
     
-    for prompt in test_prompts:
-        print(f"Question: {prompt}")
+    # Load the model and adapter once for all prompts
+    worker = MLXGenerationWorker(model_name, adapter_path)
+    try:
+        worker.load()
+    except Exception as e:
+        print(f"[ERROR] Error loading model: {e}")
+        return
+    print(f"[OK] Model loaded in {worker.load_seconds:.1f}s")
+    print()
+    
+    for result in worker.generate_batch(test_prompts, max_tokens=200, temperature=0.3):
+        print(f"Question: {result['question']}")
         print("-" * 80)
-        
-        cmd = [
-            sys.executable, "-m", "mlx_lm", "generate",
-            "--model", model_name,
-            "--adapter-path", adapter_path,
-            "--prompt", prompt,
-            "--max-tokens", "200",
-            "--temp", "0.3"
-        ]
-        
-        try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-            
-            if result.returncode == 0:
-                # Extract the generated text (skip the prompt)
-                output = result.stdout
-                if "Response:" in output or "### Response:" in output:
-                    # Try to extract just the response
-                    lines = output.split("\n")
-                    in_response = False
-                    response_lines = []
-                    for line in lines:
-                        if "Response:" in line or "### Response:" in line:
-                            in_response = True
-                            response_lines.append(line.split("Response:")[-1].strip())
-                        elif in_response and line.strip():
-                            response_lines.append(line.strip())
-                    
-                    if response_lines:
-                        print("\n".join(response_lines))
-                    else:
-                        print(output)
-                else:
-                    print(output)
-            else:
-                print(f"[ERROR] Generation failed: {result.stderr}")
-            
-            print()
-            
-        except Exception as e:
-            print(f"[ERROR] Error testing model: {e}")
-            print()
+        if result["error"]:
+            print(f"[ERROR] Generation failed: {result['error']}")
+        else:
+            print(result["answer"])
+            print(f"({result['completion_tokens']} tokens in {result['latency']:.1f}s)")
+        print()
 
 
 def main():
@@ -0,0 +1,187 @@
+"""
+Quantize the Local Model for Faster CPU Inference
+==================================================
+
+Writes int8 (or 4-bit group-quantized) weights next to the exported model
+(model.int8.safetensors / model.int4.safetensors) and compares them with the
+original weights:
+- Perplexity on the fine-tuning validation set (data/training/valid.jsonl)
+- Prefill and decode speed in tokens/sec
+
+CPU decoding reads every weight once per token, so smaller weights mean
+faster generation and less RAM. Use the result with:
+    LOCAL_LLM_QUANT=int8 (or int4)
+
+Requirements:
+- pip install torch transformers safetensors
+- Model weights (from code/09_export_model_for_lmstudio.py)
+
+Run with:
+    python code/09b_quantize_local_model.py --bits 8
+"""
+
+import os
+import gc
+import sys
+import json
+import math
+import time
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Fix OpenMP library conflict on macOS
+os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
+
+# Add parent directory to path for utils
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+VALID_PATH = Path("data/training/valid.jsonl")
+
+BENCHMARK_QUESTION = "How do I reset my password?"
+
+
+def load_validation_texts(path=VALID_PATH):
+    """Texts of the fine-tuning validation set"""
+    texts = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                texts.append(json.loads(line)["text"])
+    return texts
+
+
+def perplexity(local_model, texts):
+    """Token-level perplexity of the model over the texts"""
+    import torch
+    import torch.nn.functional as F
+
+    total_loss, total_tokens = 0.0, 0
+    with torch.inference_mode():
+        for text in texts:
+            ids = local_model.tokenizer.encode(text)
+            if len(ids) < 2:
+                continue
+            logits = local_model.model(torch.tensor([ids]))[0, :-1].float()
+            targets = torch.tensor(ids[1:])
+            total_loss += F.cross_entropy(logits, targets, reduction="sum").item()
+            total_tokens += len(targets)
+    return math.exp(total_loss / max(total_tokens, 1))
+
+
+def throughput(local_model, max_new_tokens):
+    """Prefill and greedy decode speed (tokens/sec) on a chat prompt"""
+    import torch
+
+    prompt_ids = local_model.encode_chat([{"role": "user", "content": BENCHMARK_QUESTION}])
+
+    with torch.inference_mode():
+        start = time.perf_counter()
+        local_model.model(torch.tensor([prompt_ids]), local_model.model.new_cache(), num_logits=1)
+        prefill = len(prompt_ids) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    generated = 0
+    for _ in local_model.generate_tokens(prompt_ids, max_new_tokens=max_new_tokens):
+        generated += 1
+    decode = generated / (time.perf_counter() - start) if generated else 0.0
+    return prefill, decode
+
+
+def evaluate(label, local_model, texts, max_new_tokens):
+    """Measure one model and print the results"""
+    print(f"[INFO] Evaluating {label}...")
+    ppl = perplexity(local_model, texts)
+    prefill, decode = throughput(local_model, max_new_tokens)
+    print(f"[OK] {label}: perplexity {ppl:.3f}, prefill {prefill:.1f} tok/s, decode {decode:.1f} tok/s")
+    return {"perplexity": ppl, "prefill": prefill, "decode": decode}
+
+
+def main():
+    """Main function to quantize and compare the local model"""
+    parser = argparse.ArgumentParser(description="Quantize the local model and compare it with the original")
+    parser.add_argument("--model", default=os.getenv("LOCAL_MODEL_PATH", "models/techcorp-qwen2.5-1.5b-instruct"),
+                        help="Model directory")
+    parser.add_argument("--bits", type=int, default=8, choices=[8, 4])
+    parser.add_argument("--group-size", type=int, default=64,
+                        help="Input channels per scale for 4-bit weights")
+    parser.add_argument("--dtype", default=os.getenv("LOCAL_LLM_DTYPE", "bfloat16"),
+                        choices=["bfloat16", "float32"])
+    parser.add_argument("--tokens", type=int, default=64,
+                        help="Tokens to generate for the decode speed measurement")
+    parser.add_argument("--skip-eval", action="store_true",
+                        help="Only write the quantized weights")
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print(f"QUANTIZING LOCAL MODEL (int{args.bits})")
+    print("=" * 80)
+    print()
+
+    try:
+        from utils.local_llm import build_local_model
+        from utils.quantization import HAS_INT4_KERNEL, HAS_INT8_KERNEL, quantize_state_dict, save_quantized
+    except ImportError as e:
+        print(f"[ERROR] {e}")
+        print("Install with: pip install torch transformers safetensors")
+        return
+
+    quantization = f"int{args.bits}"
+    has_kernel = HAS_INT8_KERNEL if args.bits == 8 else HAS_INT4_KERNEL
+    if not has_kernel:
+        print(f"[INFO] This PyTorch build has no CPU int{args.bits} kernel; weights will be "
+              "dequantized on the fly (less memory, but not faster)")
+
+    print(f"[INFO] Loading {args.model} ({args.dtype})...")
+    try:
+        local_model = build_local_model(args.model, dtype=args.dtype)
+    except FileNotFoundError as e:
+        print(f"[ERROR] {e}")
+        return
+    print("[OK] Model loaded")
+
+    print(f"[INFO] Quantizing weights to int{args.bits}...")
+    quantized = quantize_state_dict(local_model.model.state_dict(), bits=args.bits, group_size=args.group_size)
+    output_path = save_quantized(args.model, quantized, args.bits, args.group_size)
+    del quantized
+    gc.collect()
+    original_size = sum(f.stat().st_size for f in Path(args.model).glob("*.safetensors")
+                        if not f.name.startswith("model.int"))
+    size_mb = output_path.stat().st_size / 1024 / 1024
+    print(f"[OK] Saved {output_path} ({size_mb:.0f} MB, original {original_size / 1024 / 1024:.0f} MB)")
+
+    if args.skip_eval:
+        return
+
+    if not VALID_PATH.exists():
+        print(f"[ERROR] {VALID_PATH} not found; skipping the comparison")
+        return
+    texts = load_validation_texts()
+
+    print()
+    print("=" * 80)
+    print("COMPARISON")
+    print("=" * 80)
+    print()
+    original = evaluate(args.dtype, local_model, texts, args.tokens)
+
+    # Only one model in memory at a time
+    del local_model
+    gc.collect()
+
+    local_model = build_local_model(args.model, dtype=args.dtype, quantization=quantization)
+    result = evaluate(quantization, local_model, texts, args.tokens)
+
+    print()
+    delta = result["perplexity"] - original["perplexity"]
+    print(f"[OK] Perplexity delta: {delta:+.3f} ({delta / original['perplexity']:+.1%})")
+    print(f"[OK] Decode speedup: {result['decode'] / max(original['decode'], 1e-9):.2f}x")
+    print()
+    print("Use the quantized weights with:")
+    print(f"  LOCAL_LLM_QUANT={quantization}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Serve the Local Model over an OpenAI-Compatible API
+===================================================
+
+Runs the bundled Qwen2.5 model (models/techcorp-qwen2.5-1.5b-instruct) on CPU
+behind /v1/chat/completions, so the RAG scripts and the web chatbot can use it
+like any other OpenAI-compatible endpoint.
+
+Requests from many web sessions are batched continuously: they share decode
+steps instead of waiting for each other, so throughput grows with concurrency.
+
+Requirements:
+- pip install torch transformers safetensors
+- Model weights (from code/09_export_model_for_lmstudio.py)
+
+Run with:
+    python code/10_serve_local_model.py
+
+Then point the chat model at it (embeddings still use your API key):
+    LLM_BASE_URL=http://127.0.0.1:8000/v1 streamlit run code/web_chatbot.py
+"""
+
+import os
+import sys
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Fix OpenMP library conflict on macOS
+os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
+
+# Add parent directory to path for utils
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def main():
+    """Main function to start the local model server"""
+    parser = argparse.ArgumentParser(description="Serve the local model over an OpenAI-compatible API")
+    parser.add_argument("--model", default=os.getenv("LOCAL_MODEL_PATH", "models/techcorp-qwen2.5-1.5b-instruct"),
+                        help="Model directory")
+    parser.add_argument("--adapter", action="append", default=[], metavar="[NAME=]PATH",
+                        help="MLX LoRA adapter to serve next to the base model, selected per request "
+                             "by its name in the \"model\" field (repeatable; e.g. "
+                             "support=adapters/techcorp-support). Use with the base model, not the "
+                             "already-fused export")
+    parser.add_argument("--merge-adapter", default=None,
+                        help="MLX LoRA adapter to merge into the weights instead")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=None,
+                        help="Most requests decoded together (default: LOCAL_MAX_BATCH_SIZE or 8)")
+    parser.add_argument("--dtype", default=os.getenv("LOCAL_LLM_DTYPE", "bfloat16"),
+                        choices=["bfloat16", "float32"])
+    parser.add_argument("--quantization", default=os.getenv("LOCAL_LLM_QUANT") or None,
+                        choices=["int8", "int4"],
+                        help="Run from weights written by code/09b_quantize_local_model.py")
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("LOCAL MODEL SERVER")
+    print("=" * 80)
+    print()
+
+    try:
+        from utils.local_llm import load_local_model
+        from utils.local_server import DEFAULT_MAX_BATCH_SIZE, serve
+    except ImportError as e:
+        print(f"[ERROR] {e}")
+        print("Install with: pip install torch transformers safetensors")
+        return
+
+    print(f"[INFO] Loading {args.model} ({args.quantization or args.dtype})...")
+    try:
+        local_model = load_local_model(args.model, dtype=args.dtype, adapter_path=args.merge_adapter,
+                                       quantization=args.quantization)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        return
+    print("[OK] Model loaded")
+    if args.merge_adapter:
+        print(f"[OK] Adapter merged: {args.merge_adapter}")
+
+    for spec in args.adapter:
+        name, _, path = spec.rpartition("=")
+        try:
+            name = local_model.load_adapter(path, name=name or Path(path).name)
+        except FileNotFoundError as e:
+            print(f"[ERROR] {e}")
+            return
+        print(f"[OK] Adapter loaded: {name} ({path})")
+
+    max_batch_size = args.max_batch_size or DEFAULT_MAX_BATCH_SIZE
+    url = f"http://{args.host}:{args.port}/v1"
+    print(f"[OK] Serving on {url} (up to {max_batch_size} requests per batch)")
+    print()
+    print("Use it for answer generation with:")
+    print(f"  LLM_BASE_URL={url}")
+    if args.adapter:
+        print(f"Select an adapter with the request's model name: {', '.join(local_model.adapters.names())}")
+    print()
+    print("Press Ctrl+C to stop.")
+
+    serve(local_model, host=args.host, port=args.port, max_batch_size=max_batch_size)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n[INFO] Server stopped")
@@ -0,0 +1,76 @@
+"""
+Offline OpenAI-Compatible Stub API
+==================================
+
+Serves deterministic embeddings and chat completions on localhost, so the
+pipeline (02, 03, 04, the web chatbot, run_all.py) runs without an API key
+or network access - for air-gapped demos, CI and repeatable benchmarks.
+
+Embeddings are hashed from the words of each text (similar texts get similar
+vectors); answers quote the retrieved context. Latency, jitter, injected
+errors and per-key rate limits can be dialled in to exercise the retry,
+key-pool and routing code.
+
+Run with:
+    python code/11_stub_api_server.py --latency 0.2 --jitter 0.05 --error-rate 0.02
+
+Then, in another terminal:
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8100/v1 python code/03_build_rag.py
+
+Or run the whole pipeline against an in-process stub:
+    python run_all.py --offline
+"""
+
+import sys
+import argparse
+from pathlib import Path
+
+# Add parent directory to path for utils
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def main():
+    """Main function to start the stub API server"""
+    parser = argparse.ArgumentParser(description="Serve a deterministic OpenAI-compatible stub API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Base delay per request (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Standard deviation of the delay (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with a 500 error")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute per API key before 429s")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens per minute per API key before 429s")
+    parser.add_argument("--response-mode", default="context", choices=["context", "echo"],
+                        help="Answer with the prompt's context (default) or echo the last message")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for jitter and injected errors")
+    args = parser.parse_args()
+
+    from utils.stub_server import StubAPI, offline_environment, serve
+
+    print("=" * 80)
+    print("STUB API SERVER")
+    print("=" * 80)
+    print()
+
+    api = StubAPI(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                  rpm=args.rpm, tpm=args.tpm, response_mode=args.response_mode, seed=args.seed)
+    url = f"http://{args.host}:{args.port}/v1"
+    print(f"[OK] Serving on {url}")
+    print(f"[INFO] Latency {args.latency}s +/- {args.jitter}s, error rate {args.error_rate:.0%}, "
+          f"rpm {args.rpm or 'unlimited'}, tpm {args.tpm or 'unlimited'}")
+    print()
+    print("Point the pipeline at it with:")
+    env = offline_environment(url)
+    print("  " + " ".join(f"{name}={env[name]}" for name in ("OPENAI_API_KEY", "OPENAI_BASE_URL")))
+    print("(unset OPENROUTER_API_KEY, which takes precedence)")
+    print()
+    print("Press Ctrl+C to stop.")
+
+    serve(api, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n[INFO] Server stopped")
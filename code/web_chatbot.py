@@ -18,11 +18,8 @@ from pathlib import Path
 import streamlit as st
 import qrcode
 from io import BytesIO
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 from dotenv import load_dotenv
 
 # Fix OpenMP library conflict on macOS
@@ -30,7 +27,12 @@ os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
 
 # Add parent directory to path for utils
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from utils.api_config import get_api_config, get_embedding_model, get_llm_model
+from utils.api_config import get_api_config, create_embeddings, create_chat_model, check_embedding_model
+from utils.context_packer import pack_context
+from utils.retrieval import build_retriever
+from utils.confidence import build_guarded_rag_chain, load_confidence_threshold
+from utils.faq_index import FAQIndex, FAQ_PATH, with_faq_answers
+from utils.resilience import DeadlineExceeded, with_deadline
 
 # Load environment variables
 load_dotenv()
@@ -100,16 +102,11 @@ def load_rag_system():
         if not vectorstore_path.exists():
             return None, "Vector store not found. Please run code/02_create_vectorstore.py first."
         
-        # Setup embeddings
-        model_name = get_embedding_model(config["provider"])
-        embedding_kwargs = {
-            "model": model_name,
-            "openai_api_key": config["api_key"]
-        }
-        if config["base_url"]:
-            embedding_kwargs["openai_api_base"] = config["base_url"]
+        check_embedding_model(vectorstore_path, config)
         
-        embeddings = OpenAIEmbeddings(**embedding_kwargs)
+        # Setup embeddings
+        # Uses the shared, connection-pooled HTTP clients
+        embeddings = create_embeddings(config)
         vectorstore = FAISS.load_local(
             str(vectorstore_path),
             embeddings,
@@ -117,19 +114,12 @@ def load_rag_system():
         )
         
         # Setup retriever
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 5})  # More chunks for fun content
+        # Up to 5 chunks for fun content, fewer when scores drop off
+        # (fused with BM25 keyword hits when step 2 saved a keyword index)
+        retriever = build_retriever(vectorstore, str(vectorstore_path), max_k=5, fetch_k=10)
         
         # Setup LLM
-        llm_model_name = get_llm_model(config["provider"])
-        llm_kwargs = {
-            "model": llm_model_name,
-            "temperature": 0.3,  # Slightly higher for more complete answers
-            "openai_api_key": config["api_key"]
-        }
-        if config["base_url"]:
-            llm_kwargs["openai_api_base"] = config["base_url"]
-        
-        llm = ChatOpenAI(**llm_kwargs)
+        llm = create_chat_model(config, temperature=0.3)  # Slightly higher for more complete answers
         
         # Setup prompt
         prompt_template = ChatPromptTemplate.from_template(
@@ -150,44 +140,26 @@ Question: {question}
 Answer:"""
         )
         
-        # Format docs function
-        def format_docs(docs):
-            return "\n\n".join(
-                f"Source: {doc.metadata.get('source', 'Unknown')}\nContent: {doc.page_content}"
-                for doc in docs
-            )
-        
-        # Build RAG chain
-        rag_chain = (
-            {
-                "context": retriever | format_docs,
-                "question": RunnablePassthrough()
-            }
-            | prompt_template
-            | llm
-            | StrOutputParser()
+        # Build RAG chain (skips the LLM for questions outside the knowledge base)
+        rag_chain = build_guarded_rag_chain(
+            retriever, prompt_template, llm,
+            threshold=load_confidence_threshold(),
+            format_context=pack_context
         )
         
+        # Near-duplicates of FAQ questions get the curated answer directly
+        if FAQ_PATH.exists():
+            rag_chain = with_faq_answers(FAQIndex.from_markdown(embeddings), rag_chain, retriever)
+        
+        # One deadline per question, so a dead API can't tie up app threads
+        rag_chain = with_deadline(rag_chain)
+        
         return rag_chain, retriever, config["provider"]
         
     except Exception as e:
         return None, f"Error loading RAG system: {str(e)}"
 
 
-def get_sources(retriever, question):
-    """Get source documents for a question."""
-    try:
-        docs = retriever.get_relevant_documents(question)
-        sources = []
-        for doc in docs:
-            source = doc.metadata.get('source', 'Unknown')
-            source_name = Path(source).name if source != 'Unknown' else 'Unknown'
-            sources.append(source_name)
-        return sources
-    except Exception as e:
-        return []
-
-
 def main():
     """Main Streamlit app."""
     
@@ -347,19 +319,22 @@ def main():
         with st.chat_message("assistant"):
             with st.spinner("Searching knowledge base and generating answer..."):
                 try:
-                    # Get sources
-                    sources = get_sources(retriever, question)
-                    
-                    # Get answer
-                    answer = rag_chain.invoke(question)
+                    # Get answer and sources from a single retrieval
+                    result = rag_chain.invoke(question)
+                    answer = result["answer"]
+                    sources = result["sources"]
                     
                     # Display answer
                     st.markdown(answer)
+                    if result["low_confidence"]:
+                        st.caption("Not found in the knowledge base (answered without the LLM)")
+                    elif "faq_question" in result:
+                        st.caption(f"Curated FAQ answer: *{result['faq_question']}*")
                     
                     # Display sources
                     if sources:
                         with st.expander("📄 Sources"):
-                            for i, source in enumerate(set(sources), 1):
+                            for i, source in enumerate(sources, 1):
                                 st.write(f"{i}. {source}")
                     
                     # Add assistant message to chat history
@@ -369,6 +344,13 @@ def main():
                         "sources": sources
                     })
                     
+                except DeadlineExceeded as e:
+                    error_msg = f"Sorry, that took too long ({e}). Please try again in a moment."
+                    st.error(error_msg)
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": error_msg
+                    })
                 except Exception as e:
                     error_msg = f"Error: {str(e)}"
                     st.error(error_msg)
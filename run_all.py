@@ -8,6 +8,7 @@ to verify everything works correctly.
 
 Usage:
     python run_all.py
+    python run_all.py --offline   # against the bundled stub API, no key or network needed
 
 It will:
 1. Check dependencies
@@ -107,8 +108,9 @@ def check_environment():
     print_header("Checking Environment")
     
     # Check for OpenRouter first (preferred), then OpenAI
-    openrouter_key = os.getenv("OPENROUTER_API_KEY")
-    openai_key = os.getenv("OPENAI_API_KEY")
+    # A comma-separated key pool (e.g. OPENROUTER_API_KEYS) also counts
+    openrouter_key = os.getenv("OPENROUTER_API_KEY") or os.getenv("OPENROUTER_API_KEYS", "").split(",")[0].strip()
+    openai_key = os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEYS", "").split(",")[0].strip()
     
     if openrouter_key:
         masked_key = openrouter_key[:8] + "..." + openrouter_key[-4:] if len(openrouter_key) > 12 else "***"
@@ -201,6 +203,19 @@ def run_script(script_path, description, required=True):
         return False
 
 
+def start_offline_api():
+    """Start the stub API in-process and point every step's environment at it."""
+    sys.path.insert(0, str(Path(__file__).parent))
+    from utils.stub_server import offline_environment, start_stub_server
+    
+    print_header("Starting Offline Stub API")
+    server, url = start_stub_server()
+    # Subprocesses inherit os.environ
+    os.environ.update(offline_environment(url))
+    print_success(f"Stub API serving on {url}")
+    return server
+
+
 def check_vectorstore():
     """Check if vector store exists."""
     vectorstore_path = Path("vectorstore")
@@ -214,12 +229,15 @@ def check_vectorstore():
     return False
 
 
-def main():
+def main(offline=False):
     """Main function to run all steps."""
     print_header("RAG Presentation Complete Test Suite")
     
     print(f"{Colors.BOLD}This script will test all components of the RAG presentation.{Colors.ENDC}\n")
     
+    if offline:
+        start_offline_api()
+    
     # Track steps
     steps_completed = 0
     steps_failed = 0
@@ -267,7 +285,14 @@ def main():
     if not check_vectorstore():
         print_error("Vector store was not created successfully!")
         return False
-    
+
+    # The stub's hash embeddings score far below the default confidence
+    # threshold, so calibrate one for them or every question is refused
+    if offline:
+        if not run_script("code/03b_calibrate_confidence.py", "Calibrate confidence threshold"):
+            print_error("Failed at confidence calibration step!")
+            return False
+
     # Step 6: Build RAG system
     print_step(6, 7, "Step 3: Building RAG System")
     if run_script("code/03_build_rag.py", "Build complete RAG chain"):
@@ -286,7 +311,6 @@ def main():
 import os
 import sys
 from pathlib import Path
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
@@ -298,23 +322,17 @@ load_dotenv()
 # Add parent directory to path for utils
 project_root = Path(os.getcwd())
 sys.path.insert(0, str(project_root))
-from utils.api_config import get_api_config, get_embedding_model, get_llm_model
+from utils.api_config import get_api_config, create_embeddings, create_chat_model, check_embedding_model
 
 vectorstore_path = project_root / "vectorstore"
 config = get_api_config()
 if not config:
     print("[ERROR] API key not found!")
     sys.exit(1)
+check_embedding_model(vectorstore_path, config)
 
-model_name = get_embedding_model(config["provider"])
-embedding_kwargs = {
-    "model": model_name,
-    "openai_api_key": config["api_key"]
-}
-if config["base_url"]:
-    embedding_kwargs["openai_api_base"] = config["base_url"]
-
-embeddings = OpenAIEmbeddings(**embedding_kwargs)
+# Uses the shared, connection-pooled HTTP clients
+embeddings = create_embeddings(config)
 vectorstore = FAISS.load_local(str(vectorstore_path), embeddings, allow_dangerous_deserialization=True)
 
 retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
@@ -326,16 +344,7 @@ prompt_template = ChatPromptTemplate.from_template(
     "You are a helpful customer support assistant.\\n\\nContext:\\n{context}\\n\\nQuestion: {question}\\n\\nAnswer:"
 )
 
-model_name = get_llm_model(config["provider"])
-llm_kwargs = {
-    "model": model_name,
-    "temperature": 0,
-    "openai_api_key": config["api_key"]
-}
-if config["base_url"]:
-    llm_kwargs["openai_api_base"] = config["base_url"]
-
-llm = ChatOpenAI(**llm_kwargs)
+llm = create_chat_model(config, temperature=0)
 
 rag_chain = (
     {"context": retriever | format_docs, "question": RunnablePassthrough()}
@@ -406,7 +415,7 @@ print("[OK] Chatbot test successful!")
 
 if __name__ == "__main__":
     try:
-        success = main()
+        success = main(offline="--offline" in sys.argv[1:])
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
         print(f"\n{Colors.WARNING}\nTest interrupted by user.{Colors.ENDC}")
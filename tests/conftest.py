@@ -0,0 +1,25 @@
+"""Shared fixtures for the tests (python -m pytest tests)."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.stub_server import StubAPI, start_stub_server
+
+
+@pytest.fixture
+def stub_server():
+    """Start stub servers with the given StubAPI options; returns (api, base URL)."""
+    servers = []
+
+    def start(**options):
+        api = StubAPI(**options)
+        server, url = start_stub_server(api)
+        servers.append(server)
+        return api, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
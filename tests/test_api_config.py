@@ -0,0 +1,48 @@
+"""
+Embedding model recorded with the vector store (utils/api_config.py).
+
+    python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.api_config import check_embedding_model, save_embedding_model
+
+
+@pytest.fixture
+def api_keys(monkeypatch):
+    for name in ("OPENAI_API_KEY", "OPENAI_API_KEYS", "OPENROUTER_API_KEY", "OPENROUTER_API_KEYS"):
+        monkeypatch.setenv(name, "")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    return monkeypatch
+
+
+def test_same_embedding_model_passes(tmp_path, api_keys):
+    api_keys.setenv("EMBEDDING_PROVIDER", "hash")
+    save_embedding_model(tmp_path)
+    check_embedding_model(tmp_path)
+
+
+def test_switching_embedding_provider_is_refused(tmp_path, api_keys):
+    api_keys.setenv("EMBEDDING_PROVIDER", "hash")
+    save_embedding_model(tmp_path)
+
+    api_keys.setenv("EMBEDDING_PROVIDER", "api")
+    with pytest.raises(ValueError, match="built with hash embeddings"):
+        check_embedding_model(tmp_path)
+
+
+def test_openai_and_openrouter_share_embedding_models(tmp_path, api_keys):
+    api_keys.setenv("EMBEDDING_PROVIDER", "api")
+    save_embedding_model(tmp_path)
+
+    api_keys.setenv("OPENROUTER_API_KEY", "sk-or-test")
+    check_embedding_model(tmp_path)
+
+
+def test_stores_without_a_record_are_not_checked(tmp_path, api_keys):
+    api_keys.setenv("EMBEDDING_PROVIDER", "hash")
+    check_embedding_model(tmp_path)
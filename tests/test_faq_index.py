@@ -0,0 +1,91 @@
+"""
+FAQ lookup in front of the RAG chain (utils/faq_index.py), with an embedding
+API that can be switched off.
+
+    python -m pytest tests
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.prompts import ChatPromptTemplate
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.confidence import build_guarded_rag_chain
+from utils.faq_index import FAQIndex, with_faq_answers
+from utils.lexical_index import BM25Index
+from utils.local_embeddings import HashEmbeddings
+from utils.retrieval import HybridRetriever
+
+CHUNKS = [
+    "Two-factor authentication (2FA) can be enabled under Settings > Security.",
+    "The Pro plan costs $25 per user per month.",
+    "Support is available by email around the clock.",
+]
+FAQ = [{"question": "How much does the Pro plan cost?", "answer": "$25 per user per month."}]
+
+
+class SwitchableEmbeddings(Embeddings):
+    """Hash embeddings that raise like the OpenAI client while `down` is set."""
+
+    def __init__(self):
+        self.hash = HashEmbeddings(dimensions=64)
+        self.down = False
+        self.calls = 0
+
+    def _check(self):
+        self.calls += 1
+        if self.down:
+            raise httpx.ConnectError("embedding API unreachable")
+
+    def embed_documents(self, texts):
+        self._check()
+        return self.hash.embed_documents(texts)
+
+    def embed_query(self, text):
+        self._check()
+        return self.hash.embed_query(text)
+
+
+@pytest.fixture
+def chatbot():
+    embeddings = SwitchableEmbeddings()
+    vectorstore = FAISS.from_texts(CHUNKS, embeddings, metadatas=[{"source": "kb.md"} for _ in CHUNKS])
+    retriever = HybridRetriever(vectorstore=vectorstore, lexical_index=BM25Index.from_vectorstore(vectorstore),
+                                k=2, fetch_k=3)
+    prompt = ChatPromptTemplate.from_template("{context}\n\n{question}")
+    llm = FakeListChatModel(responses=["Enable it under Settings > Security."] * 4)
+    rag_chain = build_guarded_rag_chain(retriever, prompt, llm, threshold=-1.0)
+    chain = with_faq_answers(FAQIndex(embeddings, FAQ), rag_chain, retriever)
+    return chain, embeddings
+
+
+def test_faq_question_gets_the_curated_answer(chatbot):
+    chain, _ = chatbot
+    result = chain.invoke("How much does the Pro plan cost?")
+    assert result["answer"] == FAQ[0]["answer"]
+
+
+def test_other_questions_are_embedded_once(chatbot):
+    chain, embeddings = chatbot
+    before = embeddings.calls
+    result = chain.invoke("How do I turn on 2FA?")
+    assert result["answer"] == "Enable it under Settings > Security."
+    assert embeddings.calls - before == 1
+
+
+def test_embedding_outage_falls_back_to_keyword_search(chatbot):
+    chain, embeddings = chatbot
+    embeddings.down = True
+
+    result = chain.invoke("How do I turn on 2FA?")
+    assert result["answer"] == "Enable it under Settings > Security."
+    assert result["sources"] == ["kb.md"]
+
+    result = asyncio.run(chain.ainvoke("How do I turn on 2FA?"))
+    assert result["answer"] == "Enable it under Settings > Security."
@@ -0,0 +1,87 @@
+"""
+Local sentence embeddings (utils/local_embeddings.py) with a tiny random
+BERT model saved to a temporary directory.
+
+    pip install torch transformers
+    python -m pytest tests
+"""
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.local_embeddings import LocalEmbeddings
+
+WORDS = "how do i reset my password the pro plan costs per user month enable two factor authentication".split()
+
+TEXTS = [
+    "reset password",
+    "how do i enable two factor authentication",
+    "the pro plan costs per user per month",
+    "password",
+    "how do i reset my password",
+]
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    """A random 2-layer BERT with a word-level vocabulary, saved like a sentence-transformers download."""
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+    transformers.BertTokenizerFast(vocab_file=str(vocab)).save_pretrained(tmp_path)
+
+    torch.manual_seed(0)
+    config = transformers.BertConfig(vocab_size=5 + len(WORDS), hidden_size=32, num_hidden_layers=2,
+                                     num_attention_heads=2, intermediate_size=64, max_position_embeddings=64)
+    transformers.BertModel(config).save_pretrained(tmp_path)
+    return tmp_path
+
+
+def use_cls_pooling(path):
+    (path / "1_Pooling").mkdir()
+    with open(path / "1_Pooling" / "config.json", "w") as f:
+        json.dump({"pooling_mode_cls_token": True, "pooling_mode_mean_tokens": False}, f)
+
+
+def reference_embedding(path, text, pooling):
+    """Unbatched embedding computed directly with transformers."""
+    tokenizer = transformers.AutoTokenizer.from_pretrained(path)
+    model = transformers.AutoModel.from_pretrained(path).eval()
+    inputs = tokenizer([text], return_tensors="pt")
+    with torch.no_grad():
+        hidden = model(**inputs).last_hidden_state[0].numpy()
+    vector = hidden[0] if pooling == "cls" else hidden.mean(axis=0)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.mark.parametrize("pooling", ["mean", "cls"])
+def test_pooling_mode(model_path, pooling):
+    if pooling == "cls":
+        use_cls_pooling(model_path)
+    embeddings = LocalEmbeddings(model_path, num_threads=1)
+
+    assert embeddings.backend == "torch"
+    assert embeddings.pooling == pooling
+    for text in TEXTS:
+        assert np.allclose(embeddings.embed_query(text), reference_embedding(model_path, text, pooling), atol=1e-5)
+
+
+@pytest.mark.parametrize("pooling", ["mean", "cls"])
+def test_batched_embeddings_match_single(model_path, pooling):
+    if pooling == "cls":
+        use_cls_pooling(model_path)
+    # Batches of 2 mix texts of different lengths, so most are padded
+    embeddings = LocalEmbeddings(model_path, batch_size=2, num_threads=1)
+
+    batched = np.array(embeddings.embed_documents(TEXTS))
+    single = np.array([embeddings.embed_query(text) for text in TEXTS])
+
+    assert batched.shape == (len(TEXTS), 32)
+    assert np.allclose(np.linalg.norm(batched, axis=1), 1.0, atol=1e-5)
+    assert np.allclose(batched, single, atol=1e-5)
@@ -0,0 +1,48 @@
+"""
+Deadlines and circuit breakers (utils/resilience.py) against a slow stub server.
+
+    python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.resilience import BREAKER_FAILURES, ResilientTransport, deadline, get_breaker
+
+EMBEDDING_REQUEST = {"model": "text-embedding-3-small", "input": "hello"}
+
+
+def embed(client, url):
+    return client.post(f"{url}/embeddings", json=EMBEDDING_REQUEST, headers={"authorization": "Bearer stub"})
+
+
+def breaker_for(url):
+    return get_breaker(httpx.URL(url).netloc.decode())
+
+
+def test_deadline_timeouts_leave_the_breaker_closed(stub_server):
+    _, url = stub_server(latency=0.5)
+    client = httpx.Client(transport=ResilientTransport(), timeout=60.0)
+
+    # Questions with tight deadlines time out, but the endpoint itself is fine
+    for _ in range(BREAKER_FAILURES + 1):
+        with deadline(0.05), pytest.raises(httpx.TimeoutException):
+            embed(client, url)
+
+    assert breaker_for(url).state == "closed"
+    assert embed(client, url).status_code == 200
+
+
+def test_endpoint_timeouts_open_the_breaker(stub_server):
+    _, url = stub_server(latency=0.5)
+    # The endpoint's own timeout, well inside the deadline
+    client = httpx.Client(transport=ResilientTransport(), timeout=0.05)
+
+    for _ in range(BREAKER_FAILURES):
+        with deadline(30), pytest.raises(httpx.TimeoutException):
+            embed(client, url)
+
+    assert breaker_for(url).state == "open"
@@ -0,0 +1,66 @@
+"""
+Hybrid retrieval (utils/retrieval.py) on a small FAISS store with
+hand-placed embeddings.
+
+    python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.lexical_index import BM25Index
+from utils.retrieval import HybridRetriever
+
+QUERY = "What does the SOC 2 report cover?"
+
+
+def unit(*components):
+    vector = np.zeros(4, dtype=np.float32)
+    vector[:len(components)] = components
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+# Text -> embedding; the SOC 2 chunk's embedding is far from the question's
+VECTORS = {
+    QUERY: unit(1),
+    "Security program overview for enterprise customers": unit(1),
+    "Encryption at rest and in transit for customer data": unit(1, 0.3),
+    "Office locations and opening hours": unit(0, 1),
+    "Audits: SOC 2 Type II report available on request": unit(0, 0, 1),
+}
+
+
+class FixedEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        return [VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        return VECTORS[text]
+
+
+@pytest.fixture
+def vectorstore():
+    texts = [text for text in VECTORS if text != QUERY]
+    return FAISS.from_texts(texts, FixedEmbeddings(), metadatas=[{"source": "security.md"} for _ in texts])
+
+
+def test_hybrid_keeps_keyword_hits_with_low_vector_scores(vectorstore):
+    retriever = HybridRetriever(vectorstore=vectorstore, lexical_index=BM25Index.from_vectorstore(vectorstore),
+                                k=5, fetch_k=10)
+    docs = retriever.invoke(QUERY)
+    contents = [doc.page_content for doc in docs]
+
+    # Only BM25 finds it; its vector score alone would have cut it
+    soc2 = next(doc for doc in docs if "SOC 2" in doc.page_content)
+    assert soc2.metadata["score"] < retriever.score_threshold
+    # Vector-only hits are still pruned by score
+    assert "Office locations and opening hours" not in contents
+    assert "Security program overview for enterprise customers" in contents
+    # Fused order
+    rrf_scores = [doc.metadata["rrf_score"] for doc in docs]
+    assert rrf_scores == sorted(rrf_scores, reverse=True)
@@ -0,0 +1,122 @@
+"""
+Latency-aware routing (utils/routing.py) against two local stub servers.
+
+    python -m pytest tests
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from utils.routing import AsyncRoutingTransport, Endpoint, ProviderRouter, RoutingTransport
+
+
+def routed_client(*endpoints, **options):
+    # No exploration, so the endpoint order is deterministic
+    router = ProviderRouter(list(endpoints), explore_rate=0.0, **options)
+    return router, httpx.Client(transport=RoutingTransport(router))
+
+
+def async_routed_client(*endpoints, **options):
+    router = ProviderRouter(list(endpoints), explore_rate=0.0, **options)
+    return router, httpx.AsyncClient(transport=AsyncRoutingTransport(router))
+
+
+EMBEDDING_REQUEST = {"model": "text-embedding-3-small", "input": "hello"}
+
+
+def embed(client, url):
+    return client.post(f"{url}/embeddings", json=EMBEDDING_REQUEST, headers={"authorization": "Bearer stub"})
+
+
+def test_prefers_the_faster_endpoint(stub_server):
+    slow_api, slow_url = stub_server(latency=0.05)
+    fast_api, fast_url = stub_server(latency=0.0)
+    _, client = routed_client(Endpoint("slow", slow_url, "stub"), Endpoint("fast", fast_url, "stub"))
+
+    # Requests addressed to the slow server are re-targeted too
+    for _ in range(20):
+        assert embed(client, slow_url).status_code == 200
+
+    assert slow_api.stats()["requests"] <= 2
+    assert fast_api.stats()["requests"] >= 18
+
+
+def test_fails_over_from_an_erroring_endpoint(stub_server):
+    broken_api, broken_url = stub_server(error_rate=1.0)
+    healthy_api, healthy_url = stub_server()
+    broken = Endpoint("broken", broken_url, "stub")
+    router, client = routed_client(broken, Endpoint("healthy", healthy_url, "stub"))
+
+    for _ in range(10):
+        assert embed(client, broken_url).status_code == 200
+
+    assert not broken.healthy()
+    assert router.ranked()[-1] is broken
+    # Once unhealthy, it is no longer tried first
+    assert broken_api.stats()["requests"] == 5
+    assert healthy_api.stats()["requests"] == 10
+
+
+def test_endpoint_recovers_after_a_transient_outage(stub_server):
+    flaky_api, flaky_url = stub_server(error_rate=1.0)
+    steady_api, steady_url = stub_server(latency=0.02)
+    flaky = Endpoint("flaky", flaky_url, "stub", outcome_ttl=1.0)
+    router, client = routed_client(flaky, Endpoint("steady", steady_url, "stub"))
+
+    for _ in range(8):
+        assert embed(client, flaky_url).status_code == 200
+    assert not flaky.healthy()
+
+    # The outage ends; with no traffic, only expiry can bring it back
+    flaky_api.error_rate = 0.0
+    time.sleep(1.1)
+    assert flaky.healthy()
+
+    before = flaky_api.stats()["requests"]
+    for _ in range(5):
+        assert embed(client, flaky_url).status_code == 200
+    assert flaky_api.stats()["requests"] - before == 5
+    assert router.ranked()[0] is flaky
+
+
+def test_hedging_demotes_a_degraded_endpoint(stub_server):
+    primary_api, primary_url = stub_server()
+    backup_api, backup_url = stub_server(latency=0.02)
+    primary = Endpoint("primary", primary_url, "stub", window=5)
+    backup = Endpoint("backup", backup_url, "stub", window=5)
+    router, client = async_routed_client(primary, backup, hedge=True, min_hedge_delay=0.05)
+
+    async def run():
+        async with client:
+            for _ in range(5):
+                await client.post(f"{primary_url}/embeddings", json=EMBEDDING_REQUEST)
+            assert router.ranked()[0] is primary
+
+            # The primary degrades; each request is won by the hedge and the
+            # primary's cancelled attempt must still count as a slow sample
+            primary_api.latency = 2.0
+            for _ in range(5):
+                start = time.perf_counter()
+                response = await client.post(f"{primary_url}/embeddings", json=EMBEDDING_REQUEST)
+                assert response.status_code == 200
+                assert time.perf_counter() - start < 1.0
+
+    asyncio.run(run())
+    assert router.ranked()[0] is backup
+    assert primary.percentile(50) > backup.percentile(50)
+
+
+def test_hedge_runner_up_is_not_retried(stub_server):
+    # Both fail; the slow primary answers after the hedge was sent
+    primary_api, primary_url = stub_server(latency=0.1, error_rate=1.0)
+    backup_api, backup_url = stub_server(error_rate=1.0)
+    _, client = routed_client(Endpoint("primary", primary_url, "stub"), Endpoint("backup", backup_url, "stub"),
+                              hedge=True, min_hedge_delay=0.02)
+
+    assert embed(client, primary_url).status_code == 500
+    assert primary_api.stats()["requests"] == 1
+    assert backup_api.stats()["requests"] == 1
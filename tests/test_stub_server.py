@@ -0,0 +1,33 @@
+"""
+The stub API server (utils/stub_server.py).
+
+    python -m pytest tests
+"""
+import time
+
+import httpx
+import pytest
+
+EMBEDDING_REQUEST = {"model": "text-embedding-3-small", "input": "hello"}
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_client_disconnects_are_quiet(stub_server, capfd, stream):
+    api, url = stub_server(latency=0.2)
+    if stream:
+        path, body = "chat/completions", {"model": "stub-chat", "stream": True,
+                                          "messages": [{"role": "user", "content": "hello"}]}
+    else:
+        path, body = "embeddings", EMBEDDING_REQUEST
+
+    # The client gives up before the stub answers, as under a deadline or hedging
+    for _ in range(3):
+        with pytest.raises(httpx.TimeoutException):
+            httpx.post(f"{url}/{path}", json=body, headers={"authorization": "Bearer stub"}, timeout=0.05)
+    time.sleep(0.4)
+
+    assert "Traceback" not in capfd.readouterr().err
+    assert api.stats()["requests"] == 3
+    # Still serving
+    assert httpx.post(f"{url}/embeddings", json=EMBEDDING_REQUEST,
+                      headers={"authorization": "Bearer stub"}).status_code == 200
@@ -0,0 +1,15 @@
+"""
+Shared helpers for the RAG scripts.
+
+Several modules read tuning knobs (RAG_MAX_CONCURRENCY, RAG_DEADLINE,
+RAG_SHARD_WORKERS, LOCAL_*, ...) from the environment when they are
+imported, which in the scripts happens before their own load_dotenv()
+call. Loading the project's .env here, before any of those modules, lets
+those settings take effect. Variables already set in the environment
+(including the offline stub's) still win.
+"""
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
@@ -1,39 +1,92 @@
 """
 Utility functions for configuring OpenAI-compatible APIs (OpenAI or OpenRouter)
 """
+import json
 import os
+import threading
+from pathlib import Path
 from typing import Optional
 
+import httpx
+
+from utils.key_pool import env_key, parse_keys
+
+
+# Shared connection pool settings for all embedding and chat requests
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# Saved next to the FAISS index: which embedding model built it
+EMBEDDING_MODEL_FILE = "embedding_model.json"
+
+_http_client = None
+_async_http_client = None
+_router = None
+_router_loaded = False
+_key_pools = None
+_http_client_lock = threading.Lock()
+
 
 def get_api_config():
     """
     Get API configuration from environment variables.
-    Supports both OpenAI and OpenRouter.
+    Supports both OpenAI and OpenRouter, each with a single key
+    (OPENROUTER_API_KEY) or a comma-separated pool (OPENROUTER_API_KEYS).
     
     Returns:
-        dict with api_key, base_url, and provider info
+        dict with api_key, api_keys, base_url, and provider info
     """
     # Check for OpenRouter first
-    openrouter_key = os.getenv("OPENROUTER_API_KEY")
+    openrouter_key = env_key("OPENROUTER_API_KEY")
     if openrouter_key:
         return {
             "api_key": openrouter_key,
+            "api_keys": parse_keys(os.getenv("OPENROUTER_API_KEYS")) or [openrouter_key],
             "base_url": "https://openrouter.ai/api/v1",
             "provider": "openrouter"
         }
     
     # Fall back to OpenAI
-    openai_key = os.getenv("OPENAI_API_KEY")
+    openai_key = env_key("OPENAI_API_KEY")
     if openai_key:
         return {
             "api_key": openai_key,
-            "base_url": None,  # Use default OpenAI endpoint
+            "api_keys": parse_keys(os.getenv("OPENAI_API_KEYS")) or [openai_key],
+            # Default OpenAI endpoint unless overridden (e.g. a local stub server)
+            "base_url": os.getenv("OPENAI_BASE_URL"),
             "provider": "openai"
         }
     
     return None
 
 
+def get_llm_provider(config=None):
+    """
+    Which backend generates answers: "local" when LLM_PROVIDER=local (the
+    bundled Qwen2.5 model on CPU, see utils/local_llm.py), else the API provider.
+    """
+    if os.getenv("LLM_PROVIDER", "").lower() == "local":
+        return "local"
+    if config is None:
+        config = get_api_config()
+    return config["provider"] if config else None
+
+
+def get_embedding_provider():
+    """
+    Where embeddings are computed: "api" (OpenAI/OpenRouter), or in-process
+    with "local" or "hash" (see utils/local_embeddings.py), from
+    EMBEDDING_PROVIDER. Read on every call, so a value from .env applies
+    however early utils was imported.
+    """
+    from utils.local_embeddings import EMBEDDING_PROVIDERS
+
+    provider = os.getenv("EMBEDDING_PROVIDER", "api").lower()
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"EMBEDDING_PROVIDER must be one of {', '.join(EMBEDDING_PROVIDERS)}")
+    return provider
+
+
 def get_embedding_model(provider: Optional[str] = None):
     """
     Get the appropriate embedding model name based on provider.
@@ -44,6 +97,15 @@ def get_embedding_model(provider: Optional[str] = None):
     Returns:
         Model name string
     """
+    from utils.local_embeddings import LOCAL_EMBEDDING_MODEL, DEFAULT_HASH_DIMENSIONS
+    
+    # EMBEDDING_PROVIDER=local/hash computes embeddings in-process
+    embedding_provider = get_embedding_provider()
+    if embedding_provider == "local":
+        return LOCAL_EMBEDDING_MODEL.name
+    if embedding_provider == "hash":
+        return f"hash-{DEFAULT_HASH_DIMENSIONS}"
+    
     if provider is None:
         config = get_api_config()
         if config:
@@ -58,17 +120,65 @@ def get_embedding_model(provider: Optional[str] = None):
         return "text-embedding-3-small"
 
 
+def embedding_model_id(config=None):
+    """
+    Provider and model of the configured embeddings, e.g.
+    {"provider": "api", "model": "text-embedding-3-small"}. OpenAI and
+    OpenRouter serve the same embedding models, so the "openai/" prefix is dropped.
+    """
+    provider = get_embedding_provider()
+    model = get_embedding_model(config["provider"] if config else None)
+    return {"provider": provider, "model": model.split("/", 1)[-1] if provider == "api" else model}
+
+
+def save_embedding_model(folder_path, config=None):
+    """Record which embedding model built the vector store in `folder_path`."""
+    path = Path(folder_path) / EMBEDDING_MODEL_FILE
+    with open(path, "w") as f:
+        json.dump(embedding_model_id(config), f)
+    return path
+
+
+def check_embedding_model(folder_path, config=None):
+    """
+    Make sure a saved vector store is queried with the embeddings it was
+    built with. Vectors from another model of the same size (e.g. hash vs
+    text-embedding-3-small, both 1536) search without error but find
+    unrelated chunks.
+
+    Raises:
+        ValueError: If the store was built with a different embedding model
+            (stores saved before this was recorded are not checked)
+    """
+    path = Path(folder_path) / EMBEDDING_MODEL_FILE
+    if not path.exists():
+        return
+    with open(path, "r") as f:
+        built_with = json.load(f)
+    current = embedding_model_id(config)
+    if built_with != current:
+        raise ValueError(
+            f"The vector store in {folder_path} was built with {built_with['provider']} embeddings "
+            f"({built_with['model']}), but EMBEDDING_PROVIDER selects {current['provider']} "
+            f"({current['model']}). Rebuild it with: python code/02_create_vectorstore.py"
+        )
+
+
 def get_llm_model(provider: Optional[str] = None, model: Optional[str] = None):
     """
     Get the appropriate LLM model name based on provider.
     
     Args:
-        provider: 'openrouter' or 'openai', or None to auto-detect
+        provider: 'openrouter', 'openai' or 'local', or None to auto-detect
         model: Specific model name (optional)
     
     Returns:
         Model name string
     """
+    if provider == "local":
+        from utils.local_llm import LOCAL_MODEL_PATH
+        return model or LOCAL_MODEL_PATH.name
+    
     if provider is None:
         config = get_api_config()
         if config:
@@ -88,3 +198,187 @@ def get_llm_model(provider: Optional[str] = None, model: Optional[str] = None):
     else:
         return "gpt-4o-mini"
 
+
+
+def http2_available():
+    """HTTP/2 needs the optional `h2` package (pip install httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_router():
+    """
+    Get the process-wide multi-endpoint router, or None if not configured.
+    
+    See utils/routing.py: set RAG_ENDPOINTS, or both OPENROUTER_API_KEY and
+    OPENAI_API_KEY, to route each request to the fastest healthy endpoint.
+    """
+    global _router, _router_loaded
+    if not _router_loaded:
+        from utils.routing import load_router
+        _router = load_router()
+        _router_loaded = True
+    return _router
+
+
+def get_key_pools():
+    """
+    Get the process-wide API key pools (host -> KeyPool), empty if no
+    provider has more than one key. See utils/key_pool.py.
+    """
+    global _key_pools
+    if _key_pools is None:
+        from utils.key_pool import load_key_pools
+        _key_pools = load_key_pools()
+    return _key_pools
+
+
+def get_http_client():
+    """
+    Get the process-wide HTTP client used for all sync API calls.
+    
+    The client keeps connections alive and pools them, so repeated embedding
+    and chat requests (e.g. every Streamlit rerun) reuse one TLS connection
+    instead of opening a new one each time. Uses HTTP/2 when `h2` is installed,
+    and routes across endpoints when a router is configured. Requests honour
+    the current deadline and each endpoint's circuit breaker (utils/resilience.py),
+    and are spread over the provider's key pool when it has several keys.
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            from utils.resilience import ResilientTransport
+            transport = ResilientTransport(
+                httpx.HTTPTransport(http2=http2_available(), limits=HTTP_LIMITS)
+            )
+            if get_key_pools():
+                from utils.key_pool import KeyPoolTransport
+                transport = KeyPoolTransport(get_key_pools(), transport)
+            router = get_router()
+            if router:
+                from utils.routing import RoutingTransport
+                transport = RoutingTransport(router, transport)
+            _http_client = httpx.Client(transport=transport, timeout=HTTP_TIMEOUT)
+    return _http_client
+
+
+def get_async_http_client():
+    """
+    Get the process-wide HTTP client used for all async API calls.
+    
+    Async connections belong to the event loop that opened them, so async
+    callers should run on a single long-lived loop (see utils.async_rag).
+    """
+    global _async_http_client
+    with _http_client_lock:
+        if _async_http_client is None:
+            from utils.resilience import AsyncResilientTransport
+            transport = AsyncResilientTransport(
+                httpx.AsyncHTTPTransport(http2=http2_available(), limits=HTTP_LIMITS)
+            )
+            if get_key_pools():
+                from utils.key_pool import AsyncKeyPoolTransport
+                transport = AsyncKeyPoolTransport(get_key_pools(), transport)
+            router = get_router()
+            if router:
+                from utils.routing import AsyncRoutingTransport
+                transport = AsyncRoutingTransport(router, transport)
+            _async_http_client = httpx.AsyncClient(transport=transport, timeout=HTTP_TIMEOUT)
+    return _async_http_client
+
+
+def create_embeddings(config=None):
+    """
+    Create the embedding model for the configured provider.
+    
+    Args:
+        config: API configuration dict (from get_api_config), or None to auto-detect
+    
+    Returns:
+        OpenAIEmbeddings using the shared HTTP clients, or in-process
+        embeddings when EMBEDDING_PROVIDER is "local" or "hash"
+        (see utils/local_embeddings.py)
+    """
+    embedding_provider = get_embedding_provider()
+    if embedding_provider == "hash":
+        from utils.local_embeddings import HashEmbeddings
+        return HashEmbeddings()
+    if embedding_provider == "local":
+        from utils.local_embeddings import load_local_embeddings
+        return load_local_embeddings()
+    
+    from langchain_openai import OpenAIEmbeddings
+    
+    if config is None:
+        config = get_api_config()
+    if not config:
+        raise ValueError("API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
+    
+    embedding_kwargs = {
+        "model": get_embedding_model(config["provider"]),
+        "openai_api_key": config["api_key"],
+        "http_client": get_http_client(),
+        "http_async_client": get_async_http_client(),
+    }
+    
+    if config["base_url"]:
+        embedding_kwargs["openai_api_base"] = config["base_url"]
+    
+    from utils.context_packer import has_exact_tokenizer
+    
+    if not has_exact_tokenizer(embedding_kwargs["model"]):
+        # Chunk-length checks need tiktoken's BPE files; send raw text instead
+        embedding_kwargs["check_embedding_ctx_length"] = False
+    
+    return OpenAIEmbeddings(**embedding_kwargs)
+
+
+def create_chat_model(config=None, temperature: float = 0.3, model: Optional[str] = None):
+    """
+    Create the chat model for the configured provider.
+    
+    Args:
+        config: API configuration dict (from get_api_config), or None to auto-detect
+        temperature: Sampling temperature
+        model: Specific model name (optional; a model directory for the local provider)
+    
+    Returns:
+        ChatOpenAI using the shared HTTP clients, or ChatLocalQwen when
+        LLM_PROVIDER=local
+    """
+    if get_llm_provider(config) == "local":
+        try:
+            from utils.local_llm import ChatLocalQwen, LOCAL_MODEL_PATH
+        except ImportError as e:
+            raise ImportError(
+                f"LLM_PROVIDER=local needs PyTorch and transformers ({e}). "
+                "Install with: pip install torch transformers safetensors"
+            ) from e
+        return ChatLocalQwen(temperature=temperature, model_path=str(model or LOCAL_MODEL_PATH),
+                             adapter_path=os.getenv("LOCAL_LLM_ADAPTER") or None)
+    
+    from langchain_openai import ChatOpenAI
+    
+    if config is None:
+        config = get_api_config()
+    if not config:
+        raise ValueError("API key not found. Set OPENAI_API_KEY or OPENROUTER_API_KEY")
+    
+    llm_kwargs = {
+        "model": get_llm_model(config["provider"], model),
+        "temperature": temperature,
+        "openai_api_key": config["api_key"],
+        "http_client": get_http_client(),
+        "http_async_client": get_async_http_client(),
+    }
+    
+    # LLM_BASE_URL sends only chat requests elsewhere, e.g. to the local
+    # model server (code/10_serve_local_model.py); embeddings stay on the API
+    base_url = os.getenv("LLM_BASE_URL") or config["base_url"]
+    if base_url:
+        llm_kwargs["openai_api_base"] = base_url
+    
+    return ChatOpenAI(**llm_kwargs)
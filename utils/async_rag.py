@@ -0,0 +1,133 @@
+"""
+Async helpers for running a RAG chain over many questions concurrently.
+
+LangChain runnables already expose `ainvoke`/`abatch`; these helpers add a
+concurrency limit, per-question timing and error capture so a whole question
+set (e.g. a regression suite) can be answered in parallel instead of one
+`invoke` call at a time.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "8"))
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Get the process-wide event loop used for async API calls.
+    
+    The loop runs forever in a daemon thread. Keeping one loop (instead of
+    `asyncio.run` per batch) lets the shared async HTTP client in
+    utils.api_config reuse its pooled connections across batches.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="rag-event-loop", daemon=True).start()
+    return _loop
+
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+async def ainvoke_rag(rag_chain, question: str, semaphore: Optional[asyncio.Semaphore] = None,
+                      config: Optional[dict] = None):
+    """
+    Answer a single question asynchronously.
+
+    Args:
+        rag_chain: Any LangChain runnable that accepts a question string
+        question: The question to answer
+        semaphore: Optional semaphore bounding concurrent calls
+        config: Optional RunnableConfig (e.g. callbacks) for this call
+
+    Returns:
+        dict with question, answer, error and latency (seconds). Chains that
+        return a dict (e.g. the confidence-guarded chain) have its other keys
+        merged into the result.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            output = await rag_chain.ainvoke(question, config=config)
+            error = None
+        except Exception as e:
+            output = None
+            error = str(e)
+        latency = time.perf_counter() - start
+
+    result = {"question": question, "error": error, "latency": latency}
+    if isinstance(output, dict):
+        result.update(output)
+    else:
+        result["answer"] = output
+    return result
+
+
+async def abatch_rag(rag_chain, questions, max_concurrency: Optional[int] = None):
+    """
+    Answer a list of questions concurrently.
+
+    Args:
+        rag_chain: Any LangChain runnable that accepts a question string
+        questions: List of question strings
+        max_concurrency: Maximum number of in-flight requests
+
+    Returns:
+        List of result dicts (see `ainvoke_rag`), in the same order as `questions`
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or DEFAULT_MAX_CONCURRENCY)
+    return await asyncio.gather(
+        *(ainvoke_rag(rag_chain, question, semaphore) for question in questions)
+    )
+
+
+def batch_rag(rag_chain, questions, max_concurrency: Optional[int] = None):
+    """Synchronous wrapper around `abatch_rag` for use from scripts."""
+    return run_async(abatch_rag(rag_chain, questions, max_concurrency))
+
+
+def load_questions(path):
+    """
+    Load a question set from disk.
+
+    Supports plain text (one question per line) and JSONL files whose records
+    contain a "question" or "instruction" field, or a "text" field in the
+    "### Instruction: ... ### Response:" training format.
+    """
+    path = Path(path)
+    questions = []
+
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            if path.suffix not in (".jsonl", ".json"):
+                questions.append(line)
+                continue
+
+            record = json.loads(line)
+            question = record.get("question") or record.get("instruction")
+            if not question and "### Instruction:" in record.get("text", ""):
+                question = record["text"].split("### Instruction:")[1].split("### Response:")[0]
+            if question:
+                questions.append(question.strip())
+
+    return questions
@@ -0,0 +1,65 @@
+"""
+Batched generation for Hugging Face / Unsloth fine-tuned models.
+
+Answering evaluation questions one `model.generate` call at a time leaves
+the GPU mostly idle. Here prompts are left-padded into batches (similar
+lengths together) and generated in one call each; every sequence stops on
+its own at end-of-sequence or at the next "###" section.
+"""
+from utils.mlx_worker import PROMPT_TEMPLATE, extract_response
+
+
+DEFAULT_BATCH_SIZE = 8
+
+
+def generate_batch(model, tokenizer, questions, batch_size=DEFAULT_BATCH_SIZE,
+                   max_new_tokens=200, temperature=0.7, top_p=0.9):
+    """
+    Answer questions with a causal LM in batches.
+
+    Args:
+        model: Hugging Face (or Unsloth) causal LM, ready for inference
+        tokenizer: Its tokenizer
+        questions: List of question strings
+        batch_size: Prompts per `generate` call
+
+    Returns:
+        List of answers (the "### Response:" section), in the order of `questions`
+    """
+    import torch
+
+    prompts = [PROMPT_TEMPLATE.format(question=question) for question in questions]
+    # Batch prompts of similar length together to keep padding short
+    order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+    answers = [None] * len(prompts)
+
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"  # decoder-only models continue from the right edge
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    device = next(model.parameters()).device
+
+    sampling = {"do_sample": True, "temperature": temperature, "top_p": top_p} if temperature > 0 else {
+        "do_sample": False
+    }
+    try:
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            inputs = tokenizer([prompts[i] for i in indices], return_tensors="pt", padding=True).to(device)
+            with torch.no_grad():
+                outputs = model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    pad_token_id=tokenizer.pad_token_id,
+                    stop_strings=["###"],
+                    tokenizer=tokenizer,
+                    **sampling,
+                )
+            completions = tokenizer.batch_decode(
+                outputs[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True
+            )
+            for i, completion in zip(indices, completions):
+                answers[i] = extract_response(completion)
+    finally:
+        tokenizer.padding_side = padding_side
+    return answers
@@ -0,0 +1,142 @@
+"""
+Retrieval-confidence guard for the RAG chain.
+
+When the best retrieved chunk scores below a calibrated threshold, the
+question is almost certainly not covered by the knowledge base. The guarded
+chain then returns a canned answer straight away instead of paying for an LLM
+round trip that would end in "I don't know" anyway.
+
+The threshold is calibrated against a labelled question set with
+code/03b_calibrate_confidence.py and stored next to the vector store.
+"""
+import json
+from pathlib import Path
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
+
+from utils.context_packer import pack_context
+from utils.resilience import DEFAULT_DEADLINE, staged, with_deadline
+
+
+DEFAULT_CONFIDENCE_THRESHOLD = 0.3
+CONFIDENCE_PATH = Path("vectorstore") / "confidence.json"
+
+LOW_CONFIDENCE_ANSWER = (
+    "I couldn't find information about that in the TechCorp knowledge base. "
+    "Please rephrase your question or contact support@techcorp.com."
+)
+
+
+def load_confidence_threshold(path=CONFIDENCE_PATH, default=DEFAULT_CONFIDENCE_THRESHOLD):
+    """Load the calibrated threshold, or `default` if calibration hasn't been run."""
+    path = Path(path)
+    if not path.exists():
+        return default
+    with open(path, "r") as f:
+        return json.load(f)["threshold"]
+
+
+def save_confidence_threshold(threshold, stats=None, path=CONFIDENCE_PATH):
+    """Save a calibrated threshold (plus optional calibration stats)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"threshold": threshold, **(stats or {})}, f, indent=2)
+    return path
+
+
+def calibrate_threshold(in_kb_scores, off_topic_scores):
+    """
+    Pick the threshold that best separates answerable from off-topic questions.
+
+    Candidate thresholds are placed halfway between neighbouring observed
+    scores. The one with the highest balanced accuracy wins; ties go to the
+    lower threshold so answerable questions are not refused.
+
+    Args:
+        in_kb_scores: Best retrieval score for each answerable question
+        off_topic_scores: Best retrieval score for each off-topic question
+
+    Returns:
+        (threshold, stats dict)
+    """
+    scores = sorted(set(in_kb_scores) | set(off_topic_scores))
+    candidates = [scores[0]] + [(a + b) / 2 for a, b in zip(scores, scores[1:])]
+
+    best = None
+    for threshold in candidates:
+        answered = sum(score >= threshold for score in in_kb_scores) / len(in_kb_scores)
+        refused = sum(score < threshold for score in off_topic_scores) / len(off_topic_scores)
+        balanced_accuracy = (answered + refused) / 2
+        if best is None or balanced_accuracy > best[1]["balanced_accuracy"]:
+            best = (threshold, {
+                "balanced_accuracy": balanced_accuracy,
+                "in_kb_answered": answered,
+                "off_topic_refused": refused,
+            })
+
+    return best
+
+
+def top_score(docs):
+    """Best relevance score among retrieved documents (None if unscored)."""
+    scores = [doc.metadata["score"] for doc in docs if "score" in doc.metadata]
+    return max(scores) if scores else None
+
+
+def source_names(docs):
+    """Unique source file names of retrieved documents, in retrieval order."""
+    names = []
+    for doc in docs:
+        source = doc.metadata.get("source", "Unknown")
+        name = Path(source).name if source != "Unknown" else "Unknown"
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def build_guarded_rag_chain(retriever, prompt_template, llm,
+                            threshold=DEFAULT_CONFIDENCE_THRESHOLD, format_context=pack_context,
+                            deadline=DEFAULT_DEADLINE):
+    """
+    Build a RAG chain that skips the LLM when retrieval confidence is low.
+
+    The retriever must put relevance scores in `doc.metadata["score"]`
+    (e.g. AdaptiveRetriever); unscored results are always sent to the LLM.
+
+    Each question must be answered within `deadline` seconds (None for no
+    limit), split across retrieval and generation; past it the chain raises
+    utils.resilience.DeadlineExceeded instead of waiting on the provider.
+
+    Returns:
+        Runnable mapping a question to a dict with "answer", "sources",
+        "score" and "low_confidence"
+    """
+    answer_chain = (
+        RunnableLambda(lambda x: {"context": format_context(x["docs"]), "question": x["question"]})
+        | prompt_template
+        | staged("generate", llm)
+        | StrOutputParser()
+    )
+
+    def to_result(inputs, answer, low_confidence):
+        return {
+            "answer": answer,
+            "sources": [] if low_confidence else source_names(inputs["docs"]),
+            "score": top_score(inputs["docs"]),
+            "low_confidence": low_confidence,
+        }
+
+    generate = RunnablePassthrough.assign(answer=answer_chain) | RunnableLambda(
+        lambda x: to_result(x, x["answer"], False)
+    )
+
+    def route(inputs):
+        score = top_score(inputs["docs"])
+        if score is not None and score < threshold:
+            return RunnableLambda(lambda x: to_result(x, LOW_CONFIDENCE_ANSWER, True))
+        return generate
+
+    chain = RunnableParallel(docs=retriever, question=RunnablePassthrough()) | RunnableLambda(route)
+    return chain if deadline is None else with_deadline(chain, deadline)
@@ -0,0 +1,194 @@
+"""
+Token-budgeted context assembly for RAG prompts.
+
+Retrieved chunks overlap (the splitter uses a 200-character overlap) and
+neighbouring chunks from the same file are often retrieved together. Instead
+of concatenating every chunk in full, `pack_context`:
+
+1. Merges chunks from the same source that overlap or are adjacent
+2. Drops chunks whose text is already contained in another chunk
+3. Adds the merged sections in relevance order until a token budget is used
+"""
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+
+import tiktoken
+
+
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "1500"))
+DEFAULT_TOKEN_MODEL = "gpt-4o-mini"
+
+# Shortest suffix/prefix match treated as a real chunk overlap
+MIN_TEXT_OVERLAP = 20
+
+
+class ApproximateEncoding:
+    """
+    Stand-in for a tiktoken encoding when its BPE data cannot be downloaded
+    (air-gapped runs). Splits text into pieces of up to 4 word characters,
+    close to the ~4 characters per token of English text.
+    """
+
+    name = "approximate"
+    _pieces = re.compile(r"\w{1,4}|\s+|[^\w\s]")
+
+    def encode(self, text):
+        return self._pieces.findall(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = DEFAULT_TOKEN_MODEL):
+    """Get the tiktoken encoding for a model (falls back to cl100k_base)."""
+    # OpenRouter model names carry a provider prefix, e.g. "openai/gpt-4o-mini"
+    model = model.split("/")[-1]
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use
+        print(f"[WARNING] tiktoken encoding unavailable ({type(e).__name__}); using approximate token counts")
+        return ApproximateEncoding()
+
+
+def has_exact_tokenizer(model: str = DEFAULT_TOKEN_MODEL) -> bool:
+    """Whether tiktoken's encoding for `model` is available (False offline without cached BPE files)."""
+    return not isinstance(get_encoding(model), ApproximateEncoding)
+
+
+def count_tokens(text: str, model: str = DEFAULT_TOKEN_MODEL) -> int:
+    """Count the tokens in `text` for the given model."""
+    return len(get_encoding(model).encode(text))
+
+
+def _text_overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is a prefix of `right`."""
+    max_overlap = min(len(left), len(right))
+    for size in range(max_overlap, MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _try_merge(section, doc_text, doc_start):
+    """
+    Try to merge a chunk into a section from the same source.
+
+    Uses `start_index` offsets when both sides have them, and falls back to
+    matching overlapping text otherwise. Returns True if merged.
+    """
+    text = section["text"]
+
+    if section["start"] is not None and doc_start is not None:
+        start, end = section["start"], section["start"] + len(text)
+        doc_end = doc_start + len(doc_text)
+        if doc_start > end or doc_end < start:
+            return False
+        if doc_start < start:
+            text = doc_text[:start - doc_start] + text
+            start = doc_start
+        if doc_end > start + len(text):
+            text = text + doc_text[start + len(text) - doc_start:]
+        section["text"], section["start"] = text, start
+        return True
+
+    if doc_text in text:
+        return True
+    if text in doc_text:
+        section["text"], section["start"] = doc_text, doc_start
+        return True
+
+    overlap = _text_overlap(text, doc_text)
+    if overlap:
+        section["text"] = text + doc_text[overlap:]
+        return True
+
+    overlap = _text_overlap(doc_text, text)
+    if overlap:
+        section["text"], section["start"] = doc_text + text[overlap:], doc_start
+        return True
+
+    return False
+
+
+def merge_chunks(docs):
+    """
+    Merge overlapping chunks from the same source.
+
+    Args:
+        docs: Retrieved Documents, most relevant first
+
+    Returns:
+        List of section dicts (source, text, start), ordered by the rank of
+        the most relevant chunk in each section
+    """
+    sections = []
+
+    for doc in docs:
+        source = doc.metadata.get("source", "Unknown")
+        doc_start = doc.metadata.get("start_index")
+        same_source = [s for s in sections if s["source"] == source]
+
+        merged_into = None
+        for section in same_source:
+            if _try_merge(section, doc.page_content, doc_start):
+                merged_into = section
+                break
+
+        if merged_into is None:
+            sections.append({"source": source, "text": doc.page_content, "start": doc_start})
+            continue
+
+        # A merged section may now bridge the gap to another section
+        for other in same_source:
+            if other is merged_into or other not in sections:
+                continue
+            if _try_merge(merged_into, other["text"], other["start"]):
+                sections.remove(other)
+
+    return sections
+
+
+def _format_section(section):
+    source = section["source"]
+    source_name = Path(source).name if source != "Unknown" else "Unknown"
+    return f"Source: {source_name}\nContent: {section['text']}"
+
+
+def pack_context(docs, max_tokens: int = DEFAULT_CONTEXT_TOKENS, model: str = DEFAULT_TOKEN_MODEL):
+    """
+    Format retrieved documents for the prompt within a token budget.
+
+    Args:
+        docs: Retrieved Documents, most relevant first
+        max_tokens: Token budget for the whole context block
+        model: Model name used to pick the tokenizer
+
+    Returns:
+        Context string
+    """
+    encoding = get_encoding(model)
+    separator_tokens = len(encoding.encode("\n\n"))
+
+    parts = []
+    used = 0
+    for section in merge_chunks(docs):
+        text = _format_section(section)
+        tokens = encoding.encode(text)
+        cost = len(tokens) + (separator_tokens if parts else 0)
+
+        if used + cost <= max_tokens:
+            parts.append(text)
+            used += cost
+        elif not parts:
+            # Always include (a truncated copy of) the most relevant section
+            parts.append(encoding.decode(tokens[:max_tokens]))
+            used = max_tokens
+
+    return "\n\n".join(parts)
@@ -0,0 +1,322 @@
+"""
+Scoring and reporting for RAG vs fine-tuned model evaluations.
+
+Answers are scored against reference answers with cheap metrics that need no
+judge model:
+- token_f1: word overlap (SQuAD-style F1)
+- rouge_l: longest common word subsequence F-measure
+- embedding_similarity: cosine similarity of answer and reference embeddings
+
+Per system, the report has mean scores, latency percentiles, token counts
+and the API cost of those tokens (code/05b_evaluate_rag_vs_finetuning.py).
+"""
+import json
+import math
+import os
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.async_rag import ainvoke_rag, DEFAULT_MAX_CONCURRENCY
+
+
+# USD per million tokens, for API cost estimates (defaults: gpt-4o-mini list prices)
+PRICE_INPUT = float(os.getenv("RAG_PRICE_INPUT", "0.15"))
+PRICE_OUTPUT = float(os.getenv("RAG_PRICE_OUTPUT", "0.60"))
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+METRICS = ("token_f1", "rouge_l", "embedding_similarity")
+
+
+# ---------------------------------------------------------------------------
+# Question sets
+# ---------------------------------------------------------------------------
+
+def load_qa_pairs(path):
+    """
+    Load questions with reference answers.
+
+    Supports JSONL records with "question"/"instruction" and
+    "answer"/"output"/"response" fields, or a "text" field in the
+    "### Instruction: ... ### Response: ..." training format, and markdown
+    FAQs ("###" question headers, see utils.faq_index.parse_faq).
+
+    Returns:
+        List of dicts with "question", "reference" and "source"
+    """
+    path = Path(path)
+    if path.suffix == ".md":
+        from utils.faq_index import parse_faq
+
+        return [{"question": pair["question"], "reference": pair["answer"], "source": path.name}
+                for pair in parse_faq(path)]
+
+    pairs = []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            question = record.get("question") or record.get("instruction")
+            reference = record.get("answer") or record.get("output") or record.get("response")
+            text = record.get("text", "")
+            if not question and "### Instruction:" in text and "### Response:" in text:
+                # Split at the first markers only; a response may quote them again
+                question, _, reference = text.split("### Instruction:", 1)[1].partition("### Response:")
+            if question and reference:
+                pairs.append({"question": question.strip(), "reference": reference.strip(),
+                              "source": path.name})
+    return pairs
+
+
+def load_eval_set(paths):
+    """Load and merge question sets, keeping the first reference for repeated questions."""
+    seen = set()
+    items = []
+    for path in paths:
+        for pair in load_qa_pairs(path):
+            key = pair["question"].lower()
+            if key not in seen:
+                seen.add(key)
+                items.append(pair)
+    return items
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", (text or "").lower())
+
+
+def token_f1(answer, reference):
+    """Harmonic mean of word precision and recall against the reference."""
+    answer_tokens, reference_tokens = tokenize(answer), tokenize(reference)
+    if not answer_tokens or not reference_tokens:
+        return 0.0
+    counts = {}
+    for token in reference_tokens:
+        counts[token] = counts.get(token, 0) + 1
+    common = 0
+    for token in answer_tokens:
+        if counts.get(token, 0) > 0:
+            counts[token] -= 1
+            common += 1
+    if common == 0:
+        return 0.0
+    precision, recall = common / len(answer_tokens), common / len(reference_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_l(answer, reference):
+    """ROUGE-L F-measure: longest common word subsequence."""
+    a, b = tokenize(answer), tokenize(reference)
+    if not a or not b:
+        return 0.0
+    previous = [0] * (len(b) + 1)
+    for token in a:
+        current = [0]
+        for j, other in enumerate(b):
+            current.append(previous[j] + 1 if token == other else max(previous[j + 1], current[j]))
+        previous = current
+    lcs = previous[-1]
+    if lcs == 0:
+        return 0.0
+    precision, recall = lcs / len(a), lcs / len(b)
+    return 2 * precision * recall / (precision + recall)
+
+
+def embedding_similarities(embeddings, answers, references):
+    """Cosine similarity of each answer to its reference (None for missing answers), in one embedding batch."""
+    indices = [i for i, answer in enumerate(answers) if answer]
+    if not indices:
+        return [None] * len(answers)
+    texts = [answers[i] for i in indices] + [references[i] for i in indices]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    half = len(indices)
+    cosines = (vectors[:half] * vectors[half:]).sum(axis=1)
+
+    similarities = [None] * len(answers)
+    for i, cosine in zip(indices, cosines):
+        similarities[i] = float(cosine)
+    return similarities
+
+
+def score_results(results, references, embeddings=None):
+    """Add metric scores to result dicts (in place) against the matching references."""
+    answers = [None if result.get("error") else result.get("answer") for result in results]
+    for result, answer, reference in zip(results, answers, references):
+        result["token_f1"] = token_f1(answer, reference) if answer else 0.0
+        result["rouge_l"] = rouge_l(answer, reference) if answer else 0.0
+    if embeddings is not None:
+        for result, similarity in zip(results, embedding_similarities(embeddings, answers, references)):
+            result["embedding_similarity"] = similarity
+    return results
+
+
+def percentile(values, p):
+    """Linear-interpolated percentile (p in 0-100) of a list of numbers."""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * p / 100
+    low, high = math.floor(position), math.ceil(position)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+# ---------------------------------------------------------------------------
+# Running the RAG chain with token accounting
+# ---------------------------------------------------------------------------
+
+class UsageTracker(BaseCallbackHandler):
+    """Collects prompt/completion token counts reported by chat model calls."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage")
+        if usage:
+            self.prompt_tokens += usage.get("prompt_tokens", 0) or 0
+            self.completion_tokens += usage.get("completion_tokens", 0) or 0
+            return
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if metadata:
+                    self.prompt_tokens += metadata.get("input_tokens", 0)
+                    self.completion_tokens += metadata.get("output_tokens", 0)
+
+
+async def aevaluate_rag(rag_chain, questions, max_concurrency=None):
+    """
+    Answer questions concurrently, recording latency and token usage per question.
+
+    Returns:
+        Result dicts as from utils.async_rag.ainvoke_rag, plus
+        "prompt_tokens" and "completion_tokens"
+    """
+    import asyncio
+
+    semaphore = asyncio.Semaphore(max_concurrency or DEFAULT_MAX_CONCURRENCY)
+
+    async def run(question):
+        tracker = UsageTracker()
+        result = await ainvoke_rag(rag_chain, question, semaphore, config={"callbacks": [tracker]})
+        result["prompt_tokens"] = tracker.prompt_tokens
+        result["completion_tokens"] = tracker.completion_tokens
+        return result
+
+    return await asyncio.gather(*(run(question) for question in questions))
+
+
+# ---------------------------------------------------------------------------
+# Reports
+# ---------------------------------------------------------------------------
+
+def summarize(results, price_input=0.0, price_output=0.0, wall_seconds=None):
+    """
+    Aggregate one system's scored results.
+
+    Args:
+        price_input / price_output: USD per million prompt / completion tokens
+            (0 for local models)
+        wall_seconds: Time the whole question set took
+    """
+    ok = [result for result in results if not result.get("error")]
+    latencies = [result["latency"] for result in ok if result.get("latency") is not None]
+    prompt_tokens = sum(result.get("prompt_tokens") or 0 for result in results)
+    completion_tokens = sum(result.get("completion_tokens") or 0 for result in results)
+    cost = (prompt_tokens * price_input + completion_tokens * price_output) / 1_000_000
+
+    summary = {"questions": len(results), "errors": len(results) - len(ok)}
+    for metric in METRICS:
+        values = [result[metric] for result in results if result.get(metric) is not None]
+        summary[metric] = sum(values) / len(values) if values else None
+    summary["latency_mean"] = sum(latencies) / len(latencies) if latencies else None
+    for p in LATENCY_PERCENTILES:
+        summary[f"latency_p{p}"] = percentile(latencies, p)
+    summary.update({
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": cost,
+        "cost_per_question_usd": cost / len(results) if results else 0.0,
+        "wall_seconds": wall_seconds,
+    })
+    return summary
+
+
+def _fmt(value, digits=3):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    return str(value)
+
+
+def render_markdown(report):
+    """Markdown version of a report from `build_report`."""
+    systems = list(report["summary"])
+    lines = [
+        "# RAG vs Fine-Tuning Evaluation",
+        "",
+        f"Generated {report['created']} on {report['questions']} questions "
+        f"({', '.join(report['question_sets'])}).",
+        "",
+        "## Summary",
+        "",
+        "| Metric | " + " | ".join(systems) + " |",
+        "|---|" + "---|" * len(systems),
+    ]
+    rows = [("Token F1", "token_f1", 3), ("ROUGE-L", "rouge_l", 3),
+            ("Embedding similarity", "embedding_similarity", 3),
+            ("Errors", "errors", 0), ("Latency mean (s)", "latency_mean", 2)]
+    rows += [(f"Latency p{p} (s)", f"latency_p{p}", 2) for p in LATENCY_PERCENTILES]
+    rows += [("Prompt tokens", "prompt_tokens", 0), ("Completion tokens", "completion_tokens", 0),
+             ("Cost (USD)", "cost_usd", 4), ("Cost per question (USD)", "cost_per_question_usd", 5),
+             ("Wall time (s)", "wall_seconds", 1)]
+    for label, key, digits in rows:
+        lines.append(f"| {label} | " + " | ".join(
+            _fmt(report["summary"][system].get(key), digits) for system in systems
+        ) + " |")
+
+    lines += ["", "## Per question (token F1)", "",
+              "| Question | " + " | ".join(systems) + " |",
+              "|---|" + "---|" * len(systems)]
+    for i, item in enumerate(report["items"]):
+        question = item["question"].replace("|", "\\|")
+        lines.append(f"| {question} | " + " | ".join(
+            _fmt(report["results"][system][i].get("token_f1")) for system in systems
+        ) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def build_report(items, results_by_system, summaries, question_sets):
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "questions": len(items),
+        "question_sets": [str(path) for path in question_sets],
+        "items": items,
+        "summary": summaries,
+        "results": results_by_system,
+    }
+
+
+def write_report(report, output_prefix):
+    """Write `<prefix>.json` and `<prefix>.md`; returns both paths."""
+    output_prefix = Path(output_prefix)
+    output_prefix.parent.mkdir(parents=True, exist_ok=True)
+    json_path = output_prefix.with_suffix(".json")
+    md_path = output_prefix.with_suffix(".md")
+    with open(json_path, "w") as f:
+        json.dump(report, f, indent=2)
+    with open(md_path, "w") as f:
+        f.write(render_markdown(report))
+    return json_path, md_path
@@ -0,0 +1,173 @@
+"""
+Direct-answer index over the curated FAQ.
+
+faq.md is a list of "### Question" headers followed by curated answers. The
+serving path embeds those questions once at startup; when a user question is
+a near-duplicate of an FAQ question, the curated answer is returned directly,
+skipping retrieval and the LLM.
+"""
+from pathlib import Path
+
+import numpy as np
+from langchain_core.runnables import RunnableLambda
+
+from utils.resilience import stage
+from utils.retrieval import EMBEDDING_ERRORS, cache_query_embedding
+
+
+FAQ_PATH = Path("knowledge_base") / "faq.md"
+
+# Cosine similarity above which a user question counts as an FAQ question
+DEFAULT_FAQ_THRESHOLD = 0.92
+
+
+def parse_faq(path=FAQ_PATH):
+    """
+    Parse "###" question headers and their answers from a markdown FAQ.
+
+    Args:
+        path: Path to the FAQ markdown file
+
+    Returns:
+        List of dicts with "question" and "answer"
+    """
+    with open(path, "r") as f:
+        lines = f.read().split("\n")
+
+    qa_pairs = []
+    current_question = None
+    current_answer = []
+
+    def flush():
+        answer = "\n".join(current_answer).strip()
+        if current_question and answer:
+            qa_pairs.append({"question": current_question, "answer": answer})
+
+    for line in lines:
+        if line.startswith("#"):
+            # Any header ends the current answer; "###" headers start a new one
+            flush()
+            current_question = line.replace("###", "").strip() if line.startswith("###") else None
+            current_answer = []
+        elif current_question:
+            current_answer.append(line)
+
+    flush()
+    return qa_pairs
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class FAQIndex:
+    """Embedding index of FAQ questions with their curated answers."""
+
+    def __init__(self, embeddings, qa_pairs, source="faq.md", threshold=DEFAULT_FAQ_THRESHOLD):
+        self.embeddings = embeddings
+        self.qa_pairs = qa_pairs
+        self.source = source
+        self.threshold = threshold
+        # One batched embedding request for all FAQ questions
+        self.vectors = _normalize(embeddings.embed_documents([qa["question"] for qa in qa_pairs]))
+
+    @classmethod
+    def from_markdown(cls, embeddings, path=FAQ_PATH, threshold=DEFAULT_FAQ_THRESHOLD):
+        """Build the index from a markdown FAQ file."""
+        path = Path(path)
+        return cls(embeddings, parse_faq(path), source=path.name, threshold=threshold)
+
+    def _best(self, query_vector):
+        similarities = self.vectors @ _normalize(query_vector)
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+    def _to_match(self, best, similarity):
+        if similarity < self.threshold:
+            return None
+        qa = self.qa_pairs[best]
+        return {
+            "answer": qa["answer"],
+            "sources": [self.source],
+            "score": similarity,
+            "low_confidence": False,
+            "faq_question": qa["question"],
+        }
+
+    def lookup(self, question):
+        """
+        Look up a user question.
+
+        Returns:
+            (match, query_vector): the result dict of `match` or None, and the
+            question's embedding (None if the FAQ is empty) for reuse by
+            retrieval
+        """
+        if not self.qa_pairs:
+            return None, None
+        with stage("embed"):
+            query_vector = self.embeddings.embed_query(question)
+        return self._to_match(*self._best(query_vector)), query_vector
+
+    async def alookup(self, question):
+        """Async version of `lookup`."""
+        if not self.qa_pairs:
+            return None, None
+        with stage("embed"):
+            query_vector = await self.embeddings.aembed_query(question)
+        return self._to_match(*self._best(query_vector)), query_vector
+
+    def match(self, question):
+        """
+        Look up a user question.
+
+        Returns:
+            Result dict (same shape as the guarded RAG chain's, plus
+            "faq_question") if an FAQ question is similar enough, else None
+        """
+        return self.lookup(question)[0]
+
+    async def amatch(self, question):
+        """Async version of `match`."""
+        return (await self.alookup(question))[0]
+
+
+def with_faq_answers(faq_index, rag_chain, retriever=None):
+    """
+    Put an FAQ lookup in front of a RAG chain.
+
+    Questions matching an FAQ question return the curated answer; all other
+    questions go to `rag_chain`, which should return the same dict shape
+    (e.g. the chain from build_guarded_rag_chain).
+
+    Pass the chain's `retriever` (AdaptiveRetriever or HybridRetriever) to
+    hand it the question embedding from the lookup, so questions that miss
+    the FAQ are not embedded a second time for retrieval. The FAQ index must
+    use the vector store's embedding model. If the lookup's embedding call
+    fails, the question goes to `rag_chain` unmatched.
+    """
+    def to_rag(question, query_vector):
+        if retriever is not None and query_vector is not None:
+            cache_query_embedding(retriever, question, query_vector)
+        return rag_chain
+
+    # Returning a runnable from a RunnableLambda invokes it with the same input.
+    # If embedding fails, the RAG chain still answers (e.g. HybridRetriever
+    # from the keyword index alone)
+    def route(question):
+        try:
+            match, query_vector = faq_index.lookup(question)
+        except EMBEDDING_ERRORS:
+            return rag_chain
+        return to_rag(question, query_vector) if match is None else RunnableLambda(lambda _: match)
+
+    async def aroute(question):
+        try:
+            match, query_vector = await faq_index.alookup(question)
+        except EMBEDDING_ERRORS:
+            return rag_chain
+        return to_rag(question, query_vector) if match is None else RunnableLambda(lambda _: match)
+
+    return RunnableLambda(route, afunc=aroute)
@@ -0,0 +1,255 @@
+"""
+Pools of API keys for one provider, with client-side rate tracking.
+
+Providers rate-limit per key (requests and tokens per minute). With a pool of
+keys, each request is sent with the key that has the most headroom left in
+the current minute, so aggregate throughput grows with the number of keys.
+
+Keys are listed comma-separated in OPENROUTER_API_KEYS / OPENAI_API_KEYS.
+Per-key limits default to RAG_KEY_RPM / RAG_KEY_TPM; rate-limit headers from
+the provider and 429 responses refine them as requests come back.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+import httpx
+
+
+WINDOW_SECONDS = 60.0
+DEFAULT_RPM = int(os.getenv("RAG_KEY_RPM", "500"))
+DEFAULT_TPM = int(os.getenv("RAG_KEY_TPM", "200000"))
+
+# Completion tokens assumed when a request doesn't set max_tokens
+DEFAULT_COMPLETION_TOKENS = 256
+
+# How long to rest a key after a 429 without a Retry-After header
+DEFAULT_COOLDOWN = 10.0
+
+
+def parse_keys(value):
+    """Split a comma-separated key list, dropping blanks and duplicates."""
+    keys = []
+    for key in (value or "").split(","):
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def env_key(name):
+    """
+    The API key for `name` (e.g. "OPENAI_API_KEY"): the variable itself, or
+    else the first key of its pool variable (e.g. "OPENAI_API_KEYS").
+    """
+    keys = parse_keys(os.getenv(f"{name}S"))
+    return os.getenv(name) or (keys[0] if keys else None)
+
+
+def estimate_tokens(request):
+    """Rough token cost of an API request: ~4 characters per prompt token plus the completion."""
+    content = request.content
+    if not content:
+        return 1
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return len(content) // 4
+    completion = body.get("max_tokens") or body.get("max_completion_tokens")
+    if completion is None:
+        completion = DEFAULT_COMPLETION_TOKENS if "messages" in body else 0
+    return len(content) // 4 + completion
+
+
+class KeyState:
+    """Sliding-window request and token counts for one API key."""
+
+    def __init__(self, key, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.key = key
+        self.rpm = rpm
+        self.tpm = tpm
+        self.events = deque()  # (timestamp, tokens)
+        self.tokens_in_window = 0
+        self.cooldown_until = 0.0
+        # Remaining fraction reported by the provider's rate-limit headers
+        self.reported = None
+        self.reported_at = 0.0
+
+    def _expire(self, now):
+        while self.events and now - self.events[0][0] >= WINDOW_SECONDS:
+            self.tokens_in_window -= self.events.popleft()[1]
+
+    def headroom(self, tokens, now):
+        """Fraction of this key's per-minute budget left after sending `tokens`."""
+        if now < self.cooldown_until:
+            return -1.0
+        self._expire(now)
+        headroom = min(
+            1 - (len(self.events) + 1) / self.rpm,
+            1 - (self.tokens_in_window + tokens) / self.tpm,
+        )
+        if self.reported is not None and now - self.reported_at < WINDOW_SECONDS:
+            headroom = min(headroom, self.reported)
+        return headroom
+
+    def record(self, tokens, now):
+        self.events.append((now, tokens))
+        self.tokens_in_window += tokens
+
+    def update_from_response(self, response, now):
+        """Take the provider's own view of the limits into account."""
+        if response.status_code == 429:
+            retry_after = response.headers.get("retry-after")
+            try:
+                cooldown = float(retry_after) if retry_after else DEFAULT_COOLDOWN
+            except ValueError:
+                cooldown = DEFAULT_COOLDOWN
+            self.cooldown_until = now + cooldown
+            return
+
+        fractions = []
+        for kind in ("requests", "tokens"):
+            limit = response.headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = response.headers.get(f"x-ratelimit-remaining-{kind}")
+            try:
+                if limit and remaining and float(limit) > 0:
+                    fractions.append(float(remaining) / float(limit))
+            except ValueError:
+                pass
+        if fractions:
+            self.reported = min(fractions)
+            self.reported_at = now
+
+    def stats(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        return {
+            "key": f"...{self.key[-4:]}",
+            "requests_last_minute": len(self.events),
+            "tokens_last_minute": self.tokens_in_window,
+            "cooling_down": now < self.cooldown_until,
+        }
+
+
+class KeyPool:
+    """
+    A provider's API keys; hands out the key with the most headroom.
+
+    Args:
+        keys: List of API keys
+        rpm: Requests per minute allowed per key
+        tpm: Tokens per minute allowed per key
+    """
+
+    def __init__(self, keys, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        if not keys:
+            raise ValueError("KeyPool needs at least one key")
+        self.keys = [KeyState(key, rpm, tpm) for key in keys]
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """Pick a key for a request costing about `tokens` and count it against that key."""
+        with self._lock:
+            now = time.monotonic()
+            best = max(self.keys, key=lambda state: state.headroom(tokens, now))
+            best.record(tokens, now)
+            return best
+
+    def has_headroom(self):
+        """Whether any key is not cooling down after a 429."""
+        with self._lock:
+            now = time.monotonic()
+            return any(now >= state.cooldown_until for state in self.keys)
+
+    def update(self, state, response):
+        with self._lock:
+            state.update_from_response(response, time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return [state.stats(now) for state in self.keys]
+
+
+def _sign(pool, request):
+    state = pool.acquire(estimate_tokens(request))
+    request.headers["authorization"] = f"Bearer {state.key}"
+    return state
+
+
+class KeyPoolTransport(httpx.BaseTransport):
+    """
+    Sync httpx transport that signs each request with the pool key with the
+    most headroom. A 429 is retried at once with another key while one has
+    headroom left, instead of making the client back off.
+    """
+
+    def __init__(self, pools, transport=None):
+        self.pools = pools
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        pool = self.pools.get(request.url.netloc.decode())
+        if pool is None:
+            return self.transport.handle_request(request)
+
+        for _ in range(len(pool.keys)):
+            state = _sign(pool, request)
+            response = self.transport.handle_request(request)
+            pool.update(state, response)
+            if response.status_code != 429 or not pool.has_headroom():
+                return response
+            response.close()
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncKeyPoolTransport(httpx.AsyncBaseTransport):
+    """Async version of KeyPoolTransport."""
+
+    def __init__(self, pools, transport=None):
+        self.pools = pools
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request):
+        pool = self.pools.get(request.url.netloc.decode())
+        if pool is None:
+            return await self.transport.handle_async_request(request)
+
+        for _ in range(len(pool.keys)):
+            state = _sign(pool, request)
+            response = await self.transport.handle_async_request(request)
+            pool.update(state, response)
+            if response.status_code != 429 or not pool.has_headroom():
+                return response
+            await response.aclose()
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def load_key_pools():
+    """
+    Load key pools from the environment.
+
+    Returns:
+        Dict mapping endpoint host (e.g. "openrouter.ai") to KeyPool, for
+        providers with more than one key configured
+    """
+    from utils.routing import OPENAI_BASE_URL, OPENROUTER_BASE_URL
+
+    pools = {}
+    for env, base_url in (
+        ("OPENROUTER_API_KEYS", OPENROUTER_BASE_URL),
+        ("OPENAI_API_KEYS", os.getenv("OPENAI_BASE_URL") or OPENAI_BASE_URL),
+    ):
+        keys = parse_keys(os.getenv(env))
+        if len(keys) > 1:
+            pools[urlparse(base_url).netloc] = KeyPool(keys)
+    return pools
@@ -0,0 +1,181 @@
+"""
+BM25 keyword index over the vector store's chunks.
+
+Embedding search misses exact terms such as "SOC 2", "2FA" or "$25": their
+vectors are dominated by the surrounding prose. A BM25 inverted index over
+the same chunks finds them, needs no embedding call, and is built once by
+code/02_create_vectorstore.py and saved next to the FAISS index.
+
+Documents are identified by their position in the FAISS index, so keyword
+and vector hits can be fused (`reciprocal_rank_fusion`, see
+utils/retrieval.HybridRetriever).
+"""
+import json
+import math
+import re
+from pathlib import Path
+
+import numpy as np
+
+
+LEXICAL_INDEX_FILE = "bm25.json"
+
+# Standard BM25 parameters: term-frequency saturation and length normalization
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+
+# Rank offset in reciprocal rank fusion; 60 is the value from the original paper
+DEFAULT_RRF_K = 60
+
+
+def tokenize(text):
+    """Lowercase words and numbers ("2fa", "soc", "2", "25.00")."""
+    return re.findall(r"[a-z0-9]+(?:\.[0-9]+)?", text.lower())
+
+
+def reciprocal_rank_fusion(rankings, k=DEFAULT_RRF_K):
+    """
+    Fuse ranked lists of ids: each id scores sum(1 / (k + rank)) over the
+    lists it appears in (rank starting at 1).
+
+    Returns:
+        List of (id, fused score) pairs, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+
+class BM25Index:
+    """
+    Inverted index with precomputed BM25 weights.
+
+    Args:
+        doc_ids: Docstore id of the chunk at each FAISS position
+        postings: term -> (positions, term frequencies)
+        doc_lengths: Token count of each chunk
+    """
+
+    def __init__(self, doc_ids, postings, doc_lengths, k1=DEFAULT_K1, b=DEFAULT_B):
+        self.doc_ids = list(doc_ids)
+        self.postings = postings
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        self.k1 = k1
+        self.b = b
+
+        count = len(self.doc_ids)
+        average_length = float(self.doc_lengths.mean()) if count else 0.0
+        # Per-posting weight idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)),
+        # so a query only sums the weights of its terms' postings
+        self._weights = {}
+        for term, (positions, frequencies) in postings.items():
+            positions = np.asarray(positions, dtype=np.int64)
+            frequencies = np.asarray(frequencies, dtype=np.float32)
+            idf = math.log(1 + (count - len(positions) + 0.5) / (len(positions) + 0.5))
+            norm = k1 * (1 - b + b * self.doc_lengths[positions] / max(average_length, 1e-9))
+            self._weights[term] = (positions, idf * frequencies * (k1 + 1) / (frequencies + norm))
+
+    @classmethod
+    def from_texts(cls, doc_ids, texts, k1=DEFAULT_K1, b=DEFAULT_B):
+        postings = {}
+        doc_lengths = []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, frequency in counts.items():
+                entry = postings.setdefault(term, ([], []))
+                entry[0].append(position)
+                entry[1].append(frequency)
+        return cls(doc_ids, postings, doc_lengths, k1=k1, b=b)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, k1=DEFAULT_K1, b=DEFAULT_B):
+        """Index every chunk of a LangChain FAISS store, in FAISS index order."""
+        doc_ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+        texts = [vectorstore.docstore.search(doc_id).page_content for doc_id in doc_ids]
+        return cls.from_texts(doc_ids, texts, k1=k1, b=b)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def scores(self, query):
+        """BM25 score of every chunk for `query`."""
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self._weights:
+                positions, weights = self._weights[term]
+                scores[positions] += weights
+        return scores
+
+    def search(self, query, k=10, positions=None):
+        """
+        Top-`k` chunks containing any query term.
+
+        Args:
+            positions: Only rank the chunks at these FAISS positions
+                (e.g. from utils.metadata_index.MetadataIndex.select)
+
+        Returns:
+            List of (FAISS position, BM25 score) pairs, best first
+        """
+        scores = self.scores(query)
+        if positions is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed[positions] = True
+            scores[~allowed] = 0.0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(position), float(scores[position])) for position in top]
+
+    def matches(self, vectorstore):
+        """Whether this index was built from `vectorstore` (same chunks in the same order)."""
+        return len(self.doc_ids) == len(vectorstore.index_to_docstore_id) and all(
+            vectorstore.index_to_docstore_id[i] == doc_id for i, doc_id in enumerate(self.doc_ids)
+        )
+
+    def save(self, folder_path):
+        """Write the index to `<folder_path>/bm25.json`."""
+        path = Path(folder_path) / LEXICAL_INDEX_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "doc_ids": self.doc_ids,
+                "doc_lengths": self.doc_lengths.astype(int).tolist(),
+                "postings": {term: [list(map(int, positions)), list(map(int, frequencies))]
+                             for term, (positions, frequencies) in self.postings.items()},
+            }, f)
+        return path
+
+    @classmethod
+    def load(cls, folder_path):
+        with open(Path(folder_path) / LEXICAL_INDEX_FILE, "r") as f:
+            data = json.load(f)
+        return cls(data["doc_ids"], data["postings"], data["doc_lengths"], k1=data["k1"], b=data["b"])
+
+
+def load_lexical_index(folder_path, vectorstore=None):
+    """
+    Load the BM25 index saved next to a vector store.
+
+    Returns:
+        BM25Index, or None if there is none or (given `vectorstore`) it is
+        out of date
+    """
+    if not (Path(folder_path) / LEXICAL_INDEX_FILE).exists():
+        return None
+    index = BM25Index.load(folder_path)
+    if vectorstore is not None and not index.matches(vectorstore):
+        print(f"[WARNING] {LEXICAL_INDEX_FILE} does not match the vector store; "
+              "rerun code/02_create_vectorstore.py to rebuild it")
+        return None
+    return index
@@ -0,0 +1,220 @@
+"""
+Offline embedding providers.
+
+Building the index and embedding every query through the API costs a network
+round trip and per-token fees. With EMBEDDING_PROVIDER set, embeddings are
+computed in-process instead (see utils/api_config.create_embeddings):
+
+- local: a sentence-embedding model from a directory on disk
+  (LOCAL_EMBEDDING_MODEL, e.g. a download of BAAI/bge-small-en-v1.5 or
+  sentence-transformers/all-MiniLM-L6-v2). Runs the model's ONNX export with
+  onnxruntime when there is one, else PyTorch; texts are embedded in batches
+  of similar length on all CPU cores.
+- hash: no model and no dependencies beyond numpy. Words and word pairs are
+  hashed to fixed random vectors (a random projection of the bag of words),
+  so texts that share vocabulary are similar. Cruder than a trained model,
+  but enough for tests and keyword-heavy FAQ retrieval.
+
+A vector store must be queried with the embeddings it was built with:
+rebuild it (code/02_create_vectorstore.py) after switching provider. Step 2
+records the model next to the index, and loading checks it
+(utils.api_config.check_embedding_model).
+
+Optional dependencies for "local": pip install torch transformers
+(or onnxruntime transformers for ONNX models)
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+# Values of EMBEDDING_PROVIDER (read by utils.api_config.get_embedding_provider):
+# "api" (OpenAI/OpenRouter), "local" or "hash"
+EMBEDDING_PROVIDERS = ("api", "local", "hash")
+
+LOCAL_EMBEDDING_MODEL = Path(os.getenv("LOCAL_EMBEDDING_MODEL", "models/embeddings"))
+
+DEFAULT_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+DEFAULT_MAX_LENGTH = 512
+
+# Matches text-embedding-3-small, so FAISS index sizes stay comparable
+DEFAULT_HASH_DIMENSIONS = int(os.getenv("HASH_EMBEDDING_DIMENSIONS", "1536"))
+
+
+def _normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+# ---------------------------------------------------------------------------
+# Hashed embeddings
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=65536)
+def _feature_vector(feature, dimensions):
+    seed = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+
+
+def hash_embedding(text, dimensions=DEFAULT_HASH_DIMENSIONS):
+    """Deterministic unit vector for `text` from its words and word pairs."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature in features or [""]:
+        vector += _feature_vector(feature, dimensions)
+    return _normalize(vector)
+
+
+class HashEmbeddings(Embeddings):
+    """Dependency-free hashed bag-of-words embeddings."""
+
+    def __init__(self, dimensions: int = DEFAULT_HASH_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [hash_embedding(text, self.dimensions).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return hash_embedding(text, self.dimensions).tolist()
+
+
+# ---------------------------------------------------------------------------
+# Sentence-embedding models
+# ---------------------------------------------------------------------------
+
+def _onnx_model_file(path):
+    for candidate in (path / "model.onnx", path / "onnx" / "model.onnx"):
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def _pooling_mode(path):
+    """Pooling ("cls" or "mean") from a sentence-transformers config; mean if there is none."""
+    config_path = path / "1_Pooling" / "config.json"
+    if config_path.exists():
+        with open(config_path) as f:
+            if json.load(f).get("pooling_mode_cls_token"):
+                return "cls"
+    return "mean"
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Sentence embeddings from a local model directory, computed on CPU.
+
+    Args:
+        model_path: Directory with the tokenizer and either model.onnx
+            (onnx/model.onnx) or PyTorch weights
+        batch_size: Texts per forward pass
+        num_threads: CPU threads (default: all cores)
+        max_length: Longest input in tokens; longer texts are truncated
+    """
+
+    def __init__(self, model_path=LOCAL_EMBEDDING_MODEL, batch_size: int = DEFAULT_BATCH_SIZE,
+                 num_threads: int = None, max_length: int = DEFAULT_MAX_LENGTH):
+        self.model_path = Path(model_path)
+        if not self.model_path.exists():
+            raise FileNotFoundError(
+                f"Embedding model not found at {self.model_path}. Download a sentence-embedding model, e.g.\n"
+                f"  huggingface-cli download BAAI/bge-small-en-v1.5 --local-dir {self.model_path}"
+            )
+        try:
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError(f"transformers is not installed ({e}). Install with: pip install transformers") from e
+
+        self.batch_size = batch_size
+        self.num_threads = num_threads or os.cpu_count()
+        self.pooling = _pooling_mode(self.model_path)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+        self.max_length = min(max_length, self.tokenizer.model_max_length)
+        self.session = None
+        self.model = None
+        self._lock = threading.Lock()
+
+        onnx_file = _onnx_model_file(self.model_path)
+        if onnx_file is not None:
+            try:
+                import onnxruntime
+            except ImportError:
+                onnx_file = None
+        if onnx_file is not None:
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.num_threads
+            self.session = onnxruntime.InferenceSession(str(onnx_file), options,
+                                                        providers=["CPUExecutionProvider"])
+            self.input_names = {node.name for node in self.session.get_inputs()}
+            self.backend = "onnx"
+        else:
+            try:
+                import torch
+                from transformers import AutoModel
+            except ImportError as e:
+                raise ImportError(
+                    f"Local embeddings need PyTorch or onnxruntime ({e}). "
+                    "Install with: pip install torch transformers"
+                ) from e
+            torch.set_num_threads(self.num_threads)
+            self.model = AutoModel.from_pretrained(self.model_path).eval()
+            self.backend = "torch"
+
+    def _forward(self, texts):
+        if self.session is not None:
+            inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                    return_tensors="np")
+            feeds = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            mask = inputs["attention_mask"]
+        else:
+            import torch
+
+            inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                    return_tensors="pt")
+            with torch.inference_mode():
+                hidden = self.model(**inputs).last_hidden_state.float().numpy()
+            mask = inputs["attention_mask"].numpy()
+
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            weights = mask[..., None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        return _normalize(pooled.astype(np.float32))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Batch texts of similar length together to keep padding short
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        with self._lock:
+            for start in range(0, len(order), self.batch_size):
+                indices = order[start:start + self.batch_size]
+                for i, vector in zip(indices, self._forward([texts[i] for i in indices])):
+                    vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_local_embeddings(model_path=LOCAL_EMBEDDING_MODEL, batch_size=DEFAULT_BATCH_SIZE):
+    """Load a local embedding model once per process."""
+    key = (str(Path(model_path).resolve()), batch_size)
+    with _models_lock:
+        if key not in _models:
+            _models[key] = LocalEmbeddings(model_path, batch_size=batch_size)
+    return _models[key]
@@ -0,0 +1,860 @@
+"""
+Local CPU inference for the bundled Qwen2.5-1.5B-Instruct model.
+
+Runs models/techcorp-qwen2.5-1.5b-instruct in-process with PyTorch, so the
+RAG chain can generate answers offline with no per-token cost. Select it with
+LLM_PROVIDER=local (see utils/api_config.create_chat_model).
+
+The exported model is MLX 4-bit (weights packed into uint32 with per-group
+scales and biases), which transformers cannot load directly. The loader here
+reads the safetensors shards itself, dequantizes them, and runs a compact
+Qwen2 implementation with its own KV cache and decode loop. Plain
+(unquantized) Hugging Face Qwen2 checkpoints load the same way.
+
+Weights are loaded once per process (`load_local_model` is cached).
+
+Every RAG prompt starts with the same preamble, and popular questions pull in
+the same context chunks. The key/value states of recent prompts are kept in
+an LRU `PrefixCache`, so prefill only runs over the part of a prompt that
+differs from the closest earlier one.
+
+Decoding is speculative by prompt lookup: RAG answers copy long spans from
+the retrieved context, so the tokens that followed the latest n-gram's
+previous occurrence in the prompt (or the answer so far) are proposed as a
+draft and checked in a single forward pass. Accepted drafts cost one weight
+read for several tokens; the output is the same as without drafting.
+
+Optional dependencies: pip install torch transformers safetensors
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Iterator, List, Optional
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from utils.lora import AdapterRegistry, read_adapter
+from utils.resilience import DeadlineExceeded, current_timeout
+
+
+LOCAL_MODEL_PATH = Path(os.getenv("LOCAL_MODEL_PATH", "models/techcorp-qwen2.5-1.5b-instruct"))
+
+# bfloat16 halves memory (~3 GB for 1.5B parameters); float32 is more portable
+LOCAL_DTYPE = os.getenv("LOCAL_LLM_DTYPE", "bfloat16")
+
+# "int8" or "int4" to run from weights written by code/09b_quantize_local_model.py
+LOCAL_QUANTIZATION = os.getenv("LOCAL_LLM_QUANT") or None
+
+DEFAULT_MAX_NEW_TOKENS = 512
+
+# Most tokens drafted per step by prompt lookup (0 disables speculative decoding)
+DEFAULT_DRAFT_TOKENS = int(os.getenv("LOCAL_LLM_DRAFT_TOKENS", "8"))
+
+# Prompt tokens whose key/value states are kept for reuse (0 disables the
+# prefix cache); about 28 KB per token for the 1.5B model in bfloat16
+DEFAULT_PREFIX_CACHE_TOKENS = int(os.getenv("LOCAL_PREFIX_CACHE_TOKENS", "16384"))
+
+# Longest / shortest suffix n-gram looked up when drafting
+MAX_NGRAM = 3
+MIN_NGRAM = 1
+
+
+# ---------------------------------------------------------------------------
+# Model
+# ---------------------------------------------------------------------------
+
+class KVCache:
+    """
+    Per-layer key/value tensors for a batch of sequences.
+
+    Buffers grow geometrically, so appending a token doesn't copy the whole
+    cache, and `crop` (dropping trailing positions) is free.
+    """
+
+    def __init__(self, num_layers):
+        self.keys = [None] * num_layers
+        self.values = [None] * num_layers
+        self.length = 0
+
+    def update(self, layer, key, value):
+        """Append `key`/`value` ([batch, kv_heads, new, head_dim]) for one layer."""
+        end = self.length + key.shape[2]
+        if self.keys[layer] is None or self.keys[layer].shape[2] < end:
+            self._grow(layer, key, value, end)
+        self.keys[layer][:, :, self.length:end] = key
+        self.values[layer][:, :, self.length:end] = value
+        return self.keys[layer][:, :, :end], self.values[layer][:, :, :end]
+
+    def _grow(self, layer, key, value, needed):
+        old_keys, old_values = self.keys[layer], self.values[layer]
+        capacity = max(needed, 256, 2 * (old_keys.shape[2] if old_keys is not None else 0))
+        batch, heads, _, head_dim = key.shape
+        self.keys[layer] = key.new_zeros(batch, heads, capacity, head_dim)
+        self.values[layer] = value.new_zeros(batch, heads, capacity, head_dim)
+        if old_keys is not None:
+            self.keys[layer][:, :, :self.length] = old_keys[:, :, :self.length]
+            self.values[layer][:, :, :self.length] = old_values[:, :, :self.length]
+
+    def advance(self, count):
+        self.length += count
+
+    def crop(self, length):
+        """Forget every position from `length` on."""
+        self.length = min(self.length, length)
+
+
+class RMSNorm(nn.Module):
+    def __init__(self, size, eps):
+        super().__init__()
+        self.weight = nn.Parameter(torch.ones(size))
+        self.eps = eps
+
+    def forward(self, x):
+        hidden = x.float()
+        hidden = hidden * torch.rsqrt(hidden.pow(2).mean(-1, keepdim=True) + self.eps)
+        return self.weight * hidden.to(x.dtype)
+
+
+def rotate_half(x):
+    x1, x2 = x.chunk(2, dim=-1)
+    return torch.cat((-x2, x1), dim=-1)
+
+
+class Attention(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.num_heads = config["num_attention_heads"]
+        self.num_kv_heads = config["num_key_value_heads"]
+        self.head_dim = config["hidden_size"] // self.num_heads
+        hidden = config["hidden_size"]
+        self.q_proj = nn.Linear(hidden, self.num_heads * self.head_dim, bias=True)
+        self.k_proj = nn.Linear(hidden, self.num_kv_heads * self.head_dim, bias=True)
+        self.v_proj = nn.Linear(hidden, self.num_kv_heads * self.head_dim, bias=True)
+        self.o_proj = nn.Linear(self.num_heads * self.head_dim, hidden, bias=False)
+
+    def forward(self, x, cos, sin, mask, cache, layer_index):
+        batch, length, _ = x.shape
+        q = self.q_proj(x).view(batch, length, self.num_heads, self.head_dim).transpose(1, 2)
+        k = self.k_proj(x).view(batch, length, self.num_kv_heads, self.head_dim).transpose(1, 2)
+        v = self.v_proj(x).view(batch, length, self.num_kv_heads, self.head_dim).transpose(1, 2)
+
+        q = q * cos + rotate_half(q) * sin
+        k = k * cos + rotate_half(k) * sin
+
+        if cache is not None:
+            k, v = cache.update(layer_index, k, v)
+
+        # Grouped-query attention: each key/value head serves several query heads
+        groups = self.num_heads // self.num_kv_heads
+        k = k.repeat_interleave(groups, dim=1)
+        v = v.repeat_interleave(groups, dim=1)
+
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+        return self.o_proj(out.transpose(1, 2).reshape(batch, length, -1))
+
+
+class MLP(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        hidden, intermediate = config["hidden_size"], config["intermediate_size"]
+        self.gate_proj = nn.Linear(hidden, intermediate, bias=False)
+        self.up_proj = nn.Linear(hidden, intermediate, bias=False)
+        self.down_proj = nn.Linear(intermediate, hidden, bias=False)
+
+    def forward(self, x):
+        return self.down_proj(F.silu(self.gate_proj(x)) * self.up_proj(x))
+
+
+class DecoderLayer(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.self_attn = Attention(config)
+        self.mlp = MLP(config)
+        self.input_layernorm = RMSNorm(config["hidden_size"], config["rms_norm_eps"])
+        self.post_attention_layernorm = RMSNorm(config["hidden_size"], config["rms_norm_eps"])
+
+    def forward(self, x, cos, sin, mask, cache, layer_index):
+        x = x + self.self_attn(self.input_layernorm(x), cos, sin, mask, cache, layer_index)
+        return x + self.mlp(self.post_attention_layernorm(x))
+
+
+class Qwen2Model(nn.Module):
+    """Qwen2 decoder (the architecture of Qwen2.5) with an explicit KV cache."""
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.embed_tokens = nn.Embedding(config["vocab_size"], config["hidden_size"])
+        self.layers = nn.ModuleList(DecoderLayer(config) for _ in range(config["num_hidden_layers"]))
+        self.norm = RMSNorm(config["hidden_size"], config["rms_norm_eps"])
+        if not config.get("tie_word_embeddings", False):
+            self.lm_head = nn.Linear(config["hidden_size"], config["vocab_size"], bias=False)
+
+        head_dim = config["hidden_size"] // config["num_attention_heads"]
+        inv_freq = 1.0 / (config.get("rope_theta", 10000.0) ** (
+            torch.arange(0, head_dim, 2, dtype=torch.float32, device="cpu") / head_dim
+        ))
+        self.register_buffer("inv_freq", inv_freq, persistent=False)
+
+    def new_cache(self):
+        return KVCache(len(self.layers))
+
+    def _rotary(self, position_ids, dtype):
+        freqs = position_ids[:, :, None].float() * self.inv_freq[None, None, :]
+        emb = torch.cat((freqs, freqs), dim=-1)[:, None, :, :]
+        return emb.cos().to(dtype), emb.sin().to(dtype)
+
+    def forward(self, input_ids, cache=None, attention_mask=None, num_logits=None):
+        """
+        Args:
+            input_ids: [batch, new_tokens] token ids
+            cache: KVCache holding earlier positions (updated in place), or None
+            attention_mask: Optional [batch, past + new_tokens] mask, 0 for
+                padding (e.g. left-padded batches)
+            num_logits: Only compute logits for the last `num_logits`
+                positions (None for all)
+
+        Returns:
+            Logits, [batch, positions, vocab]
+        """
+        batch, length = input_ids.shape
+        past = cache.length if cache is not None else 0
+        total = past + length
+        device = input_ids.device
+
+        if attention_mask is not None:
+            position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)[:, past:]
+        else:
+            position_ids = torch.arange(past, total, device=device).expand(batch, length)
+
+        mask = None
+        if length > 1 or attention_mask is not None:
+            # Causal mask over cached + new positions; every query may see itself,
+            # so rows for padding tokens never end up fully masked
+            query_positions = torch.arange(past, total, device=device)[:, None]
+            key_positions = torch.arange(total, device=device)[None, :]
+            mask = (key_positions <= query_positions)[None, None]
+            if attention_mask is not None:
+                mask = mask & attention_mask.bool()[:, None, None, :]
+                mask = mask | (key_positions == query_positions)[None, None]
+
+        x = self.embed_tokens(input_ids)
+        cos, sin = self._rotary(position_ids, x.dtype)
+        for index, layer in enumerate(self.layers):
+            x = layer(x, cos, sin, mask, cache, index)
+        if cache is not None:
+            cache.advance(length)
+
+        if num_logits is not None:
+            x = x[:, -num_logits:]
+        x = self.norm(x)
+        weight = self.lm_head.weight if hasattr(self, "lm_head") else self.embed_tokens.weight
+        return x @ weight.T
+
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+
+def dequantize_mlx(weight, scales, biases, bits=4, group_size=64, chunk_rows=4096):
+    """
+    Dequantize an MLX affine-quantized matrix.
+
+    MLX packs 32 // bits values into each uint32 (lowest bits first) and stores
+    one scale and bias per `group_size` values: w = q * scale + bias.
+    """
+    rows = weight.shape[0]
+    shifts = torch.arange(0, 32, bits, dtype=torch.int64)
+    value_mask = (1 << bits) - 1
+    out = torch.empty(rows, weight.shape[1] * (32 // bits), dtype=torch.float32)
+
+    # Row chunks keep the int64 unpacking buffer small for the embedding matrix
+    for start in range(0, rows, chunk_rows):
+        end = min(rows, start + chunk_rows)
+        packed = weight[start:end].to(torch.int64) & 0xFFFFFFFF
+        q = ((packed[:, :, None] >> shifts) & value_mask).reshape(end - start, -1, group_size)
+        values = q.float() * scales[start:end].float()[:, :, None] + biases[start:end].float()[:, :, None]
+        out[start:end] = values.reshape(end - start, -1)
+    return out
+
+
+def read_weights(path):
+    """Read all safetensors shards of a model directory into one dict."""
+    from safetensors.torch import load_file
+
+    path = Path(path)
+    index_path = path / "model.safetensors.index.json"
+    if index_path.exists():
+        with open(index_path, "r") as f:
+            files = sorted(set(json.load(f)["weight_map"].values()))
+    else:
+        files = ["model.safetensors"]
+
+    missing = [name for name in files if not (path / name).exists()]
+    if missing:
+        raise FileNotFoundError(
+            f"Model weights not found in {path}: {', '.join(missing)}. "
+            "Export the model first (code/09_export_model_for_lmstudio.py)."
+        )
+
+    tensors = {}
+    for name in files:
+        tensors.update(load_file(str(path / name)))
+    return tensors
+
+
+def load_state_dict(path, config, dtype):
+    """Model weights as a float state dict, dequantizing MLX-quantized layers."""
+    quantization = config.get("quantization") or config.get("quantization_config") or {}
+    tensors = read_weights(path)
+
+    state = {}
+    for name, tensor in tensors.items():
+        if name.endswith((".scales", ".biases")):
+            continue
+        prefix = name[:-len(".weight")] if name.endswith(".weight") else None
+        if prefix and f"{prefix}.scales" in tensors:
+            tensor = dequantize_mlx(
+                tensor, tensors[f"{prefix}.scales"], tensors[f"{prefix}.biases"],
+                bits=quantization.get("bits", 4), group_size=quantization.get("group_size", 64),
+            )
+        # Our module names drop the "model." prefix of Hugging Face checkpoints
+        key = name[len("model."):] if name.startswith("model.") else name
+        state[key] = tensor.to(dtype)
+    return state
+
+
+def merge_lora(state, adapter_path):
+    """
+    Merge an MLX LoRA adapter (adapters.safetensors + adapter_config.json, as
+    written by mlx_lm.lora) into a float state dict: W += scale * (A @ B)^T.
+
+    To switch between adapters without reloading, use LocalModel.load_adapter
+    instead (utils/lora.py).
+    """
+    scale, layers = read_adapter(adapter_path)
+    for key, (lora_a, lora_b) in layers.items():
+        weight = state[f"{key}.weight"]
+        delta = scale * (lora_a.float() @ lora_b.float()).T
+        state[f"{key}.weight"] = (weight.float() + delta).to(weight.dtype)
+    return state
+
+
+def common_prefix_length(a, b):
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+class PrefixCache:
+    """
+    LRU store of the key/value states of recent prompts.
+
+    A new prompt starts from the entry it shares the longest prefix with
+    (the system preamble at least), so only its tail needs a prefill.
+
+    Args:
+        max_tokens: Total prompt tokens kept across entries
+    """
+
+    def __init__(self, max_tokens=DEFAULT_PREFIX_CACHE_TOKENS):
+        self.max_tokens = max_tokens
+        # (adapter, prompt token ids) -> (keys, values) per layer
+        self.entries = OrderedDict()
+        self.tokens = 0
+        self.lookups = 0
+        self.reused_tokens = 0
+        self._lock = threading.Lock()
+
+    def restore(self, prompt_ids, cache, adapter=None):
+        """
+        Load the longest cached prefix of `prompt_ids` into an empty `cache`.
+        At least one prompt token is left over to compute logits from. States
+        are only shared between prompts run with the same LoRA adapter.
+
+        Returns:
+            Number of prompt tokens restored
+        """
+        with self._lock:
+            self.lookups += 1
+            best, length = None, 0
+            for key in self.entries:
+                if key[0] != adapter:
+                    continue
+                shared = common_prefix_length(key[1], prompt_ids)
+                if shared > length:
+                    best, length = key, shared
+            length = min(length, len(prompt_ids) - 1)
+            if length <= 0:
+                return 0
+            self.entries.move_to_end(best)
+            keys, values = self.entries[best]
+            self.reused_tokens += length
+
+        for layer in range(len(keys)):
+            cache.update(layer, keys[layer][:, :, :length], values[layer][:, :, :length])
+        cache.advance(length)
+        return length
+
+    def store(self, prompt_ids, cache, adapter=None):
+        """Keep the states of a prefilled prompt (row 0 of `cache`)."""
+        length = len(prompt_ids)
+        if length == 0 or length > self.max_tokens:
+            return
+        key = (adapter, tuple(prompt_ids))
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+
+        keys = [k[:1, :, :length].clone() for k in cache.keys]
+        values = [v[:1, :, :length].clone() for v in cache.values]
+        with self._lock:
+            # Entries that are a prefix of this prompt are now redundant
+            redundant = [
+                old for old in self.entries
+                if old[0] == adapter and len(old[1]) <= length and key[1][:len(old[1])] == old[1]
+            ]
+            for old in redundant:
+                del self.entries[old]
+                self.tokens -= len(old[1])
+            self.entries[key] = (keys, values)
+            self.tokens += length
+            while self.tokens > self.max_tokens:
+                old, _ = self.entries.popitem(last=False)
+                self.tokens -= len(old[1])
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self.entries), "tokens": self.tokens,
+                    "lookups": self.lookups, "reused_tokens": self.reused_tokens}
+
+
+class LocalModel:
+    """A loaded model plus tokenizer, with a streaming generation loop."""
+
+    def __init__(self, model, tokenizer, path):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.path = Path(path)
+        self.stop_token_ids = {
+            token_id for token_id in (
+                tokenizer.eos_token_id,
+                tokenizer.convert_tokens_to_ids("<|im_end|>"),
+                tokenizer.convert_tokens_to_ids("<|endoftext|>"),
+            ) if token_id is not None
+        }
+        # One generation at a time; torch already uses every core for each step
+        self.lock = threading.Lock()
+        # Draft tokens proposed / accepted by speculative decoding so far
+        self.speculation = {"drafted": 0, "accepted": 0}
+        self.prefix_cache = PrefixCache()
+        self.adapters = AdapterRegistry(model, dtype=model.embed_tokens.weight.dtype)
+
+    def load_adapter(self, adapter_path, name=None):
+        """
+        Load a LoRA adapter next to the resident base weights (once per name).
+
+        Returns:
+            The adapter's name (default: its path), to pass as `adapter`
+        """
+        name = name or str(adapter_path)
+        if self.adapters.loaded.get(name) != str(adapter_path):
+            self.adapters.load(name, adapter_path)
+        return name
+
+    def unload_adapter(self, name):
+        self.adapters.unload(name)
+
+    def check_adapter(self, adapter):
+        if adapter is not None and adapter not in self.adapters.loaded:
+            loaded = ", ".join(self.adapters.names()) or "none"
+            raise ValueError(f"Adapter {adapter!r} is not loaded (loaded: {loaded})")
+
+    def prefill(self, prompt_ids, draft=(), adapter=None):
+        """
+        Run a prompt (plus optional draft tokens) through the model, reusing
+        cached prefix states.
+
+        Returns:
+            (cache, logits for the last prompt token and each draft token)
+        """
+        cache = self.model.new_cache()
+        reused = self.prefix_cache.restore(prompt_ids, cache, adapter)
+        input_ids = torch.tensor([list(prompt_ids[reused:]) + list(draft)])
+        with self.adapters.use(adapter):
+            logits = self.model(input_ids, cache, num_logits=len(draft) + 1)[0]
+        self.prefix_cache.store(prompt_ids, cache, adapter)
+        return cache, logits
+
+    def encode_chat(self, messages):
+        """Token ids for a list of {"role", "content"} messages, ready for the reply."""
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    @torch.inference_mode()
+    def generate_tokens(self, prompt_ids, max_new_tokens=DEFAULT_MAX_NEW_TOKENS,
+                        temperature=0.0, top_p=1.0, draft_tokens=DEFAULT_DRAFT_TOKENS, adapter=None):
+        """
+        Yield generated token ids (stops at end-of-turn).
+
+        Up to `draft_tokens` tokens proposed by prompt lookup are verified
+        with each forward pass; several tokens may be yielded per step.
+        `adapter` names a loaded LoRA adapter (None for the base model).
+        """
+        self.check_adapter(adapter)
+        cache = None
+        lookup = PromptLookup(prompt_ids) if draft_tokens > 0 else None
+        pending = list(prompt_ids)  # tokens not in the cache yet
+        generated = 0
+
+        while generated < max_new_tokens:
+            # Local generation honours the request deadline too (utils/resilience.py)
+            timeout = current_timeout()
+            if timeout is not None and timeout <= 0:
+                raise DeadlineExceeded("Deadline exceeded during local generation")
+
+            budget = min(draft_tokens, max_new_tokens - generated - 1)
+            draft = lookup.draft(budget) if lookup is not None and budget > 0 else []
+
+            if cache is None:
+                cache, logits = self.prefill(prompt_ids, draft, adapter)
+                start = 0
+            else:
+                start = cache.length
+                with self.adapters.use(adapter):
+                    logits = self.model(torch.tensor([pending + draft]), cache, num_logits=len(draft) + 1)[0]
+            tokens = accept_draft(logits, draft, temperature, top_p)
+            # Forget the keys/values of rejected draft tokens
+            cache.crop(start + len(pending) + len(tokens) - 1)
+            self.speculation["drafted"] += len(draft)
+            self.speculation["accepted"] += len(tokens) - 1
+
+            for token_id in tokens:
+                if token_id in self.stop_token_ids:
+                    return
+                yield token_id
+                generated += 1
+                if generated >= max_new_tokens:
+                    return
+            if lookup is not None:
+                lookup.extend(tokens)
+            pending = [tokens[-1]]
+
+    def stream_text(self, prompt_ids, max_new_tokens=DEFAULT_MAX_NEW_TOKENS,
+                    temperature=0.0, top_p=1.0, stop=None, adapter=None):
+        """Yield the reply as text pieces (see TextStreamer)."""
+        streamer = TextStreamer(self.tokenizer, stop)
+        with self.lock:
+            for token_id in self.generate_tokens(prompt_ids, max_new_tokens, temperature, top_p,
+                                                 adapter=adapter):
+                piece, done = streamer.push(token_id)
+                if piece:
+                    yield piece
+                if done:
+                    return
+        piece = streamer.finish()
+        if piece:
+            yield piece
+
+
+class TextStreamer:
+    """
+    Incremental detokenizer for one generated reply.
+
+    Text is only released once it decodes to whole characters and can no
+    longer turn into one of the `stop` strings.
+    """
+
+    def __init__(self, tokenizer, stop=None):
+        self.tokenizer = tokenizer
+        self.stop = [s for s in (stop or []) if s]
+        self.holdback = max((len(s) for s in self.stop), default=1) - 1
+        self.token_ids = []
+        self.emitted = 0
+
+    def push(self, token_id):
+        """
+        Add a token.
+
+        Returns:
+            (new text, stopped): `stopped` is True once a stop string appeared
+        """
+        self.token_ids.append(token_id)
+        text = self.tokenizer.decode(self.token_ids, skip_special_tokens=True)
+        if text.endswith("\ufffd"):
+            return "", False  # partial multi-byte character
+
+        hits = [text.find(s, max(0, self.emitted - self.holdback)) for s in self.stop]
+        hits = [i for i in hits if i >= 0]
+        if hits:
+            end = min(hits)
+            piece = text[self.emitted:end] if end > self.emitted else ""
+            self.emitted = len(text)
+            return piece, True
+
+        safe = len(text) - self.holdback
+        if safe > self.emitted:
+            piece = text[self.emitted:safe]
+            self.emitted = safe
+            return piece, False
+        return "", False
+
+    def finish(self):
+        """Release any held-back text at the end of generation."""
+        text = self.tokenizer.decode(self.token_ids, skip_special_tokens=True)
+        piece = text[self.emitted:]
+        self.emitted = len(text)
+        return piece
+
+
+def token_probs(logits, temperature=1.0, top_p=1.0):
+    """Next-token distribution after temperature and nucleus (top-p) filtering."""
+    probs = torch.softmax(logits.float() / temperature, dim=-1)
+    if top_p < 1.0:
+        sorted_probs, sorted_ids = torch.sort(probs, descending=True)
+        outside = torch.cumsum(sorted_probs, dim=-1) - sorted_probs > top_p
+        sorted_probs[outside] = 0.0
+        probs = torch.zeros_like(probs).scatter_(-1, sorted_ids, sorted_probs)
+        probs = probs / probs.sum()
+    return probs
+
+
+def sample(logits, temperature=0.0, top_p=1.0):
+    """Pick the next token id: greedy at temperature 0, else nucleus sampling."""
+    if temperature <= 0:
+        return int(torch.argmax(logits))
+    return int(torch.multinomial(token_probs(logits, temperature, top_p), 1))
+
+
+class PromptLookup:
+    """
+    Drafts tokens by n-gram lookup: finds the latest earlier occurrence of
+    the sequence's last few tokens and proposes the tokens that followed it.
+    """
+
+    def __init__(self, token_ids, max_ngram=MAX_NGRAM, min_ngram=MIN_NGRAM):
+        self.max_ngram = max_ngram
+        self.min_ngram = min_ngram
+        self.tokens = []
+        self.index = {}  # n-gram -> position of the token that followed it
+        self.extend(token_ids)
+
+    def extend(self, token_ids):
+        for token_id in token_ids:
+            # The n-grams ending at the previous token now have a continuation
+            end = len(self.tokens)
+            for n in range(self.min_ngram, min(self.max_ngram, end) + 1):
+                self.index[tuple(self.tokens[end - n:end])] = end
+            self.tokens.append(token_id)
+
+    def draft(self, count):
+        """Up to `count` tokens likely to come next (empty when nothing matches)."""
+        for n in range(min(self.max_ngram, len(self.tokens)), self.min_ngram - 1, -1):
+            position = self.index.get(tuple(self.tokens[-n:]))
+            if position is not None:
+                return self.tokens[position:position + count]
+        return []
+
+
+def accept_draft(logits, draft, temperature=0.0, top_p=1.0):
+    """
+    Verify drafted tokens against the model.
+
+    Args:
+        logits: [len(draft) + 1, vocab]; row i predicts the token after draft[:i]
+        draft: Proposed token ids
+
+    Returns:
+        The accepted draft prefix plus one token from the model, distributed
+        exactly as if every token had been sampled one at a time
+    """
+    if temperature <= 0:
+        best = logits.argmax(dim=-1).tolist()
+        tokens = []
+        for token_id, draft_id in zip(best, draft):
+            tokens.append(token_id)
+            if token_id != draft_id:
+                return tokens
+        tokens.append(best[len(draft)])
+        return tokens
+
+    tokens = []
+    for row, draft_id in enumerate(draft):
+        probs = token_probs(logits[row], temperature, top_p)
+        # The draft is a single certain guess: keep it with probability p(draft),
+        # else sample from the model's distribution with the draft removed
+        if torch.rand(()) < probs[draft_id]:
+            tokens.append(draft_id)
+            continue
+        probs[draft_id] = 0.0
+        tokens.append(int(torch.multinomial(probs / probs.sum(), 1)))
+        return tokens
+    tokens.append(sample(logits[len(draft)], temperature, top_p))
+    return tokens
+
+
+def build_local_model(path=LOCAL_MODEL_PATH, dtype=LOCAL_DTYPE, adapter_path=None, quantization=None):
+    """
+    Load a local model from disk (uncached; see `load_local_model`).
+
+    Args:
+        path: Model directory (config.json, tokenizer files, safetensors)
+        dtype: "bfloat16" or "float32"
+        adapter_path: Optional MLX LoRA adapter directory to merge in. Use it
+            with the base model the adapter was trained on, not with an export
+            that already has the adapter fused.
+        quantization: None, "int8" or "int4" (see utils/quantization.py)
+
+    Returns:
+        LocalModel
+    """
+    from transformers import AutoTokenizer
+
+    path = Path(path)
+    with open(path / "config.json", "r") as f:
+        config = json.load(f)
+    torch_dtype = getattr(torch, dtype)
+
+    if quantization:
+        from utils.quantization import load_quantized, prepare_quantized, replace_linear_layers
+
+        if adapter_path:
+            raise ValueError("Adapters can't be merged into quantized weights; "
+                             "load them with LocalModel.load_adapter instead")
+        bits = {"int8": 8, "int4": 4}[quantization]
+        state, group_size = load_quantized(path, bits)
+        state = {
+            name: tensor if not tensor.is_floating_point() else tensor.to(torch_dtype)
+            for name, tensor in state.items()
+        }
+    else:
+        state = load_state_dict(path, config, torch_dtype)
+        if adapter_path:
+            state = merge_lora(state, adapter_path)
+
+    # Build on the meta device and adopt the loaded tensors, so the
+    # weights are never held twice
+    with torch.device("meta"):
+        model = Qwen2Model(config)
+        if quantization:
+            replace_linear_layers(model, bits, group_size, dtype=torch_dtype)
+    missing, _ = model.load_state_dict(state, strict=False, assign=True)
+    if missing:
+        raise ValueError(f"Model weights missing from {path}: {', '.join(missing[:5])}")
+    if quantization:
+        prepare_quantized(model)
+    model.eval()
+
+    threads = os.getenv("LOCAL_LLM_THREADS")
+    if threads:
+        torch.set_num_threads(int(threads))
+
+    return LocalModel(model, AutoTokenizer.from_pretrained(str(path)), path)
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_local_model(path=LOCAL_MODEL_PATH, dtype=LOCAL_DTYPE, adapter_path=None,
+                     quantization=LOCAL_QUANTIZATION):
+    """
+    Load a local model once per process.
+
+    Arguments as for `build_local_model`; repeated calls with the same
+    arguments return the same LocalModel.
+    """
+    key = (str(Path(path).resolve()), dtype, str(adapter_path) if adapter_path else None, quantization)
+    with _models_lock:
+        if key not in _models:
+            _models[key] = build_local_model(path, dtype, adapter_path, quantization)
+    return _models[key]
+
+
+# ---------------------------------------------------------------------------
+# LangChain chat model
+# ---------------------------------------------------------------------------
+
+ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+
+def to_chat_messages(messages):
+    """Convert LangChain messages to {"role", "content"} dicts for the chat template."""
+    return [
+        {"role": ROLES.get(message.type, "user"), "content": message.content}
+        for message in messages
+    ]
+
+
+class ChatLocalQwen(BaseChatModel):
+    """
+    LangChain chat model running the bundled Qwen2.5 model on CPU.
+
+    Drop-in replacement for ChatOpenAI in the RAG chains; supports
+    `stream`/`astream` token by token. With `adapter_path`, replies come from
+    that LoRA adapter on the shared base model, so chat models with different
+    adapters (or none) can run side by side on one copy of the weights.
+    """
+
+    model_path: str = str(LOCAL_MODEL_PATH)
+    adapter_path: Optional[str] = None
+    temperature: float = 0.3
+    top_p: float = 0.9
+    max_tokens: int = DEFAULT_MAX_NEW_TOKENS
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-qwen2"
+
+    @property
+    def _identifying_params(self):
+        return {"model_path": self.model_path, "adapter_path": self.adapter_path,
+                "temperature": self.temperature, "top_p": self.top_p}
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        local = load_local_model(self.model_path)
+        adapter = local.load_adapter(self.adapter_path) if self.adapter_path else None
+        prompt_ids = local.encode_chat(to_chat_messages(messages))
+
+        for piece in local.stream_text(
+            prompt_ids,
+            max_new_tokens=kwargs.get("max_tokens", self.max_tokens),
+            temperature=kwargs.get("temperature", self.temperature),
+            top_p=self.top_p,
+            stop=stop,
+            adapter=adapter,
+        ):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = "".join(
+            chunk.message.content for chunk in self._stream(messages, stop, run_manager, **kwargs)
+        )
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
@@ -0,0 +1,379 @@
+"""
+OpenAI-compatible HTTP server for the local Qwen2.5 model, with continuous batching.
+
+Serves `/v1/chat/completions` (plain and streamed) and `/v1/models`, so
+ChatOpenAI can use it via LLM_BASE_URL (see utils/api_config.create_chat_model).
+
+Concurrent requests share decode steps instead of queuing: the scheduler
+keeps one running batch, and every step generates the next token for every
+sequence in it. New requests are prefilled and join the batch between steps;
+finished ones leave it. On CPU a decode step is dominated by reading the
+weights, so a batch of 8 costs little more than a single sequence.
+
+Sequences of different lengths share one KV cache, right-aligned: shorter
+ones are left-padded and the padding is masked out of attention. Prefill
+starts from the closest cached prompt prefix (LocalModel.prefill).
+
+LoRA adapters loaded on the model (LocalModel.load_adapter) are listed in
+/v1/models; a request whose "model" names one is generated with it, in the
+same batch as requests for the base model or other adapters.
+
+Start it with code/10_serve_local_model.py.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+from utils.local_llm import DEFAULT_MAX_NEW_TOKENS, TextStreamer, sample
+
+
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv("LOCAL_MAX_BATCH_SIZE", "8"))
+
+
+class GenerationRequest:
+    """One chat completion being generated; its text arrives on `events`."""
+
+    def __init__(self, prompt_ids, tokenizer, max_new_tokens=DEFAULT_MAX_NEW_TOKENS,
+                 temperature=0.0, top_p=1.0, stop=None, adapter=None):
+        self.prompt_ids = prompt_ids
+        self.adapter = adapter
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.streamer = TextStreamer(tokenizer, stop)
+        self.events = queue.Queue()  # text pieces, then None
+        self.completion_tokens = 0
+        self.finish_reason = None
+        self.error = None
+        self.cancelled = False
+
+    def finish(self, reason, error=None):
+        if self.finish_reason is None:
+            piece = self.streamer.finish() if error is None else ""
+            if piece:
+                self.events.put(piece)
+            self.finish_reason = reason
+            self.error = error
+            self.events.put(None)
+
+    def iter_text(self):
+        """Yield text pieces as they are generated."""
+        while True:
+            piece = self.events.get()
+            if piece is None:
+                break
+            yield piece
+        if self.error is not None:
+            raise RuntimeError(f"Generation failed: {self.error}")
+
+    def text(self):
+        return "".join(self.iter_text())
+
+
+class BatchScheduler:
+    """
+    Continuous-batching generation loop running in a background thread.
+
+    Args:
+        local_model: LocalModel from utils.local_llm.load_local_model
+        max_batch_size: Most sequences decoded together
+    """
+
+    def __init__(self, local_model, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        self.local = local_model
+        self.model = local_model.model
+        self.max_batch_size = max_batch_size
+        self.waiting = queue.Queue()
+        self.running = []      # GenerationRequests, one per batch row
+        self.last_tokens = []  # next input token per row
+        self.cache = None
+        self.mask = None       # [rows, cache length], 0 for padding
+        self.thread = threading.Thread(target=self._loop, name="local-batch-scheduler", daemon=True)
+        self.thread.start()
+
+    def submit(self, prompt_ids, max_new_tokens=DEFAULT_MAX_NEW_TOKENS,
+               temperature=0.0, top_p=1.0, stop=None, adapter=None):
+        """Queue a prompt for generation and return its GenerationRequest."""
+        self.local.check_adapter(adapter)
+        request = GenerationRequest(prompt_ids, self.local.tokenizer, max_new_tokens,
+                                    temperature, top_p, stop, adapter)
+        self.waiting.put(request)
+        return request
+
+    def stats(self):
+        return {"running": len(self.running), "waiting": self.waiting.qsize(),
+                "cache_length": self.cache.length if self.cache is not None else 0,
+                "prefix_cache": self.local.prefix_cache.stats()}
+
+    def _loop(self):
+        while True:
+            try:
+                if not self.running:
+                    self._admit(self.waiting.get())
+                elif len(self.running) < self.max_batch_size:
+                    # One admission per step, so a long prefill only briefly
+                    # pauses the sequences already decoding
+                    try:
+                        self._admit(self.waiting.get_nowait())
+                    except queue.Empty:
+                        pass
+                if self.running:
+                    self._step()
+            except Exception as e:
+                for request in self.running:
+                    request.finish("error", error=str(e))
+                self.running, self.last_tokens, self.cache, self.mask = [], [], None, None
+
+    def _emit(self, request, token_id):
+        """Hand a sampled token to its request. Returns True when the request is done."""
+        if request.cancelled:
+            request.finish("cancelled")
+            return True
+        if token_id in self.local.stop_token_ids:
+            request.finish("stop")
+            return True
+
+        request.completion_tokens += 1
+        piece, stopped = request.streamer.push(token_id)
+        if piece:
+            request.events.put(piece)
+        if stopped:
+            request.finish("stop")
+            return True
+        if request.completion_tokens >= request.max_new_tokens:
+            request.finish("length")
+            return True
+        return False
+
+    @torch.inference_mode()
+    def _admit(self, request):
+        """Prefill a new request and add it to the running batch."""
+        if request.cancelled:
+            request.finish("cancelled")
+            return
+        try:
+            cache, logits = self.local.prefill(request.prompt_ids, adapter=request.adapter)
+            logits = logits[-1]
+        except Exception as e:
+            request.finish("error", error=str(e))
+            return
+
+        token_id = sample(logits, request.temperature, request.top_p)
+        if self._emit(request, token_id):
+            return
+        self._join(request, cache, token_id)
+
+    def _join(self, request, cache, token_id):
+        self.running.append(request)
+        self.last_tokens.append(token_id)
+        prompt_length = cache.length
+
+        if self.cache is None:
+            self.cache = cache
+            self.mask = torch.ones(1, prompt_length, dtype=torch.long)
+            return
+
+        # Right-align the new sequence and the running batch in one cache
+        rows, length = self.mask.shape
+        new_length = max(length, prompt_length)
+        for layer in range(len(self.cache.keys)):
+            for store, new in ((self.cache.keys, cache.keys), (self.cache.values, cache.values)):
+                old = store[layer][:, :, :length]
+                merged = old.new_zeros(rows + 1, old.shape[1], new_length, old.shape[3])
+                merged[:rows, :, new_length - length:] = old
+                merged[rows, :, new_length - prompt_length:] = new[layer][0, :, :prompt_length]
+                store[layer] = merged
+        self.cache.length = new_length
+
+        mask = torch.zeros(rows + 1, new_length, dtype=torch.long)
+        mask[:rows, new_length - length:] = self.mask
+        mask[rows, new_length - prompt_length:] = 1
+        self.mask = mask
+
+    @torch.inference_mode()
+    def _step(self):
+        """Generate one token for every running sequence."""
+        input_ids = torch.tensor(self.last_tokens)[:, None]
+        self.mask = torch.cat([self.mask, torch.ones(len(self.running), 1, dtype=torch.long)], dim=1)
+        adapters = [request.adapter for request in self.running]
+        with self.local.adapters.use(adapters if any(adapters) else None):
+            logits = self.model(input_ids, self.cache, attention_mask=self.mask, num_logits=1)[:, -1]
+
+        finished = []
+        for row, request in enumerate(self.running):
+            token_id = sample(logits[row], request.temperature, request.top_p)
+            if self._emit(request, token_id):
+                finished.append(row)
+            else:
+                self.last_tokens[row] = token_id
+        if finished:
+            self._remove(finished)
+
+    def _remove(self, rows):
+        keep = [row for row in range(len(self.running)) if row not in rows]
+        self.running = [self.running[row] for row in keep]
+        self.last_tokens = [self.last_tokens[row] for row in keep]
+        if not keep:
+            self.cache, self.mask = None, None
+            return
+
+        # Drop the finished rows, then any leading columns that are now padding for everyone
+        mask = self.mask[keep]
+        start = int((mask.sum(dim=0) > 0).nonzero()[0])
+        index = torch.tensor(keep)
+        length = self.cache.length
+        for store in (self.cache.keys, self.cache.values):
+            for layer in range(len(store)):
+                store[layer] = store[layer][index, :, start:length]
+        self.cache.length = length - start
+        self.mask = mask[:, start:]
+
+
+def message_text(content):
+    """Text of an OpenAI message content (a string or a list of parts)."""
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+
+def make_handler(scheduler, model_name):
+    """Build the request handler class serving `scheduler`."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, status, message):
+            self._send_json(status, {"error": {"message": message, "type": "invalid_request_error"}})
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [
+                    {"id": name, "object": "model", "created": 0, "owned_by": "local"}
+                    for name in [model_name] + scheduler.local.adapters.names()
+                ]})
+            elif self.path.rstrip("/") == "/health":
+                self._send_json(200, {"status": "ok", **scheduler.stats()})
+            else:
+                self._send_error(404, f"Unknown path {self.path}")
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_error(404, f"Only /v1/chat/completions is served, not {self.path}")
+                return
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                messages = [
+                    {"role": message["role"], "content": message_text(message.get("content"))}
+                    for message in body["messages"]
+                ]
+            except (ValueError, KeyError, TypeError) as e:
+                self._send_error(400, f"Invalid request: {e}")
+                return
+
+            stop = body.get("stop")
+            # Any other model name (e.g. from a shared config) gets the base model
+            model = body.get("model")
+            adapter = model if model in scheduler.local.adapters.loaded else None
+            request = scheduler.submit(
+                scheduler.local.encode_chat(messages),
+                max_new_tokens=body.get("max_tokens") or body.get("max_completion_tokens")
+                or DEFAULT_MAX_NEW_TOKENS,
+                temperature=body.get("temperature", 0.7),
+                top_p=body.get("top_p", 1.0),
+                stop=[stop] if isinstance(stop, str) else stop,
+                adapter=adapter,
+            )
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+            if body.get("stream"):
+                self._stream(request, completion_id)
+                return
+
+            try:
+                text = request.text()
+            except RuntimeError as e:
+                self._send_json(500, {"error": {"message": str(e), "type": "server_error"}})
+                return
+
+            prompt_tokens = len(request.prompt_ids)
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.adapter or model_name,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": request.finish_reason,
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": request.completion_tokens,
+                    "total_tokens": prompt_tokens + request.completion_tokens,
+                },
+            })
+
+        def _stream(self, request, completion_id):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def event(delta, finish_reason=None):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.adapter or model_name,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+
+            try:
+                event({"role": "assistant", "content": ""})
+                for piece in request.iter_text():
+                    event({"content": piece})
+                event({}, request.finish_reason)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # Client went away; free its batch slot
+                request.cancelled = True
+            except RuntimeError:
+                pass
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(local_model, host="127.0.0.1", port=8000, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+          model_name=None):
+    """Run the server until interrupted."""
+    scheduler = BatchScheduler(local_model, max_batch_size=max_batch_size)
+    handler = make_handler(scheduler, model_name or local_model.path.name)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,150 @@
+"""
+Hot-swappable LoRA adapters on one resident base model.
+
+Instead of merging an adapter into the weights (one model copy per adapter,
+and a reload to switch), the adapted projection layers are wrapped in
+LoRALinear, which adds scale * (x @ A) @ B for the adapter chosen for each
+batch row. Adapters are a few MB each, so several stay loaded next to the
+base weights (float or quantized) and every request can pick its own, or
+none, with no reload. This makes A/B tests between adapter versions and the
+base model cheap.
+
+Adapters are the MLX format written by mlx_lm.lora (adapters.safetensors +
+adapter_config.json), e.g. adapters/techcorp-support.
+"""
+import json
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import torch
+from torch import nn
+
+
+def read_adapter(adapter_path):
+    """
+    Read an MLX LoRA adapter.
+
+    Returns:
+        (scale, {layer name: (A [in, rank], B [rank, out])}); layer names
+        match the local model's modules (no "model." prefix)
+    """
+    from safetensors.torch import load_file
+
+    adapter_path = Path(adapter_path)
+    weights_path = adapter_path / "adapters.safetensors"
+    if not weights_path.exists():
+        raise FileNotFoundError(
+            f"Adapter weights not found at {weights_path}. "
+            "Fine-tune first (code/08_finetune_mlx_complete.py)."
+        )
+    with open(adapter_path / "adapter_config.json", "r") as f:
+        scale = json.load(f).get("lora_parameters", {}).get("scale", 1.0)
+
+    tensors = load_file(str(weights_path))
+    layers = {}
+    for name, lora_a in tensors.items():
+        if not name.endswith(".lora_a"):
+            continue
+        prefix = name[:-len(".lora_a")]
+        key = prefix[len("model."):] if prefix.startswith("model.") else prefix
+        layers[key] = (lora_a, tensors[f"{prefix}.lora_b"])
+    return scale, layers
+
+
+class LoRALinear(nn.Module):
+    """A base projection (nn.Linear or a quantized layer) plus any loaded adapters."""
+
+    def __init__(self, base, registry):
+        super().__init__()
+        self.base = base
+        self.registry = registry
+        self.adapters = {}  # name -> (A, B, scale)
+
+    def forward(self, x):
+        y = self.base(x)
+        selection = self.registry.selection()
+        if selection is None or not self.adapters:
+            return y
+
+        if isinstance(selection, str):
+            adapter = self.adapters.get(selection)
+            if adapter is None:
+                return y
+            lora_a, lora_b, scale = adapter
+            return y + scale * ((x @ lora_a.to(x.dtype)) @ lora_b.to(x.dtype))
+
+        # One adapter name (or None) per batch row
+        for name in set(selection):
+            adapter = self.adapters.get(name) if name is not None else None
+            if adapter is None:
+                continue
+            lora_a, lora_b, scale = adapter
+            rows = torch.tensor([i for i, row_name in enumerate(selection) if row_name == name])
+            y[rows] += scale * ((x[rows] @ lora_a.to(x.dtype)) @ lora_b.to(x.dtype))
+        return y
+
+
+class AdapterRegistry:
+    """
+    The adapters loaded onto one model.
+
+    The adapter(s) applied by a forward pass are set with `use`, per thread,
+    either as one name for the whole batch or as a list with one name (or
+    None for the base model) per batch row.
+    """
+
+    def __init__(self, model, dtype=torch.bfloat16):
+        self.model = model
+        self.dtype = dtype
+        self.loaded = {}  # name -> adapter path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def selection(self):
+        return getattr(self._local, "selection", None)
+
+    @contextmanager
+    def use(self, selection):
+        """Apply `selection` (a name, a per-row list, or None) to forward passes in this block."""
+        previous = self.selection()
+        self._local.selection = selection
+        try:
+            yield
+        finally:
+            self._local.selection = previous
+
+    def _wrap(self, layer_name):
+        module = self.model.get_submodule(layer_name)
+        if isinstance(module, LoRALinear):
+            return module
+        parent_name, _, child_name = layer_name.rpartition(".")
+        wrapped = LoRALinear(module, self)
+        setattr(self.model.get_submodule(parent_name), child_name, wrapped)
+        return wrapped
+
+    def load(self, name, adapter_path):
+        """Load an adapter under `name` (replacing any adapter of that name)."""
+        scale, layers = read_adapter(adapter_path)
+        with self._lock:
+            self._unload(name)
+            for layer_name, (lora_a, lora_b) in layers.items():
+                self._wrap(layer_name).adapters[name] = (
+                    lora_a.to(self.dtype), lora_b.to(self.dtype), scale
+                )
+            self.loaded[name] = str(adapter_path)
+        return name
+
+    def _unload(self, name):
+        for module in self.model.modules():
+            if isinstance(module, LoRALinear):
+                module.adapters.pop(name, None)
+        self.loaded.pop(name, None)
+
+    def unload(self, name):
+        """Drop an adapter; requests must not be using it."""
+        with self._lock:
+            self._unload(name)
+
+    def names(self):
+        return list(self.loaded)
@@ -0,0 +1,220 @@
+"""
+Metadata pre-filtering for the FAISS vector store.
+
+LangChain's FAISS `filter` searches `fetch_k` nearest chunks and then drops
+those that don't match, so a narrow filter (one source file) can return
+fewer than `k` results or none at all. Instead, chunk metadata is indexed
+when the vector store is built (code/02_create_vectorstore.py):
+
+- source: the knowledge-base file name, e.g. "pricing.md"
+- section: every markdown header above or inside the chunk, e.g.
+  "Account Management"
+
+A filter such as {"source": "pricing.md"} or {"source": ["faq.md",
+"data_privacy.md"], "section": "Billing"} resolves to the set of matching
+FAISS positions, and only those vectors are scored (an IDSelector on the
+search). Values in a list match any; different fields must all match.
+"""
+import bisect
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+
+
+METADATA_INDEX_FILE = "metadata_index.json"
+INDEXED_FIELDS = ("source", "section")
+
+SECTION_SEPARATOR = " > "
+
+_HEADER = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$", re.M)
+
+
+# ---------------------------------------------------------------------------
+# Section metadata
+# ---------------------------------------------------------------------------
+
+def header_offsets(text):
+    """
+    Markdown headers of a document with the header path they open.
+
+    Returns:
+        (offsets, paths): character offset of each header and the list of
+        header titles (outermost first) in effect from there on
+    """
+    offsets, paths, stack = [], [], []
+    for match in _HEADER.finditer(text):
+        level = len(match.group(1))
+        stack = [(lvl, title) for lvl, title in stack if lvl < level] + [(level, match.group(2))]
+        offsets.append(match.start())
+        paths.append([title for _, title in stack])
+    return offsets, paths
+
+
+def add_section_metadata(documents, chunks):
+    """
+    Set `metadata["section"]` on chunks split from `documents` with
+    add_start_index=True: the header path at the chunk's start, joined with
+    " > ". Headers that start inside the chunk go in `metadata["headers"]`
+    with those of the path, so section filters also find them.
+    """
+    headers_by_source = {doc.metadata.get("source"): header_offsets(doc.page_content) for doc in documents}
+    for chunk in chunks:
+        start = chunk.metadata.get("start_index")
+        offsets, paths = headers_by_source.get(chunk.metadata.get("source"), ([], []))
+        if start is None or not offsets:
+            continue
+        # Headers at or before the chunk's first character
+        current = bisect.bisect_right(offsets, start) - 1
+        path = paths[current] if current >= 0 else []
+        end = bisect.bisect_left(offsets, start + len(chunk.page_content))
+        inside = [paths[i][-1] for i in range(current + 1, end)]
+        chunk.metadata["section"] = SECTION_SEPARATOR.join(path)
+        chunk.metadata["headers"] = list(dict.fromkeys(path + inside))
+    return chunks
+
+
+def _field_values(field, metadata):
+    if field == "source":
+        source = metadata.get("source")
+        return [Path(source).name] if source else []
+    if field == "section":
+        return metadata.get("headers") or [
+            title for title in (metadata.get("section") or "").split(SECTION_SEPARATOR) if title
+        ]
+    value = metadata.get(field)
+    return value if isinstance(value, list) else [] if value is None else [value]
+
+
+def _normalize(value):
+    return str(value).strip().lower()
+
+
+# ---------------------------------------------------------------------------
+# Index
+# ---------------------------------------------------------------------------
+
+class MetadataIndex:
+    """
+    Inverted index from metadata values to sorted FAISS positions.
+
+    Args:
+        doc_ids: Docstore id of the chunk at each FAISS position
+        postings: field -> normalized value -> positions
+    """
+
+    def __init__(self, doc_ids, postings):
+        self.doc_ids = list(doc_ids)
+        self.postings = {
+            field: {value: np.asarray(positions, dtype=np.int64) for value, positions in values.items()}
+            for field, values in postings.items()
+        }
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, fields=INDEXED_FIELDS):
+        """Index the metadata of every chunk of a LangChain FAISS store."""
+        doc_ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+        postings = {field: {} for field in fields}
+        for position, doc_id in enumerate(doc_ids):
+            metadata = vectorstore.docstore.search(doc_id).metadata
+            for field in fields:
+                for value in set(map(_normalize, _field_values(field, metadata))):
+                    postings[field].setdefault(value, []).append(position)
+        return cls(doc_ids, postings)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def values(self, field):
+        """Indexed values of a field with their chunk counts, most frequent first."""
+        values = self.postings.get(field, {})
+        return sorted(((value, len(positions)) for value, positions in values.items()),
+                      key=lambda pair: (-pair[1], pair[0]))
+
+    def select(self, metadata_filter):
+        """
+        FAISS positions of the chunks matching a filter.
+
+        Args:
+            metadata_filter: dict of field -> value or list of values
+
+        Returns:
+            Sorted int64 array of positions (empty if nothing matches)
+        """
+        selected = None
+        for field, wanted in metadata_filter.items():
+            if field not in self.postings:
+                raise ValueError(f"Field {field!r} is not indexed (indexed: {', '.join(self.postings)})")
+            wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            matches = [self.postings[field].get(_normalize(value)) for value in wanted]
+            positions = np.unique(np.concatenate([m for m in matches if m is not None] or [np.empty(0, np.int64)]))
+            selected = positions if selected is None else np.intersect1d(selected, positions, assume_unique=True)
+        if selected is None:
+            return np.arange(len(self.doc_ids), dtype=np.int64)
+        return selected
+
+    def matches(self, vectorstore):
+        """Whether this index was built from `vectorstore` (same chunks in the same order)."""
+        return len(self.doc_ids) == len(vectorstore.index_to_docstore_id) and all(
+            vectorstore.index_to_docstore_id[i] == doc_id for i, doc_id in enumerate(self.doc_ids)
+        )
+
+    def save(self, folder_path):
+        """Write the index to `<folder_path>/metadata_index.json`."""
+        path = Path(folder_path) / METADATA_INDEX_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({
+                "doc_ids": self.doc_ids,
+                "postings": {field: {value: positions.tolist() for value, positions in values.items()}
+                             for field, values in self.postings.items()},
+            }, f)
+        return path
+
+    @classmethod
+    def load(cls, folder_path):
+        with open(Path(folder_path) / METADATA_INDEX_FILE, "r") as f:
+            data = json.load(f)
+        return cls(data["doc_ids"], data["postings"])
+
+
+def load_metadata_index(folder_path, vectorstore=None):
+    """
+    Load the metadata index saved next to a vector store.
+
+    Returns:
+        MetadataIndex, or None if there is none or (given `vectorstore`) it
+        is out of date
+    """
+    if not (Path(folder_path) / METADATA_INDEX_FILE).exists():
+        return None
+    index = MetadataIndex.load(folder_path)
+    if vectorstore is not None and not index.matches(vectorstore):
+        print(f"[WARNING] {METADATA_INDEX_FILE} does not match the vector store; "
+              "rerun code/02_create_vectorstore.py to rebuild it")
+        return None
+    return index
+
+
+def search_positions(index, query_vector, k, positions=None):
+    """
+    Nearest neighbours of `query_vector` in a FAISS index, scoring only the
+    vectors at `positions` (all vectors if None).
+
+    Args:
+        query_vector: (n, d) array, one row per query
+
+    Returns:
+        (distances, positions) arrays of shape (n, k); -1 marks missing results
+    """
+    if positions is None:
+        return index.search(query_vector, k)
+    if len(positions) == 0:
+        shape = (len(query_vector), k)
+        return np.full(shape, np.inf, dtype=np.float32), np.full(shape, -1, dtype=np.int64)
+
+    import faiss
+
+    params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.asarray(positions, dtype=np.int64)))
+    return index.search(query_vector, min(k, len(positions)), params=params)
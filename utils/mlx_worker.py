@@ -0,0 +1,112 @@
+"""
+In-process MLX generation worker for comparing fine-tuned models.
+
+Running `python -m mlx_lm generate` once per question reloads the model every
+time and leaves the answer to be scraped from stdout. The worker loads the
+base model and LoRA adapter once, then answers any number of prompts,
+returning one result dict per prompt.
+
+Requires Apple Silicon and: pip install mlx mlx-lm
+"""
+import threading
+import time
+from pathlib import Path
+
+
+DEFAULT_MLX_MODEL = "mlx-community/Qwen2.5-1.5B-Instruct-4bit"
+DEFAULT_ADAPTER_PATH = "adapters/techcorp-support"
+
+# The format the adapter was trained on (data/training/*.jsonl)
+PROMPT_TEMPLATE = "### Instruction:\n{question}\n\n### Response:\n"
+
+
+def extract_response(text):
+    """The answer part of a completion: everything before the next "###" section."""
+    return text.split("###")[0].strip()
+
+
+class MLXGenerationWorker:
+    """
+    Keeps one MLX model (plus optional LoRA adapter) loaded for repeated generation.
+
+    Args:
+        model_name: Hugging Face id or local path of the MLX base model
+        adapter_path: Optional LoRA adapter directory (from mlx_lm lora)
+    """
+
+    def __init__(self, model_name=DEFAULT_MLX_MODEL, adapter_path=None):
+        self.model_name = model_name
+        self.adapter_path = str(adapter_path) if adapter_path else None
+        self.model = None
+        self.tokenizer = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load the model on first use."""
+        with self._lock:
+            if self.model is not None:
+                return
+            try:
+                from mlx_lm import load
+            except ImportError as e:
+                raise ImportError(f"mlx_lm is not installed ({e}). Install with: pip install mlx mlx-lm") from e
+            if self.adapter_path and not Path(self.adapter_path).exists():
+                raise FileNotFoundError(f"Adapter not found at {self.adapter_path}")
+
+            start = time.perf_counter()
+            self.model, self.tokenizer = load(self.model_name, adapter_path=self.adapter_path)
+            self.load_seconds = time.perf_counter() - start
+
+    def _sampling_kwargs(self, temperature, top_p):
+        try:
+            from mlx_lm.sample_utils import make_sampler
+        except ImportError:
+            # Older mlx_lm releases take the sampling settings directly
+            return {"temp": temperature, "top_p": top_p}
+        return {"sampler": make_sampler(temp=temperature, top_p=top_p)}
+
+    def generate(self, question, max_tokens=200, temperature=0.7, top_p=0.9):
+        """
+        Answer one question.
+
+        Returns:
+            dict with question, answer, error, latency (seconds),
+            prompt_tokens and completion_tokens
+        """
+        from mlx_lm import generate
+
+        self.load()
+        prompt = PROMPT_TEMPLATE.format(question=question)
+        result = {"question": question, "answer": None, "error": None,
+                  "prompt_tokens": len(self.tokenizer.encode(prompt)), "completion_tokens": 0}
+
+        start = time.perf_counter()
+        try:
+            with self._lock:
+                text = generate(self.model, self.tokenizer, prompt=prompt, max_tokens=max_tokens,
+                                verbose=False, **self._sampling_kwargs(temperature, top_p))
+            result["answer"] = extract_response(text)
+            result["completion_tokens"] = len(self.tokenizer.encode(text))
+        except Exception as e:
+            result["error"] = str(e)
+        result["latency"] = time.perf_counter() - start
+        return result
+
+    def generate_batch(self, questions, max_tokens=200, temperature=0.7, top_p=0.9):
+        """Answer a list of questions with the loaded model; results in the same order."""
+        self.load()
+        return [self.generate(question, max_tokens, temperature, top_p) for question in questions]
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_mlx_worker(model_name=DEFAULT_MLX_MODEL, adapter_path=DEFAULT_ADAPTER_PATH):
+    """The process-wide worker for a model/adapter pair (created once, loaded on first use)."""
+    key = (model_name, str(adapter_path) if adapter_path else None)
+    with _workers_lock:
+        if key not in _workers:
+            _workers[key] = MLXGenerationWorker(model_name, adapter_path)
+    return _workers[key]
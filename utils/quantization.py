@@ -0,0 +1,235 @@
+"""
+Weight-only int8 / int4 quantization for the local Qwen2 model.
+
+Decoding on CPU is memory-bandwidth bound: every generated token reads every
+weight once. Storing the projection weights as int8 (per output channel) or
+int4 (per group of input channels) halves or quarters the bytes read per
+token and the resident memory. Activations stay in bfloat16/float32.
+
+Quantized checkpoints are written next to the original weights by
+code/09b_quantize_local_model.py (model.int8.safetensors /
+model.int4.safetensors) and loaded with LOCAL_LLM_QUANT=int8 or int4.
+
+PyTorch's CPU weight-only kernels (`_weight_int8pack_mm`,
+`_weight_int4pack_mm_for_cpu`) are used when available; otherwise weights are
+dequantized on the fly, which still saves memory but not time.
+"""
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+
+# Projection layers that get quantized; embeddings and norms stay in float
+QUANTIZED_LAYERS = ("q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj")
+
+DEFAULT_GROUP_SIZE = 64
+
+HAS_INT8_KERNEL = hasattr(torch, "_weight_int8pack_mm")
+HAS_INT4_KERNEL = hasattr(torch, "_weight_int4pack_mm_for_cpu") and hasattr(
+    torch, "_convert_weight_to_int4pack_for_cpu"
+)
+
+
+def quantize_int8(weight):
+    """Symmetric per-output-channel int8: weight ~= q * scales[:, None]."""
+    weight = weight.float()
+    scales = (weight.abs().amax(dim=1) / 127).clamp(min=1e-8)
+    q = torch.round(weight / scales[:, None]).clamp(-127, 127).to(torch.int8)
+    return q, scales
+
+
+def quantize_int4(weight, group_size=DEFAULT_GROUP_SIZE):
+    """
+    Asymmetric group-wise 4-bit: weight ~= q * scale + bias per group of
+    `group_size` input channels. Two values are packed per uint8 (low nibble first).
+    """
+    weight = weight.float()
+    rows, cols = weight.shape
+    groups = weight.view(rows, cols // group_size, group_size)
+    low, high = groups.amin(dim=-1), groups.amax(dim=-1)
+    scales = ((high - low) / 15).clamp(min=1e-8)
+    q = torch.round((groups - low[..., None]) / scales[..., None]).clamp(0, 15).to(torch.uint8)
+    q = q.view(rows, cols)
+    packed = q[:, 0::2] | (q[:, 1::2] << 4)
+    return packed, scales, low
+
+
+def unpack_int4(packed):
+    """Inverse of the nibble packing in `quantize_int4`: [rows, cols // 2] -> [rows, cols]."""
+    low = packed & 0x0F
+    high = packed >> 4
+    return torch.stack((low, high), dim=-1).view(packed.shape[0], -1)
+
+
+class Int8Linear(nn.Module):
+    """Linear layer with int8 weights and per-channel scales."""
+
+    def __init__(self, in_features, out_features, bias=True, dtype=torch.bfloat16):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer("weight", torch.empty(out_features, in_features, dtype=torch.int8))
+        self.register_buffer("scales", torch.empty(out_features, dtype=dtype))
+        self.register_buffer("bias", torch.empty(out_features, dtype=dtype) if bias else None)
+
+    def prepare(self):
+        """Copy the loaded weights into fresh storage (after loading weights)."""
+        # Tensors from safetensors.load_file can start at unaligned offsets,
+        # which makes _weight_int8pack_mm crash; new allocations are aligned
+        self.weight = self.weight.clone(memory_format=torch.contiguous_format)
+        self.scales = self.scales.clone(memory_format=torch.contiguous_format)
+
+    def forward(self, x):
+        shape = x.shape
+        x = x.reshape(-1, self.in_features)
+        if HAS_INT8_KERNEL:
+            y = torch._weight_int8pack_mm(x, self.weight, self.scales.to(x.dtype))
+        else:
+            y = F.linear(x, self.weight.to(x.dtype) * self.scales.to(x.dtype)[:, None])
+        if self.bias is not None:
+            y = y + self.bias.to(y.dtype)
+        return y.view(*shape[:-1], self.out_features)
+
+
+class Int4Linear(nn.Module):
+    """Linear layer with group-wise 4-bit weights (see `quantize_int4`)."""
+
+    def __init__(self, in_features, out_features, bias=True, group_size=DEFAULT_GROUP_SIZE,
+                 dtype=torch.bfloat16):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.group_size = group_size
+        groups = in_features // group_size
+        self.register_buffer("weight", torch.empty(out_features, in_features // 2, dtype=torch.uint8))
+        self.register_buffer("scales", torch.empty(out_features, groups, dtype=dtype))
+        self.register_buffer("biases", torch.empty(out_features, groups, dtype=dtype))
+        self.register_buffer("bias", torch.empty(out_features, dtype=dtype) if bias else None)
+        self._packed = None
+        self._scales_and_zeros = None
+
+    def prepare(self):
+        """Convert the stored nibbles to the CPU kernel's layout (after loading weights)."""
+        if not HAS_INT4_KERNEL:
+            return
+        q = unpack_int4(self.weight).to(torch.int32)
+        self._packed = torch._convert_weight_to_int4pack_for_cpu(q, 1)
+        # The kernel computes (q - 8) * scale + zero
+        zeros = self.biases.float() + self.scales.float() * 8
+        self._scales_and_zeros = torch.stack(
+            (self.scales.float(), zeros), dim=-1
+        ).transpose(0, 1).contiguous().to(self.scales.dtype)
+        # The kernel layout replaces the stored nibbles; don't keep both in memory
+        self.weight = torch.empty(0, dtype=torch.uint8)
+
+    def dequantize(self):
+        q = unpack_int4(self.weight).view(self.out_features, -1, self.group_size).float()
+        weight = q * self.scales.float()[..., None] + self.biases.float()[..., None]
+        return weight.view(self.out_features, self.in_features)
+
+    def forward(self, x):
+        shape = x.shape
+        x = x.reshape(-1, self.in_features)
+        if self._packed is not None:
+            y = torch._weight_int4pack_mm_for_cpu(
+                x, self._packed, self.group_size, self._scales_and_zeros.to(x.dtype)
+            )
+        else:
+            y = F.linear(x, self.dequantize().to(x.dtype))
+        if self.bias is not None:
+            y = y + self.bias.to(y.dtype)
+        return y.view(*shape[:-1], self.out_features)
+
+
+def is_quantized_layer(name):
+    return name.split(".")[-1] in QUANTIZED_LAYERS
+
+
+def quantize_state_dict(state, bits=8, group_size=DEFAULT_GROUP_SIZE):
+    """
+    Quantize the projection weights of a float state dict.
+
+    Returns:
+        New state dict: "<layer>.weight" holds the integer weights, with
+        "<layer>.scales" (and "<layer>.biases" for int4) alongside
+    """
+    quantized = {}
+    for name, tensor in state.items():
+        layer = name[:-len(".weight")] if name.endswith(".weight") else None
+        if layer is None or not is_quantized_layer(layer):
+            quantized[name] = tensor
+            continue
+        if bits == 8:
+            q, scales = quantize_int8(tensor)
+            quantized[f"{layer}.weight"] = q
+            quantized[f"{layer}.scales"] = scales.to(tensor.dtype)
+        elif bits == 4:
+            packed, scales, biases = quantize_int4(tensor, group_size)
+            quantized[f"{layer}.weight"] = packed
+            quantized[f"{layer}.scales"] = scales.to(tensor.dtype)
+            quantized[f"{layer}.biases"] = biases.to(tensor.dtype)
+        else:
+            raise ValueError(f"Unsupported bits: {bits} (use 8 or 4)")
+    return quantized
+
+
+def quantized_weights_path(model_path, bits):
+    """Where the quantized checkpoint for `bits` lives: next to the original weights."""
+    return Path(model_path) / f"model.int{bits}.safetensors"
+
+
+def save_quantized(model_path, quantized_state, bits, group_size=DEFAULT_GROUP_SIZE):
+    """Write a quantized state dict (from `quantize_state_dict`) next to the model."""
+    from safetensors.torch import save_file
+
+    path = quantized_weights_path(model_path, bits)
+    tensors = {name: tensor.contiguous() for name, tensor in quantized_state.items()}
+    save_file(tensors, str(path), metadata={"bits": str(bits), "group_size": str(group_size)})
+    return path
+
+
+def load_quantized(model_path, bits):
+    """
+    Read a quantized checkpoint.
+
+    Returns:
+        (state dict, group size)
+    """
+    from safetensors import safe_open
+    from safetensors.torch import load_file
+
+    path = quantized_weights_path(model_path, bits)
+    if not path.exists():
+        raise FileNotFoundError(
+            f"Quantized weights not found at {path}. "
+            f"Create them with: python code/09b_quantize_local_model.py --bits {bits}"
+        )
+    with safe_open(str(path), framework="pt") as f:
+        metadata = f.metadata() or {}
+    return load_file(str(path)), int(metadata.get("group_size", DEFAULT_GROUP_SIZE))
+
+
+def replace_linear_layers(model, bits=8, group_size=DEFAULT_GROUP_SIZE, dtype=torch.bfloat16):
+    """Swap the model's projection nn.Linear layers for empty quantized ones (before loading)."""
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if not isinstance(child, nn.Linear) or child_name not in QUANTIZED_LAYERS:
+                continue
+            if bits == 8:
+                replacement = Int8Linear(child.in_features, child.out_features,
+                                         bias=child.bias is not None, dtype=dtype)
+            else:
+                replacement = Int4Linear(child.in_features, child.out_features,
+                                         bias=child.bias is not None, group_size=group_size, dtype=dtype)
+            setattr(module, child_name, replacement)
+    return model
+
+
+def prepare_quantized(model):
+    """Finish loading: let quantized layers build their kernel layouts."""
+    for module in model.modules():
+        if isinstance(module, (Int8Linear, Int4Linear)):
+            module.prepare()
+    return model
@@ -0,0 +1,319 @@
+"""
+Deadlines and circuit breakers for API calls.
+
+Without these, a hung embedding or chat request blocks `rag_chain.invoke` for
+as long as the HTTP read timeout allows, and every new question piles another
+blocked thread behind a provider that is down.
+
+- A deadline bounds one whole question. It is split across the pipeline
+  stages (embed, search, generate); unused time carries over to later stages.
+  The remaining budget is applied to each HTTP request as its timeout.
+- A circuit breaker per endpoint (host) opens after repeated failures, so
+  further requests fail immediately instead of waiting for a timeout. After a
+  cool-down one trial request is let through to see if the endpoint is back.
+  Timeouts that only happened because the deadline shortened the request's
+  timeout don't count as failures.
+
+Both act in ResilientTransport, an httpx transport under the shared HTTP
+clients from utils.api_config, and in `with_deadline`/`staged` for chains.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from langchain_core.runnables import RunnableLambda
+
+
+# Seconds allowed for one question, end to end
+DEFAULT_DEADLINE = float(os.getenv("RAG_DEADLINE", "30"))
+
+# Share of the deadline reserved for each stage, in pipeline order
+STAGE_BUDGETS = {"embed": 0.15, "search": 0.05, "generate": 0.8}
+
+BREAKER_FAILURES = int(os.getenv("RAG_BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("RAG_BREAKER_RESET", "30"))
+
+_deadline = ContextVar("rag_deadline", default=None)
+_stage_expires_at = ContextVar("rag_stage_expires_at", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The per-question deadline ran out."""
+
+
+class CircuitOpenError(httpx.TransportError):
+    """The endpoint's circuit breaker is open; the request was not sent."""
+
+
+class Deadline:
+    """A point in time by which a question must be answered."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self, stage):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(f"Deadline of {self.seconds:.1f}s exceeded before {stage}")
+
+    def stage_budget(self, stage):
+        """
+        Seconds `stage` may use: whatever is left after reserving the shares of
+        the stages that follow it, but never less than its own share.
+        """
+        stages = list(STAGE_BUDGETS)
+        later = stages[stages.index(stage) + 1:] if stage in STAGE_BUDGETS else []
+        reserved = sum(STAGE_BUDGETS[name] for name in later) * self.seconds
+        own = STAGE_BUDGETS.get(stage, 1.0) * self.seconds
+        remaining = self.remaining()
+        return max(remaining - reserved, min(remaining, own))
+
+
+def current_deadline():
+    """The deadline of the question being answered in this context, or None."""
+    return _deadline.get()
+
+
+def current_timeout():
+    """Seconds left for the current stage (or whole question), or None if unbounded."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    stage_expires_at = _stage_expires_at.get()
+    if stage_expires_at is None:
+        return deadline.remaining()
+    return max(0.0, min(stage_expires_at, deadline.expires_at) - time.monotonic())
+
+
+@contextmanager
+def deadline(seconds=DEFAULT_DEADLINE):
+    """
+    Bound everything in the block to `seconds`.
+
+    Nested deadlines never extend an outer one.
+    """
+    outer = _deadline.get()
+    if outer is not None:
+        seconds = min(seconds, outer.remaining())
+    token = _deadline.set(Deadline(seconds))
+    stage_token = _stage_expires_at.set(None)
+    try:
+        yield _deadline.get()
+    finally:
+        _stage_expires_at.reset(stage_token)
+        _deadline.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """
+    Run a pipeline stage within its share of the current deadline.
+
+    Raises DeadlineExceeded if no time is left, or if the stage fails after
+    the deadline has run out (whatever error the client library raised).
+    """
+    current = _deadline.get()
+    if current is None:
+        yield
+        return
+
+    current.check(name)
+    token = _stage_expires_at.set(time.monotonic() + current.stage_budget(name))
+    try:
+        yield
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        if current.remaining() <= 0:
+            raise DeadlineExceeded(f"Deadline of {current.seconds:.1f}s exceeded during {name}") from e
+        raise
+    finally:
+        _stage_expires_at.reset(token)
+
+
+def with_deadline(runnable, seconds=DEFAULT_DEADLINE):
+    """Wrap a runnable so each invocation runs under its own deadline."""
+    def run(inputs, config):
+        with deadline(seconds):
+            return runnable.invoke(inputs, config)
+
+    async def arun(inputs, config):
+        with deadline(seconds):
+            return await runnable.ainvoke(inputs, config)
+
+    return RunnableLambda(run, afunc=arun)
+
+
+def staged(name, runnable):
+    """Wrap a runnable so it runs as pipeline stage `name` (see `stage`)."""
+    def run(inputs, config):
+        with stage(name):
+            return runnable.invoke(inputs, config)
+
+    async def arun(inputs, config):
+        with stage(name):
+            return await runnable.ainvoke(inputs, config)
+
+    return RunnableLambda(run, afunc=arun)
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures; open ->
+    half-open after `reset_timeout` seconds, when one trial request is let
+    through. The trial's outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """Whether a request may be sent now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release(self):
+        """Give back a trial slot whose request ended without an outcome (e.g. cancelled)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def __repr__(self):
+        return f"CircuitBreaker({self.name!r}, state={self.state!r})"
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Get the process-wide circuit breaker for an endpoint."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def _prepare(request):
+    """
+    Cap the request timeout at the deadline and check the endpoint's breaker.
+
+    Returns:
+        (breaker, whether the deadline shortened the request's own timeouts)
+    """
+    capped = False
+    timeout = current_timeout()
+    if timeout is not None:
+        if timeout <= 0:
+            raise httpx.TimeoutException("Deadline exceeded before request was sent", request=request)
+        limits = request.extensions.get("timeout", {})
+        keys = ("connect", "read", "write", "pool")
+        capped = any(limits.get(key) is None or limits[key] > timeout for key in keys)
+        request.extensions["timeout"] = {key: min(limits.get(key) or timeout, timeout) for key in keys}
+
+    endpoint = request.url.netloc.decode()
+    breaker = get_breaker(endpoint)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {endpoint}; failing fast", request=request)
+    return breaker, capped
+
+
+def _record(breaker, response):
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def _record_error(breaker, error, capped):
+    # Timing out on a deadline-shortened timeout means the question ran out
+    # of budget, not that the endpoint failed; tight deadlines alone must not
+    # open the breaker for a healthy provider
+    if capped and isinstance(error, httpx.TimeoutException):
+        breaker.release()
+    else:
+        breaker.record_failure()
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """Sync httpx transport applying deadlines and per-endpoint circuit breakers."""
+
+    def __init__(self, transport=None):
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        breaker, capped = _prepare(request)
+        try:
+            response = self.transport.handle_request(request)
+        except httpx.TransportError as e:
+            _record_error(breaker, e, capped)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        _record(breaker, response)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncResilientTransport(httpx.AsyncBaseTransport):
+    """Async httpx transport applying deadlines and per-endpoint circuit breakers."""
+
+    def __init__(self, transport=None):
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request):
+        breaker, capped = _prepare(request)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError as e:
+            _record_error(breaker, e, capped)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        _record(breaker, response)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,479 @@
+"""
+Retrieval helpers shared by the RAG scripts.
+
+`AdaptiveRetriever` over-fetches candidates with their relevance scores and
+keeps only as many as the score distribution justifies, instead of always
+returning a fixed `k`.
+
+`HybridRetriever` fuses those vector hits with BM25 keyword hits
+(utils/lexical_index.py) by reciprocal rank fusion, so exact product terms
+are found too. If the query embedding fails or runs out of its time budget,
+it answers from the keyword index alone.
+
+Both take an optional `metadata_filter` (e.g. {"source": "pricing.md"}),
+resolved by the metadata index (utils/metadata_index.py) to the matching
+chunks before searching, so only those are scored. Without a filter, a
+`source_router` (utils/source_router.py) limits vector search to the
+sub-indexes of the sources closest to the query. A `sharded_index`
+(utils/sharded_index.py) searches the vector shards in parallel instead of
+the single FAISS index, with the same results.
+
+Query embedding and index search run as separate deadline stages (see
+utils/resilience.py), so a slow embedding call cannot eat the generation budget.
+
+For many queries at once, `batch_scored_search` embeds them all in one
+request and runs one matrix FAISS search, and `prefetch_query_embeddings`
+embeds a question set up front so a chain answering it concurrently makes
+no per-question embedding calls. `cache_query_embedding` hands a retriever
+a query vector computed elsewhere, such as the FAQ lookup's.
+"""
+from pathlib import Path
+from typing import Any, List, Optional
+
+import httpx
+import numpy as np
+import openai
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from utils.lexical_index import DEFAULT_RRF_K, load_lexical_index, reciprocal_rank_fusion
+from utils.metadata_index import load_metadata_index, search_positions
+from utils.sharded_index import SHARD_WORKERS, SHARDS_DIR, SHARDS_FILE, load_sharded_index
+from utils.source_router import DEFAULT_ROUTE_SOURCES, load_source_router
+from utils.resilience import stage
+
+
+# Embedding failures after which HybridRetriever falls back to keyword search
+# (timeouts include the "embed" stage running out of its deadline share)
+EMBEDDING_ERRORS = (httpx.HTTPError, openai.APIError, TimeoutError)
+
+# Query vectors kept per retriever by cache_query_embedding (long-running chatbots)
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+
+def with_score(doc, score):
+    """Copy a Document with its relevance score added to the metadata."""
+    return Document(page_content=doc.page_content, metadata={**doc.metadata, "score": score})
+
+
+def select_adaptive(results, min_k=1, max_k=5, score_threshold=0.35, max_gap=0.08):
+    """
+    Choose how many results to keep from a scored candidate list.
+
+    The first `min_k` results are always kept. After that, results are added
+    in order until one falls below `score_threshold`, the score drops by more
+    than `max_gap` from the previous result, or `max_k` is reached.
+
+    Args:
+        results: List of (Document, relevance score) pairs, best first
+        min_k: Minimum number of documents to return
+        max_k: Maximum number of documents to return
+        score_threshold: Minimum relevance score (0-1) for optional results
+        max_gap: Largest allowed score drop between consecutive results
+
+    Returns:
+        List of Documents with "score" in their metadata
+    """
+    results = sorted(results, key=lambda pair: pair[1], reverse=True)
+    selected = results[:min_k]
+
+    for doc, score in results[min_k:max_k]:
+        previous_score = selected[-1][1] if selected else score
+        if score < score_threshold or previous_score - score > max_gap:
+            break
+        selected.append((doc, score))
+
+    return [with_score(doc, score) for doc, score in selected]
+
+
+def _relevance_scores(vectorstore, results):
+    """Convert (Document, distance) pairs to (Document, relevance score in 0-1) pairs."""
+    relevance_score_fn = vectorstore._select_relevance_score_fn()
+    return [(doc, relevance_score_fn(distance)) for doc, distance in results]
+
+
+def _query_matrix(vectorstore, embeddings):
+    """Query embeddings as the float32 (n, d) array the FAISS index expects."""
+    import faiss
+
+    vectors = np.array(embeddings, dtype=np.float32)
+    if getattr(vectorstore, "_normalize_L2", False):
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _query_array(vectorstore, embedding):
+    """Query embedding as the float32 (1, d) array the FAISS index expects."""
+    return _query_matrix(vectorstore, [embedding])
+
+
+def _vector_search(vectorstore, query_vector, k, positions=None, router=None, shards=None):
+    """
+    (distances, positions) of the nearest chunks: among `positions` if
+    given, else in the sources `router` picks, else in the whole index.
+    With `shards` (a ShardedIndex), the shards are searched instead of the
+    vector store's index.
+    """
+    if positions is None and router is not None:
+        return router.search(query_vector, k)
+    if shards is not None:
+        return shards.search(query_vector, k, positions)
+    return search_positions(vectorstore.index, query_vector, k, positions)
+
+
+def _batch_vector_search(vectorstore, query_vectors, k, positions=None, router=None, shards=None):
+    """
+    `_vector_search` for an (n, d) query matrix: one FAISS search over the
+    main index, or one search per row through a router or shards.
+    """
+    if (positions is None and router is not None) or shards is not None:
+        rows = [_vector_search(vectorstore, vector[None, :], k, positions, router, shards)
+                for vector in query_vectors]
+        return np.vstack([d for d, _ in rows]), np.vstack([p for _, p in rows])
+    return search_positions(vectorstore.index, query_vectors, k, positions)
+
+
+def _documents(vectorstore, distances, found):
+    """(Document, distance) pairs for one row of FAISS results, skipping -1s."""
+    return [
+        (vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(position)]), float(distance))
+        for position, distance in zip(found, distances) if position != -1
+    ]
+
+
+def _search_subset(vectorstore, embedding, k, positions, router=None, shards=None):
+    """(Document, distance) pairs for the nearest chunks (see `_vector_search`)."""
+    distances, found = _vector_search(vectorstore, _query_array(vectorstore, embedding), k, positions, router,
+                                      shards)
+    return _documents(vectorstore, distances[0], found[0])
+
+
+def filter_positions(metadata_index, metadata_filter):
+    """FAISS positions allowed by a metadata filter, or None without one."""
+    if not metadata_filter:
+        return None
+    if metadata_index is None:
+        raise ValueError("A metadata filter needs the metadata index; rerun code/02_create_vectorstore.py")
+    return metadata_index.select(metadata_filter)
+
+
+def scored_search(vectorstore, query, k, positions=None, router=None, shards=None, embedding=None):
+    """
+    Top-`k` (Document, relevance score) pairs, embedding and searching as
+    separate "embed" and "search" stages.
+
+    Args:
+        positions: Only search the chunks at these FAISS positions
+        router: SourceRouter to search only the closest sources' sub-indexes
+        shards: ShardedIndex to search in parallel instead of the main index
+        embedding: Query embedding, if already computed
+    """
+    if not hasattr(vectorstore, "similarity_search_with_score_by_vector"):
+        return vectorstore.similarity_search_with_relevance_scores(query, k=k)
+
+    if embedding is None:
+        with stage("embed"):
+            embedding = vectorstore.embeddings.embed_query(query)
+    with stage("search"):
+        if positions is None and router is None and shards is None:
+            results = vectorstore.similarity_search_with_score_by_vector(embedding, k=k)
+        else:
+            results = _search_subset(vectorstore, embedding, k, positions, router, shards)
+    return _relevance_scores(vectorstore, results)
+
+
+async def ascored_search(vectorstore, query, k, positions=None, router=None, shards=None, embedding=None):
+    """Async version of `scored_search`."""
+    if not hasattr(vectorstore, "asimilarity_search_with_score_by_vector"):
+        return await vectorstore.asimilarity_search_with_relevance_scores(query, k=k)
+
+    if embedding is None:
+        with stage("embed"):
+            embedding = await vectorstore.embeddings.aembed_query(query)
+    with stage("search"):
+        if positions is None and router is None and shards is None:
+            results = await vectorstore.asimilarity_search_with_score_by_vector(embedding, k=k)
+        else:
+            results = _search_subset(vectorstore, embedding, k, positions, router, shards)
+    return _relevance_scores(vectorstore, results)
+
+
+def embed_queries(vectorstore, queries):
+    """Embed many queries in one request (`embed_documents`), as one "embed" stage."""
+    with stage("embed"):
+        return vectorstore.embeddings.embed_documents(list(queries))
+
+
+def batch_scored_search(vectorstore, queries, k, positions=None, router=None, shards=None):
+    """
+    `scored_search` for many queries: one embedding request for all of them
+    and one matrix FAISS search.
+
+    Returns:
+        One list of (Document, relevance score) pairs per query, in order
+    """
+    queries = list(queries)
+    if not queries:
+        return []
+    if not hasattr(vectorstore, "index_to_docstore_id"):
+        return [scored_search(vectorstore, query, k) for query in queries]
+
+    embeddings = embed_queries(vectorstore, queries)
+    with stage("search"):
+        distances, found = _batch_vector_search(vectorstore, _query_matrix(vectorstore, embeddings), k,
+                                                positions, router, shards)
+        results = [_documents(vectorstore, row_distances, row_found)
+                   for row_distances, row_found in zip(distances, found)]
+    return [_relevance_scores(vectorstore, row) for row in results]
+
+
+def prefetch_query_embeddings(retriever, queries):
+    """
+    Embed a question set in one request and cache the vectors on an
+    AdaptiveRetriever or HybridRetriever, so answering the questions (e.g.
+    concurrently through a chain) makes no further embedding calls.
+
+    Returns:
+        Number of questions embedded (0 for other retrievers or on failure,
+        in which case each question is embedded when it is asked)
+    """
+    if not hasattr(retriever, "query_embeddings"):
+        return 0
+    queries = [query for query in dict.fromkeys(queries) if query not in (retriever.query_embeddings or {})]
+    if not queries:
+        return 0
+    try:
+        embeddings = embed_queries(retriever.vectorstore, queries)
+    except EMBEDDING_ERRORS:
+        return 0
+    retriever.query_embeddings = {**(retriever.query_embeddings or {}), **dict(zip(queries, embeddings))}
+    return len(queries)
+
+
+def cache_query_embedding(retriever, query, embedding, max_size=QUERY_EMBEDDING_CACHE_SIZE):
+    """
+    Cache one query vector computed elsewhere (e.g. by the FAQ lookup) on an
+    AdaptiveRetriever or HybridRetriever, so retrieving for `query` does not
+    embed it again. Beyond `max_size` entries the oldest are dropped.
+
+    Returns:
+        Whether the retriever takes cached embeddings
+    """
+    if not hasattr(retriever, "query_embeddings"):
+        return False
+    cached = {**(retriever.query_embeddings or {}), query: embedding}
+    if len(cached) > max_size:
+        cached = dict(list(cached.items())[-max_size:])
+    retriever.query_embeddings = cached
+    return True
+
+
+class AdaptiveRetriever(BaseRetriever):
+    """
+    Retriever that picks `k` per query from the similarity score distribution.
+
+    Easy questions with one clearly relevant chunk send less context to the
+    LLM; broad questions with many similarly relevant chunks get up to `max_k`.
+    """
+
+    vectorstore: VectorStore
+    fetch_k: int = 10
+    min_k: int = 1
+    max_k: int = 5
+    score_threshold: float = 0.35
+    max_gap: float = 0.08
+    metadata_index: Any = None
+    metadata_filter: Optional[dict] = None
+    source_router: Any = None
+    sharded_index: Any = None
+    query_embeddings: Optional[dict] = None
+
+    def _select(self, results):
+        return select_adaptive(
+            results,
+            min_k=self.min_k,
+            max_k=self.max_k,
+            score_threshold=self.score_threshold,
+            max_gap=self.max_gap,
+        )
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        positions = filter_positions(self.metadata_index, self.metadata_filter)
+        results = scored_search(self.vectorstore, query, k=max(self.fetch_k, self.max_k), positions=positions,
+                                router=self.source_router, shards=self.sharded_index,
+                                embedding=(self.query_embeddings or {}).get(query))
+        return self._select(results)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        positions = filter_positions(self.metadata_index, self.metadata_filter)
+        results = await ascored_search(self.vectorstore, query, k=max(self.fetch_k, self.max_k),
+                                       positions=positions, router=self.source_router,
+                                       shards=self.sharded_index,
+                                       embedding=(self.query_embeddings or {}).get(query))
+        return self._select(results)
+
+
+def _distances(vectorstore, query_vector, positions):
+    """FAISS distances (or inner products) from the query to the vectors at `positions`."""
+    import faiss
+
+    vectors = vectorstore.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+    if vectorstore.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return vectors @ query_vector[0]
+    return ((vectors - query_vector) ** 2).sum(axis=1)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing FAISS and BM25 rankings with reciprocal rank fusion.
+
+    The top `k` fused chunks are returned in fused order, keeping every
+    keyword hit (exact terms whose embeddings may be far from the query) and
+    the first `min_k`. Vector-only hits are pruned by relevance score as in
+    AdaptiveRetriever: none below `score_threshold` or after a drop of more
+    than `max_gap`. Each keeps its vector relevance score
+    in `metadata["score"]` (computed for keyword-only hits too), so the
+    confidence guard works as with AdaptiveRetriever, plus the fused score in
+    `metadata["rrf_score"]`. Keyword-only fallback results are unscored, and
+    the top `k` are returned.
+    """
+
+    vectorstore: VectorStore
+    lexical_index: Any
+    fetch_k: int = 20
+    k: int = 5
+    min_k: int = 1
+    score_threshold: float = 0.35
+    max_gap: float = 0.08
+    rrf_k: int = DEFAULT_RRF_K
+    metadata_index: Any = None
+    metadata_filter: Optional[dict] = None
+    source_router: Any = None
+    sharded_index: Any = None
+    query_embeddings: Optional[dict] = None
+
+    def _fuse(self, query, embedding):
+        allowed = filter_positions(self.metadata_index, self.metadata_filter)
+        keyword_hits = [position for position, _ in
+                        self.lexical_index.search(query, k=self.fetch_k, positions=allowed)]
+        docstore, ids = self.vectorstore.docstore, self.vectorstore.index_to_docstore_id
+
+        if embedding is None:
+            return [docstore.search(ids[position]) for position in keyword_hits[:self.k]]
+
+        with stage("search"):
+            query_vector = _query_array(self.vectorstore, embedding)
+            distances, positions = _vector_search(self.vectorstore, query_vector, self.fetch_k, allowed,
+                                                  self.source_router, self.sharded_index)
+            found = {int(p): float(d) for p, d in zip(positions[0], distances[0]) if p != -1}
+            fused = reciprocal_rank_fusion([list(found), keyword_hits], k=self.rrf_k)[:self.k]
+
+            missing = [position for position, _ in fused if position not in found]
+            if missing:
+                found.update(zip(missing, map(float, _distances(self.vectorstore, query_vector, missing))))
+
+        return self._select(fused, found, set(keyword_hits))
+
+    def _select(self, fused, found, keyword_hits):
+        """
+        Keep fused results in RRF order. Keyword hits always stay, however
+        far their embeddings are from the query; vector-only hits stop at the
+        first one below `score_threshold` or more than `max_gap` under the
+        previous vector-only hit (they arrive in vector score order).
+        """
+        relevance_score_fn = self.vectorstore._select_relevance_score_fn()
+        docstore, ids = self.vectorstore.docstore, self.vectorstore.index_to_docstore_id
+        selected = []
+        previous_score, vector_only_done = None, False
+        for rank, (position, rrf_score) in enumerate(fused):
+            score = relevance_score_fn(found[position])
+            if position not in keyword_hits:
+                if rank >= self.min_k and (vector_only_done or score < self.score_threshold or (
+                        previous_score is not None and previous_score - score > self.max_gap)):
+                    vector_only_done = True
+                    continue
+                previous_score = score
+            doc = docstore.search(ids[position])
+            selected.append(with_score(Document(page_content=doc.page_content,
+                                                metadata={**doc.metadata, "rrf_score": rrf_score}), score))
+        return selected
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = (self.query_embeddings or {}).get(query)
+        if embedding is None:
+            try:
+                with stage("embed"):
+                    embedding = self.vectorstore.embeddings.embed_query(query)
+            except EMBEDDING_ERRORS:
+                embedding = None
+        return self._fuse(query, embedding)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = (self.query_embeddings or {}).get(query)
+        if embedding is None:
+            try:
+                with stage("embed"):
+                    embedding = await self.vectorstore.embeddings.aembed_query(query)
+            except EMBEDDING_ERRORS:
+                embedding = None
+        return self._fuse(query, embedding)
+
+
+def build_retriever(vectorstore, folder_path="vectorstore", max_k=5, fetch_k=10, metadata_filter=None,
+                    route_sources=DEFAULT_ROUTE_SOURCES, shard_workers=SHARD_WORKERS):
+    """
+    HybridRetriever if a BM25 index was saved with the vector store, else
+    AdaptiveRetriever.
+
+    Args:
+        vectorstore: Loaded FAISS vector store
+        folder_path: Directory it was loaded from
+        max_k: Most chunks returned per query
+        fetch_k: Candidates fetched per ranking
+        metadata_filter: Optional filter, e.g. {"source": "pricing.md"}
+            (see utils/metadata_index.py)
+        route_sources: Search only this many of the sources closest to the
+            query (0 for all; needs the sub-indexes from step 2)
+        shard_workers: How to search the shards written by
+            code/02c_shard_vectorstore.py, if any: "threads", "processes"
+            (one worker process per shard) or "off" to use the main index.
+            Source routing searches the per-source sub-indexes instead, so
+            the shards are not loaded when it applies (no metadata filter).
+    """
+    options = {}
+    if metadata_filter:
+        options = {"metadata_index": load_metadata_index(Path(folder_path), vectorstore),
+                   "metadata_filter": metadata_filter}
+        filter_positions(options["metadata_index"], metadata_filter)  # fail early without an index
+    if route_sources:
+        router = load_source_router(Path(folder_path), vectorstore, n_sources=route_sources)
+        if router is not None:
+            options["source_router"] = router
+
+    if "source_router" in options and not metadata_filter:
+        if shard_workers != "off" and (Path(folder_path) / SHARDS_DIR / SHARDS_FILE).exists():
+            print(f"[WARNING] Source routing is on (RAG_ROUTE_SOURCES={route_sources}), so the vector "
+                  "shards are not used; set RAG_SHARD_WORKERS=off or RAG_ROUTE_SOURCES=0")
+    else:
+        shards = load_sharded_index(Path(folder_path), vectorstore, workers=shard_workers)
+        if shards is not None:
+            options["sharded_index"] = shards
+
+    lexical_index = load_lexical_index(Path(folder_path), vectorstore)
+    if lexical_index is not None:
+        return HybridRetriever(vectorstore=vectorstore, lexical_index=lexical_index, k=max_k, fetch_k=fetch_k,
+                               **options)
+    return AdaptiveRetriever(vectorstore=vectorstore, max_k=max_k, fetch_k=fetch_k, **options)
@@ -0,0 +1,412 @@
+"""
+Latency-aware routing across several OpenAI-compatible endpoints.
+
+The router sits underneath the shared HTTP clients from utils.api_config as an
+httpx transport, so OpenAIEmbeddings and ChatOpenAI use it without knowing
+about it. For every API request it:
+
+1. Ranks endpoints by rolling median latency, healthy ones first (health is
+   the error rate over recent outcomes; failures expire after a minute, so
+   an endpoint demoted by a transient outage is tried again)
+2. Sends the request to the fastest endpoint, rewriting URL, API key and
+   model name for that provider
+3. Optionally sends a hedged duplicate to the next endpoint if the first has
+   not answered within its p95 latency, and returns whichever answers first
+   (the abandoned request still counts as a latency sample, so a degraded
+   endpoint loses its rank)
+4. Fails over to the next endpoint on connection errors, 429s and 5xx
+
+Endpoints are configured with RAG_ENDPOINTS (a JSON list of objects with
+name, base_url, api_key and provider), or automatically when both
+OPENROUTER_API_KEY and OPENAI_API_KEY are set. Hedging is enabled with
+RAG_HEDGE=1.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Status codes that mean "try another endpoint"
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class Endpoint:
+    """
+    One OpenAI-compatible endpoint and its rolling latency/error stats.
+
+    Args:
+        window: Latency samples kept
+        error_window: Request outcomes kept for the error rate
+        outcome_ttl: Seconds an outcome counts towards the error rate. An
+            unhealthy endpoint gets no traffic, so without expiry a transient
+            outage would demote it for good; once its failures expire it is
+            healthy again and gets measured.
+    """
+
+    def __init__(self, name, base_url, api_key, provider="openai", window=100, error_window=20,
+                 outcome_ttl=60.0):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.provider = provider
+        self.outcome_ttl = outcome_ttl
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=error_window)
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        """Record the outcome of one request."""
+        with self._lock:
+            if ok:
+                self.latencies.append(latency)
+            self.outcomes.append((time.monotonic(), ok))
+
+    def record_latency(self, latency):
+        """Record a latency sample without an outcome (e.g. a hedged request abandoned after `latency`)."""
+        with self._lock:
+            self.latencies.append(latency)
+
+    def recent_outcomes(self):
+        """Outcomes (True for success) recorded within the last `outcome_ttl` seconds."""
+        cutoff = time.monotonic() - self.outcome_ttl
+        with self._lock:
+            return [ok for recorded, ok in self.outcomes if recorded >= cutoff]
+
+    def percentile(self, q):
+        """Latency percentile (0-100) over the rolling window, or None."""
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def error_rate(self):
+        outcomes = self.recent_outcomes()
+        if not outcomes:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def healthy(self, max_error_rate=0.5, min_samples=5):
+        outcomes = self.recent_outcomes()
+        return len(outcomes) < min_samples or outcomes.count(False) / len(outcomes) <= max_error_rate
+
+    def model_name(self, model):
+        """Map a model name to this provider's naming (OpenRouter uses "openai/" prefixes)."""
+        if self.provider == "openrouter":
+            return model if "/" in model else f"openai/{model}"
+        if model.startswith("openai/"):
+            return model[len("openai/"):]
+        return model
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "error_rate": self.error_rate(),
+            "healthy": self.healthy(),
+        }
+
+    def __repr__(self):
+        return f"Endpoint({self.name!r}, {self.base_url!r})"
+
+
+class ProviderRouter:
+    """
+    Picks endpoints by rolling latency and health.
+
+    Args:
+        endpoints: List of Endpoint objects
+        hedge: Send a duplicate request to the runner-up after a p95 delay
+        min_hedge_delay: Lower bound (seconds) on the hedge delay
+        explore_rate: Fraction of requests sent to a random healthy endpoint,
+            so a recovered endpoint gets fresh latency samples
+        base_urls: Other API base URLs whose requests should be routed (the
+            endpoints' own base URLs always are)
+    """
+
+    def __init__(self, endpoints, hedge=False, min_hedge_delay=0.2, explore_rate=0.05, base_urls=()):
+        if not endpoints:
+            raise ValueError("ProviderRouter needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.hosts = {
+            httpx.URL(url).netloc.decode()
+            for url in [endpoint.base_url for endpoint in self.endpoints] + list(base_urls)
+        }
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.explore_rate = explore_rate
+
+    def ranked(self):
+        """Endpoints in the order they should be tried."""
+        def expected_latency(endpoint):
+            # Endpoints without samples go first so they get measured
+            return endpoint.percentile(50) or 0.0
+
+        healthy = sorted((e for e in self.endpoints if e.healthy()), key=expected_latency)
+        unhealthy = sorted((e for e in self.endpoints if not e.healthy()), key=expected_latency)
+
+        if len(healthy) > 1 and random.random() < self.explore_rate:
+            explored = random.choice(healthy[1:])
+            healthy.remove(explored)
+            healthy.insert(0, explored)
+
+        return healthy + unhealthy
+
+    def hedge_delay(self, endpoint):
+        """How long to wait for `endpoint` before sending a hedged duplicate."""
+        p95 = endpoint.percentile(95)
+        return max(self.min_hedge_delay, p95 if p95 is not None else 0.0)
+
+    def routes(self, request):
+        """Whether `request` goes to a routed API (others, e.g. a local model server, pass through)."""
+        return request.url.netloc.decode() in self.hosts
+
+    def stats(self):
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+
+def build_request(request, endpoint):
+    """Re-target an API request at `endpoint`."""
+    # OpenAI-compatible paths look like <base>/v1/<operation>; keep <operation>
+    operation = request.url.path.partition("/v1/")[2] or request.url.path.lstrip("/")
+    url = httpx.URL(f"{endpoint.base_url}/{operation}", params=request.url.params)
+
+    headers = dict(request.headers)
+    headers.pop("host", None)
+    headers["authorization"] = f"Bearer {endpoint.api_key}"
+
+    content = request.content
+    if content and "json" in headers.get("content-type", ""):
+        body = json.loads(content)
+        if "model" in body:
+            body["model"] = endpoint.model_name(body["model"])
+            content = json.dumps(body).encode()
+    headers["content-length"] = str(len(content))
+
+    return httpx.Request(request.method, url, headers=headers, content=content,
+                         extensions=request.extensions)
+
+
+def _is_retryable(response):
+    return response.status_code in RETRYABLE_STATUS_CODES
+
+
+class RoutingTransport(httpx.BaseTransport):
+    """Sync httpx transport that routes requests through a ProviderRouter."""
+
+    def __init__(self, router, transport=None):
+        self.router = router
+        self.transport = transport or httpx.HTTPTransport()
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="rag-hedge")
+
+    def _send(self, request, endpoint):
+        start = time.perf_counter()
+        try:
+            response = self.transport.handle_request(build_request(request, endpoint))
+        except httpx.TransportError:
+            endpoint.record(time.perf_counter() - start, ok=False)
+            raise
+        endpoint.record(time.perf_counter() - start, ok=not _is_retryable(response))
+        return response
+
+    def _send_hedged(self, request, primary, backup, tried):
+        # Copy the caller's context so the request deadline applies in the pool threads
+        futures = {self._executor.submit(contextvars.copy_context().run, self._send, request, primary)}
+        done, _ = wait(futures, timeout=self.router.hedge_delay(primary))
+        if not done:
+            tried.add(backup)
+            futures.add(self._executor.submit(contextvars.copy_context().run, self._send, request, backup))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            responses = []
+            for future in done:
+                try:
+                    responses.append(future.result())
+                except httpx.TransportError as e:
+                    error = e
+            usable = [r for r in responses if not _is_retryable(r)]
+            if usable or (responses and not pending):
+                winner = (usable or responses)[0]
+                for response in responses:
+                    if response is not winner:
+                        response.close()
+                # Close whichever duplicate finishes later
+                for future in pending:
+                    future.add_done_callback(
+                        lambda f: f.exception() is None and f.result().close()
+                    )
+                return winner
+            for response in responses:
+                response.close()
+        raise error
+
+    def handle_request(self, request):
+        if not self.router.routes(request):
+            return self.transport.handle_request(request)
+        endpoints = self.router.ranked()
+        error = None
+        tried = set()
+
+        for i, endpoint in enumerate(endpoints):
+            # A runner-up that already raced as the hedge is not tried again
+            if endpoint in tried:
+                continue
+            tried.add(endpoint)
+            try:
+                if self.router.hedge and i == 0 and len(endpoints) > 1:
+                    response = self._send_hedged(request, endpoint, endpoints[1], tried)
+                else:
+                    response = self._send(request, endpoint)
+            except httpx.TransportError as e:
+                error = e
+                continue
+            if _is_retryable(response) and any(other not in tried for other in endpoints[i + 1:]):
+                response.close()
+                continue
+            return response
+
+        raise error
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.transport.close()
+
+
+class AsyncRoutingTransport(httpx.AsyncBaseTransport):
+    """Async httpx transport that routes requests through a ProviderRouter."""
+
+    def __init__(self, router, transport=None):
+        self.router = router
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def _send(self, request, endpoint):
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(build_request(request, endpoint))
+        except httpx.TransportError:
+            endpoint.record(time.perf_counter() - start, ok=False)
+            raise
+        except asyncio.CancelledError:
+            # Cancelled as the losing hedge: it took at least this long, and
+            # without the sample a degraded endpoint would keep its old latency
+            endpoint.record_latency(time.perf_counter() - start)
+            raise
+        endpoint.record(time.perf_counter() - start, ok=not _is_retryable(response))
+        return response
+
+    async def _send_hedged(self, request, primary, backup, tried):
+        tasks = {asyncio.ensure_future(self._send(request, primary))}
+        done, _ = await asyncio.wait(tasks, timeout=self.router.hedge_delay(primary))
+        if not done:
+            tried.add(backup)
+            tasks.add(asyncio.ensure_future(self._send(request, backup)))
+
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            responses = []
+            for task in done:
+                try:
+                    responses.append(task.result())
+                except httpx.TransportError as e:
+                    error = e
+            usable = [r for r in responses if not _is_retryable(r)]
+            if usable or (responses and not pending):
+                winner = (usable or responses)[0]
+                for response in responses:
+                    if response is not winner:
+                        await response.aclose()
+                for task in pending:
+                    task.cancel()
+                return winner
+            for response in responses:
+                await response.aclose()
+        raise error
+
+    async def handle_async_request(self, request):
+        if not self.router.routes(request):
+            return await self.transport.handle_async_request(request)
+        endpoints = self.router.ranked()
+        error = None
+        tried = set()
+
+        for i, endpoint in enumerate(endpoints):
+            # A runner-up that already raced as the hedge is not tried again
+            if endpoint in tried:
+                continue
+            tried.add(endpoint)
+            try:
+                if self.router.hedge and i == 0 and len(endpoints) > 1:
+                    response = await self._send_hedged(request, endpoint, endpoints[1], tried)
+                else:
+                    response = await self._send(request, endpoint)
+            except httpx.TransportError as e:
+                error = e
+                continue
+            if _is_retryable(response) and any(other not in tried for other in endpoints[i + 1:]):
+                await response.aclose()
+                continue
+            return response
+
+        raise error
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def load_endpoints():
+    """
+    Load routing endpoints from the environment.
+
+    Returns:
+        List of Endpoint objects (empty if routing isn't configured)
+    """
+    configured = os.getenv("RAG_ENDPOINTS")
+    if configured:
+        return [
+            Endpoint(
+                name=item.get("name", item["base_url"]),
+                base_url=item["base_url"],
+                api_key=item.get("api_key", "not-needed"),
+                provider=item.get("provider", "openai"),
+            )
+            for item in json.loads(configured)
+        ]
+
+    from utils.key_pool import env_key
+
+    endpoints = []
+    if env_key("OPENROUTER_API_KEY"):
+        endpoints.append(Endpoint("openrouter", OPENROUTER_BASE_URL,
+                                  env_key("OPENROUTER_API_KEY"), "openrouter"))
+    if env_key("OPENAI_API_KEY"):
+        endpoints.append(Endpoint("openai", os.getenv("OPENAI_BASE_URL") or OPENAI_BASE_URL,
+                                  env_key("OPENAI_API_KEY"), "openai"))
+    return endpoints if len(endpoints) > 1 else []
+
+
+def load_router():
+    """Build a ProviderRouter from the environment, or None if fewer than two endpoints."""
+    endpoints = load_endpoints()
+    if len(endpoints) < 2:
+        return None
+    # Requests to the providers' default URLs are routed too
+    base_urls = [OPENROUTER_BASE_URL, os.getenv("OPENAI_BASE_URL") or OPENAI_BASE_URL]
+    return ProviderRouter(endpoints, hedge=os.getenv("RAG_HEDGE", "0") == "1", base_urls=base_urls)
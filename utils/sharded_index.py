@@ -0,0 +1,382 @@
+"""
+Sharded vector search with parallel scatter-gather.
+
+One FAISS index in one process stops scaling at some corpus size. Here the
+vectors are split into N shards (flat FAISS indexes whose ids are positions
+in the main index, so results map back to the vector store's documents).
+A query is sent to every shard at once and the per-shard top-k lists are
+merged, so results are the same as searching the unsharded index.
+
+Shards are searched either by a thread pool in this process (FAISS releases
+the GIL while searching) or by worker processes, one per shard, reached over
+multiprocessing.connection: each request is a pickled tuple such as
+("search", query_vector, k, positions) answered with (distances, positions).
+The same protocol works over TCP, so a worker can also run on another
+machine:
+
+    RAG_SHARD_AUTHKEY=<secret> python -m utils.sharded_index vectorstore/shards/shard-000.faiss \
+        --host 0.0.0.0 --port 9000
+
+and be reached with ShardClient((host, 9000), authkey=b"<secret>"). Messages
+are pickles, so anyone holding the key can run code in the worker: keep the
+key secret and the port on a trusted network. Workers started by
+`start_shard_workers` get a fresh random key per run.
+
+Build shards with code/02c_shard_vectorstore.py; the retrievers use them
+when vectorstore/shards/ exists (RAG_SHARD_WORKERS=processes for worker
+processes).
+"""
+import ipaddress
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+import numpy as np
+
+
+SHARDS_DIR = "shards"
+SHARDS_FILE = "shards.json"
+
+# How saved shards are searched: "threads" (in this process), "processes"
+# (one worker process per shard) or "off" (ignore them, use the main index)
+SHARD_WORKERS = os.getenv("RAG_SHARD_WORKERS", "threads")
+SHARD_WORKER_MODES = ("threads", "processes", "off")
+
+# Environment variable holding the shared secret a worker checks on connect
+AUTHKEY_ENV = "RAG_SHARD_AUTHKEY"
+
+
+def merge_top_k(distances, positions, k, metric_type):
+    """
+    Merge per-shard search results into one top-`k` list.
+
+    Args:
+        distances / positions: Lists of 1-D arrays, one pair per shard
+        metric_type: FAISS metric (inner product: larger is closer; L2: smaller)
+
+    Returns:
+        (distances, positions) arrays of shape (1, k); -1 marks missing results
+    """
+    import faiss
+
+    distances, positions = np.concatenate(distances), np.concatenate(positions)
+    valid = positions != -1
+    distances, positions = distances[valid], positions[valid]
+    order = np.argsort(-distances if metric_type == faiss.METRIC_INNER_PRODUCT else distances,
+                       kind="stable")[:k]
+    padding = k - len(order)
+    return (
+        np.pad(distances[order], (0, padding), constant_values=np.inf)[None, :],
+        np.pad(positions[order], (0, padding), constant_values=-1)[None, :],
+    )
+
+
+def search_shard(index, query_vector, k, positions=None):
+    """Search one shard (an IndexIDMap2), optionally only the given positions (ids)."""
+    import faiss
+
+    if index.ntotal == 0:
+        shape = (len(query_vector), 1)
+        return np.full(shape, np.inf, dtype=np.float32), np.full(shape, -1, dtype=np.int64)
+    if positions is None:
+        return index.search(query_vector, min(k, index.ntotal))
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0:
+        return np.full((1, 1), np.inf, dtype=np.float32), np.full((1, 1), -1, dtype=np.int64)
+    params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(positions))
+    return index.search(query_vector, min(k, index.ntotal), params=params)
+
+
+# ---------------------------------------------------------------------------
+# Building
+# ---------------------------------------------------------------------------
+
+def build_shards(vectorstore, folder_path, num_shards, max_workers=None):
+    """
+    Split a LangChain FAISS store's vectors into `num_shards` contiguous
+    shards, building and writing them in parallel threads. There are at
+    most as many shards as vectors, so none is empty.
+
+    Returns:
+        Path of the shards directory
+    """
+    import faiss
+
+    main = vectorstore.index
+    if num_shards < 1:
+        raise ValueError(f"num_shards must be at least 1, got {num_shards}")
+    if num_shards > max(main.ntotal, 1):
+        print(f"[WARNING] {num_shards} shards requested for {main.ntotal} vectors; building {max(main.ntotal, 1)}")
+        num_shards = max(main.ntotal, 1)
+    path = Path(folder_path) / SHARDS_DIR
+    path.mkdir(parents=True, exist_ok=True)
+    for old in path.glob("shard-*.faiss"):
+        old.unlink()
+    bounds = np.linspace(0, main.ntotal, num_shards + 1).astype(np.int64)
+    files = [f"shard-{i:03d}.faiss" for i in range(num_shards)]
+
+    def build(i):
+        positions = np.arange(bounds[i], bounds[i + 1], dtype=np.int64)
+        index = faiss.IndexIDMap2(faiss.IndexFlat(main.d, main.metric_type))
+        if len(positions):
+            index.add_with_ids(main.reconstruct_n(int(bounds[i]), len(positions)), positions)
+        faiss.write_index(index, str(path / files[i]))
+
+    with ThreadPoolExecutor(max_workers=max_workers or num_shards) as pool:
+        list(pool.map(build, range(num_shards)))
+
+    doc_ids = [vectorstore.index_to_docstore_id[i] for i in range(main.ntotal)]
+    with open(path / SHARDS_FILE, "w") as f:
+        json.dump({"doc_ids": doc_ids, "files": files, "metric_type": int(main.metric_type)}, f)
+    return path
+
+
+# ---------------------------------------------------------------------------
+# Worker processes
+# ---------------------------------------------------------------------------
+
+def _handle(connection, index):
+    with connection:
+        while True:
+            try:
+                request = connection.recv()
+            except EOFError:
+                return
+            command = request[0]
+            if command == "search":
+                _, query_vector, k, positions = request
+                connection.send(search_shard(index, query_vector, k, positions))
+            elif command == "info":
+                connection.send({"ntotal": index.ntotal, "pid": os.getpid()})
+            elif command == "close":
+                return
+            else:
+                connection.send(ValueError(f"Unknown command {command!r}"))
+
+
+def serve_shard(shard_file, authkey, address=("127.0.0.1", 0)):
+    """
+    Serve one shard file over multiprocessing.connection until killed.
+
+    Each client connection is handled by its own thread, one request at a
+    time. Prints "[OK] Serving <file> on <host>:<port>" once listening.
+    """
+    import faiss
+
+    index = faiss.read_index(str(shard_file))
+    with Listener(address, authkey=authkey) as listener:
+        host, port = listener.address
+        print(f"[OK] Serving {Path(shard_file).name} on {host}:{port}", flush=True)
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, EOFError, OSError):
+                # Wrong key or dropped handshake: refuse this client, keep serving
+                continue
+            threading.Thread(target=_handle, args=(connection, index), daemon=True).start()
+
+
+class ShardClient:
+    """Connection to a shard worker; safe to share between threads."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self._connection = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+
+    def _request(self, *request):
+        with self._lock:
+            self._connection.send(request)
+            response = self._connection.recv()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def search(self, query_vector, k, positions=None):
+        return self._request("search", np.asarray(query_vector, dtype=np.float32), k, positions)
+
+    def info(self):
+        return self._request("info")
+
+    def close(self):
+        with self._lock:
+            try:
+                self._connection.send(("close",))
+            except OSError:
+                pass
+            self._connection.close()
+
+
+class LocalShard:
+    """A shard index searched in this process."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def search(self, query_vector, k, positions=None):
+        return search_shard(self.index, query_vector, k, positions)
+
+    def close(self):
+        pass
+
+
+def start_shard_workers(folder_path):
+    """
+    Start one local worker process per shard (`python -m utils.sharded_index`),
+    all sharing a random auth key passed through their environment.
+
+    Returns:
+        (list of ShardClient, list of subprocess.Popen)
+    """
+    manifest = _read_manifest(folder_path)
+    authkey = secrets.token_bytes(32).hex()
+    env = {**os.environ, AUTHKEY_ENV: authkey}
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "utils.sharded_index", str((Path(folder_path) / SHARDS_DIR / name).resolve()),
+             "--stop-with-parent"],
+            cwd=Path(__file__).parent.parent, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        for name in manifest["files"]
+    ]
+    clients = []
+    try:
+        for process in processes:
+            line = process.stdout.readline()
+            if not line.startswith("[OK]"):
+                raise RuntimeError(f"Shard worker failed to start (exit code {process.wait()})")
+            host, port = line.split()[-1].rsplit(":", 1)
+            clients.append(ShardClient((host, int(port)), authkey.encode()))
+    except Exception:
+        for process in processes:
+            process.kill()
+        raise
+    return clients, processes
+
+
+# ---------------------------------------------------------------------------
+# Scatter-gather
+# ---------------------------------------------------------------------------
+
+class ShardedIndex:
+    """
+    Searches all shards in parallel and merges their top-k results.
+
+    Args:
+        shards: LocalShard or ShardClient objects
+        doc_ids: Docstore id of the chunk at each main-index position
+        metric_type: FAISS metric of the shards
+        processes: Worker processes to stop on `close`
+    """
+
+    def __init__(self, shards, doc_ids, metric_type, processes=()):
+        self.shards = list(shards)
+        self.doc_ids = list(doc_ids)
+        self.metric_type = metric_type
+        self.processes = list(processes)
+        self._pool = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="shard")
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def search(self, query_vector, k, positions=None):
+        """
+        Top-`k` over all shards, optionally only among `positions`.
+
+        Returns:
+            (distances, positions) arrays of shape (1, k) as from a FAISS
+            search of the unsharded index; -1 marks missing results
+        """
+        futures = [self._pool.submit(shard.search, query_vector, k, positions) for shard in self.shards]
+        results = [future.result() for future in futures]
+        return merge_top_k([d[0] for d, _ in results], [p[0] for _, p in results], k, self.metric_type)
+
+    def matches(self, vectorstore):
+        """Whether the shards were built from `vectorstore` (same chunks in the same order)."""
+        return len(self.doc_ids) == len(vectorstore.index_to_docstore_id) and all(
+            vectorstore.index_to_docstore_id[i] == doc_id for i, doc_id in enumerate(self.doc_ids)
+        )
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        for process in self.processes:
+            process.terminate()
+            process.wait()
+        self._pool.shutdown(wait=False)
+
+
+def _read_manifest(folder_path):
+    with open(Path(folder_path) / SHARDS_DIR / SHARDS_FILE, "r") as f:
+        return json.load(f)
+
+
+def load_sharded_index(folder_path, vectorstore=None, workers=SHARD_WORKERS):
+    """
+    Load the shards saved next to a vector store.
+
+    Args:
+        workers: "threads" to search them in this process, "processes" to
+            start one worker process per shard, or "off"
+
+    Returns:
+        ShardedIndex, or None if there are no shards, `workers` is "off" or
+        (given `vectorstore`) they are out of date
+    """
+    import faiss
+
+    if workers not in SHARD_WORKER_MODES:
+        raise ValueError(f"Unknown shard workers {workers!r} (expected one of {', '.join(SHARD_WORKER_MODES)})")
+    if workers == "off" or not (Path(folder_path) / SHARDS_DIR / SHARDS_FILE).exists():
+        return None
+    manifest = _read_manifest(folder_path)
+    if vectorstore is not None and (
+        len(manifest["doc_ids"]) != len(vectorstore.index_to_docstore_id)
+        or any(vectorstore.index_to_docstore_id[i] != doc_id for i, doc_id in enumerate(manifest["doc_ids"]))
+    ):
+        print(f"[WARNING] {SHARDS_DIR}/{SHARDS_FILE} does not match the vector store; "
+              "rerun code/02c_shard_vectorstore.py to rebuild the shards")
+        return None
+
+    if workers == "processes":
+        shards, processes = start_shard_workers(folder_path)
+    else:
+        shards, processes = [LocalShard(faiss.read_index(str(Path(folder_path) / SHARDS_DIR / name)))
+                             for name in manifest["files"]], []
+    return ShardedIndex(shards, manifest["doc_ids"], manifest["metric_type"], processes)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve one vector store shard to ShardClient connections")
+    parser.add_argument("shard_file", help="Shard index, e.g. vectorstore/shards/shard-000.faiss")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (0 picks a free one)")
+    parser.add_argument("--stop-with-parent", action="store_true",
+                        help="Exit when stdin closes (used by start_shard_workers)")
+    args = parser.parse_args()
+
+    authkey = os.getenv(AUTHKEY_ENV)
+    if not authkey:
+        if not ipaddress.ip_address(socket.gethostbyname(args.host)).is_loopback:
+            parser.error(f"set {AUTHKEY_ENV} to serve on a non-loopback host")
+        authkey = secrets.token_bytes(32).hex()
+        print(f"[INFO] {AUTHKEY_ENV} not set; clients must use auth key {authkey}", file=sys.stderr, flush=True)
+
+    if args.stop_with_parent:
+        def wait_for_parent():
+            sys.stdin.read()
+            os._exit(0)
+
+        threading.Thread(target=wait_for_parent, daemon=True).start()
+
+    serve_shard(args.shard_file, authkey.encode(), (args.host, args.port))
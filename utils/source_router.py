@@ -0,0 +1,169 @@
+"""
+Query routing to per-source sub-indexes.
+
+The knowledge base is split by topic into files (pricing.md, faq.md,
+troubleshooting.md, ...). Next to the main FAISS index, the build keeps one
+sub-index per source file plus the centroid (mean embedding) of each
+source. A query is compared with the centroids first, and only the
+sub-indexes of the closest few sources are searched, so search cost follows
+the relevant categories instead of the whole corpus.
+
+Sub-index ids are positions in the main index, so results map back to the
+vector store's documents. Routing trades some recall for speed: a question
+whose best chunk sits in an unexpected file can miss it (HybridRetriever's
+keyword search still covers every source).
+
+The sub-indexes hold a second copy of the vectors (code/02_create_vectorstore.py
+writes them to vectorstore/sources/). Routing is off unless RAG_ROUTE_SOURCES
+is set to the number of sources to search.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from utils.sharded_index import merge_top_k
+
+
+ROUTER_DIR = "sources"
+ROUTER_FILE = "router.json"
+
+# Sources searched per query (0 searches the whole index without routing)
+DEFAULT_ROUTE_SOURCES = int(os.getenv("RAG_ROUTE_SOURCES", "0"))
+
+# Sources searched per query by a router built without a count
+DEFAULT_N_SOURCES = 2
+
+
+def _unit(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class SourceRouter:
+    """
+    Per-source FAISS sub-indexes with source centroids.
+
+    Args:
+        doc_ids: Docstore id of the chunk at each main-index position
+        sources: Source names, in the order of `centroids` and `indexes`
+        centroids: (sources, d) array of unit-length mean embeddings
+        indexes: FAISS IndexIDMap2 per source, ids = main-index positions
+        metric_type: FAISS metric of the main index
+        n_sources: Sources searched per query
+    """
+
+    def __init__(self, doc_ids, sources, centroids, indexes, metric_type, n_sources=DEFAULT_N_SOURCES):
+        self.doc_ids = list(doc_ids)
+        self.sources = list(sources)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.indexes = list(indexes)
+        self.metric_type = metric_type
+        self.n_sources = n_sources
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, metadata_index):
+        """
+        Split a LangChain FAISS store by source.
+
+        Args:
+            vectorstore: FAISS vector store
+            metadata_index: utils.metadata_index.MetadataIndex of the same store
+        """
+        import faiss
+
+        main = vectorstore.index
+        sources, centroids, indexes = [], [], []
+        for source, _ in metadata_index.values("source"):
+            positions = metadata_index.select({"source": source})
+            vectors = main.reconstruct_batch(positions)
+            index = faiss.IndexIDMap2(faiss.IndexFlat(main.d, main.metric_type))
+            index.add_with_ids(vectors, positions)
+            sources.append(source)
+            centroids.append(_unit(vectors.mean(axis=0)))
+            indexes.append(index)
+        return cls(metadata_index.doc_ids, sources, np.stack(centroids), indexes, main.metric_type)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def route(self, query_vector, n):
+        """
+        The `n` sources whose centroids are closest to the query.
+
+        Returns:
+            List of (source index, cosine similarity), best first
+        """
+        similarities = self.centroids @ _unit(np.asarray(query_vector, dtype=np.float32).reshape(-1))
+        best = np.argsort(-similarities)[:n]
+        return [(int(i), float(similarities[i])) for i in best]
+
+    def search(self, query_vector, k, n_sources=None):
+        """
+        Search the sub-indexes of the `n_sources` (default `self.n_sources`)
+        closest sources and merge.
+
+        Returns:
+            (distances, positions) arrays of shape (1, k) as from a FAISS
+            search of the main index; -1 marks missing results
+        """
+        distances, positions = [], []
+        for i, _ in self.route(query_vector, n_sources or self.n_sources):
+            found_distances, found = self.indexes[i].search(query_vector, min(k, self.indexes[i].ntotal))
+            distances.append(found_distances[0])
+            positions.append(found[0])
+        return merge_top_k(distances, positions, k, self.metric_type)
+
+    def matches(self, vectorstore):
+        """Whether this router was built from `vectorstore` (same chunks in the same order)."""
+        return len(self.doc_ids) == len(vectorstore.index_to_docstore_id) and all(
+            vectorstore.index_to_docstore_id[i] == doc_id for i, doc_id in enumerate(self.doc_ids)
+        )
+
+    def save(self, folder_path):
+        """Write the sub-indexes and centroids to `<folder_path>/sources/`."""
+        import faiss
+
+        path = Path(folder_path) / ROUTER_DIR
+        path.mkdir(parents=True, exist_ok=True)
+        files = []
+        for i, index in enumerate(self.indexes):
+            files.append(f"{i:03d}.faiss")
+            faiss.write_index(index, str(path / files[-1]))
+        np.save(path / "centroids.npy", self.centroids)
+        with open(path / ROUTER_FILE, "w") as f:
+            json.dump({"doc_ids": self.doc_ids, "sources": self.sources, "files": files,
+                       "metric_type": int(self.metric_type)}, f)
+        return path
+
+    @classmethod
+    def load(cls, folder_path, n_sources=DEFAULT_N_SOURCES):
+        import faiss
+
+        path = Path(folder_path) / ROUTER_DIR
+        with open(path / ROUTER_FILE, "r") as f:
+            data = json.load(f)
+        indexes = [faiss.read_index(str(path / name)) for name in data["files"]]
+        return cls(data["doc_ids"], data["sources"], np.load(path / "centroids.npy"), indexes,
+                   data["metric_type"], n_sources=n_sources)
+
+
+def load_source_router(folder_path, vectorstore=None, n_sources=DEFAULT_N_SOURCES):
+    """
+    Load the per-source sub-indexes saved next to a vector store.
+
+    Args:
+        n_sources: Sources searched per query
+
+    Returns:
+        SourceRouter, or None if there are none or (given `vectorstore`)
+        they are out of date
+    """
+    if not (Path(folder_path) / ROUTER_DIR / ROUTER_FILE).exists():
+        return None
+    router = SourceRouter.load(folder_path, n_sources=n_sources)
+    if vectorstore is not None and not router.matches(vectorstore):
+        print(f"[WARNING] {ROUTER_DIR}/{ROUTER_FILE} does not match the vector store; "
+              "rerun code/02_create_vectorstore.py to rebuild it")
+        return None
+    return router
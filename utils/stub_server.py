@@ -0,0 +1,341 @@
+"""
+Offline OpenAI-compatible stub API for tests and benchmarks.
+
+Serves `/v1/embeddings`, `/v1/chat/completions` (plain and streamed) and
+`/v1/models` with deterministic responses, so the whole pipeline runs
+without an API key or network:
+
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8100/v1 python code/02_create_vectorstore.py
+
+- Embeddings are feature-hashed: every word and word pair maps to a fixed
+  pseudo-random vector (seeded by its hash), and a text's embedding is their
+  normalized sum. Texts that share words are similar, so retrieval, the FAQ
+  index and confidence thresholds behave plausibly. Dimensions match the
+  requested model (1536 for text-embedding-3-small).
+- Chat completions answer from the prompt: by default the first sentences
+  of its "Context:" section, or an echo of the last message.
+- Latency, jitter, error rate and per-key rate limits (with 429s and
+  x-ratelimit-* headers) are configurable. A fixed seed makes runs
+  reproducible.
+
+Start it with code/11_stub_api_server.py, or in-process with `start_stub_server`.
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.key_pool import KeyState
+from utils.local_embeddings import hash_embedding
+
+
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+DEFAULT_DIMENSIONS = 1536
+
+RESPONSE_MODES = ("context", "echo")
+
+# Sentences of the prompt's context quoted by the "context" response mode
+CONTEXT_SENTENCES = 3
+
+
+def count_tokens(text):
+    """Approximate token count (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def context_answer(prompt):
+    """First sentences of the prompt's context section (the whole prompt if it has none)."""
+    match = re.search(r"Context:\s*(.*?)(?:\n\s*Question:|\Z)", prompt, re.S)
+    context = (match.group(1) if match else prompt).strip()
+    sentences = re.split(r"(?<=[.!?])\s+", " ".join(context.split()))
+    answer = " ".join(sentences[:CONTEXT_SENTENCES])
+    return answer or "I don't know."
+
+
+def message_text(content):
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+
+class StubAPI:
+    """
+    Behaviour of the stub server.
+
+    Args:
+        latency: Base delay per request, seconds
+        jitter: Standard deviation added to the delay, seconds
+        error_rate: Fraction of requests answered with a 500 error
+        rpm / tpm: Per-key requests / tokens per minute before 429s (None for no limit)
+        response_mode: "context" or "echo"
+        seed: Seed for jitter and injected errors
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rpm=None, tpm=None,
+                 response_mode="context", seed=0):
+        if response_mode not in RESPONSE_MODES:
+            raise ValueError(f"response_mode must be one of {RESPONSE_MODES}")
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.tpm = tpm
+        self.response_mode = response_mode
+        self.random = random.Random(seed)
+        self.keys = {}
+        self.counts = {"requests": 0, "errors": 0, "rate_limited": 0, "embeddings": 0, "completions": 0}
+        self._lock = threading.Lock()
+
+    def admit(self, api_key, tokens):
+        """
+        Decide how to answer a request: sleeps for the simulated latency.
+
+        Returns:
+            (status or None to proceed, rate-limit headers)
+        """
+        with self._lock:
+            self.counts["requests"] += 1
+            delay = max(0.0, self.latency + (self.random.gauss(0, self.jitter) if self.jitter else 0.0))
+            fail = self.error_rate > 0 and self.random.random() < self.error_rate
+            status, headers = None, {}
+            if self.rpm or self.tpm:
+                now = time.monotonic()
+                state = self.keys.setdefault(
+                    api_key, KeyState(api_key, rpm=self.rpm or 10**9, tpm=self.tpm or 10**12)
+                )
+                if state.headroom(tokens, now) < 0:
+                    status = 429
+                    self.counts["rate_limited"] += 1
+                else:
+                    state.record(tokens, now)
+                headers = {
+                    "x-ratelimit-limit-requests": str(state.rpm),
+                    "x-ratelimit-remaining-requests": str(max(0, state.rpm - len(state.events))),
+                    "x-ratelimit-limit-tokens": str(state.tpm),
+                    "x-ratelimit-remaining-tokens": str(max(0, state.tpm - state.tokens_in_window)),
+                }
+                if status == 429:
+                    oldest = state.events[0][0] if state.events else now
+                    headers["retry-after"] = f"{max(0.1, 60 - (now - oldest)):.1f}"
+            if status is None and fail:
+                status = 500
+                self.counts["errors"] += 1
+        if delay:
+            time.sleep(delay)
+        return status, headers
+
+    def embed(self, body):
+        inputs = body.get("input")
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        model = body.get("model", "")
+        dimensions = body.get("dimensions") or EMBEDDING_DIMENSIONS.get(model.split("/")[-1], DEFAULT_DIMENSIONS)
+        base64_format = body.get("encoding_format") == "base64"
+
+        data, tokens = [], 0
+        for index, text in enumerate(inputs or []):
+            if not isinstance(text, str):
+                # Pre-tokenized input: embed the token ids as words
+                text = " ".join(str(token) for token in text)
+            tokens += count_tokens(text)
+            vector = hash_embedding(text, dimensions)
+            embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode() if base64_format else vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        with self._lock:
+            self.counts["embeddings"] += len(data)
+        return {"object": "list", "data": data, "model": model,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    def complete(self, body):
+        """Reply text and usage for a chat completion request."""
+        messages = body.get("messages") or []
+        prompt = "\n".join(message_text(message.get("content")) for message in messages)
+        last = message_text(messages[-1].get("content")) if messages else ""
+        text = last if self.response_mode == "echo" else context_answer(last)
+
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        finish_reason = "stop"
+        if max_tokens and count_tokens(text) > max_tokens:
+            text = text[:max_tokens * 4]
+            finish_reason = "length"
+        with self._lock:
+            self.counts["completions"] += 1
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        return text, finish_reason, usage
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def estimate_request_tokens(path, body):
+    if path.endswith("/embeddings"):
+        inputs = body.get("input")
+        texts = [inputs] if isinstance(inputs, str) else inputs or []
+        return sum(count_tokens(text) if isinstance(text, str) else len(text) for text in texts)
+    messages = body.get("messages") or []
+    prompt = sum(count_tokens(message_text(message.get("content"))) for message in messages)
+    return prompt + (body.get("max_tokens") or 256)
+
+
+def make_handler(api):
+    """Build the request handler class serving `api`."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up (a deadline or a hedged duplicate won)
+                self.close_connection = True
+
+        def _send_error(self, status, message, error_type="invalid_request_error", headers=None):
+            self._send_json(status, {"error": {"message": message, "type": error_type}}, headers)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                models = list(EMBEDDING_DIMENSIONS) + ["stub-chat"]
+                self._send_json(200, {"object": "list", "data": [
+                    {"id": model, "object": "model", "created": 0, "owned_by": "stub"} for model in models
+                ]})
+            elif self.path.rstrip("/") == "/health":
+                self._send_json(200, {"status": "ok", **api.stats()})
+            else:
+                self._send_error(404, f"Unknown path {self.path}")
+
+        def do_POST(self):
+            path = self.path.rstrip("/")
+            if not (path.endswith("/embeddings") or path.endswith("/chat/completions")):
+                self._send_error(404, f"Unknown path {self.path}")
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except ValueError as e:
+                self._send_error(400, f"Invalid JSON: {e}")
+                return
+
+            api_key = (self.headers.get("Authorization") or "").removeprefix("Bearer ").strip()
+            status, headers = api.admit(api_key, estimate_request_tokens(path, body))
+            if status == 429:
+                self._send_error(429, "Rate limit reached (stub)", "rate_limit_exceeded", headers)
+                return
+            if status == 500:
+                self._send_error(500, "Injected server error (stub)", "server_error", headers)
+                return
+
+            if path.endswith("/embeddings"):
+                self._send_json(200, api.embed(body), headers)
+                return
+
+            text, finish_reason, usage = api.complete(body)
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            model = body.get("model", "stub-chat")
+            if body.get("stream"):
+                self._stream(completion_id, model, text, finish_reason, usage, headers,
+                             include_usage=(body.get("stream_options") or {}).get("include_usage"))
+                return
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            }, headers)
+
+        def _stream(self, completion_id, model, text, finish_reason, usage, headers, include_usage):
+            def event(choices, extra=None):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk",
+                         "created": int(time.time()), "model": model, "choices": choices, **(extra or {})}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+                for piece in re.findall(r"\S+\s*", text):
+                    event([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+                event([{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+                if include_usage:
+                    event([], {"usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            self.close_connection = True
+
+    return Handler
+
+
+def offline_environment(base_url, api_key="stub"):
+    """
+    Environment variables pointing the pipeline at a stub server.
+
+    Provider keys that would take precedence are set empty rather than
+    removed, so load_dotenv() in the scripts does not bring them back.
+    """
+    return {
+        "OPENAI_API_KEY": api_key,
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEYS": "",
+        "OPENROUTER_API_KEY": "",
+        "OPENROUTER_API_KEYS": "",
+        "RAG_ENDPOINTS": "",
+        "LLM_BASE_URL": "",
+        "LLM_PROVIDER": "",
+    }
+
+
+def start_stub_server(api=None, host="127.0.0.1", port=0):
+    """
+    Start the stub server in a background thread.
+
+    Returns:
+        (server, base URL ending in /v1); call server.shutdown() to stop it
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(api or StubAPI()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-api-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def serve(api=None, host="127.0.0.1", port=8100):
+    """Run the stub server until interrupted."""
+    server = ThreadingHTTPServer((host, port), make_handler(api or StubAPI()))
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()